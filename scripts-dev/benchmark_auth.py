@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the overhead of authenticating a request with a macaroon access
+token, with and without the in-memory cache of access tokens. The database is
+replaced by a store that answers immediately, so this only measures the work
+done in Auth.
+
+Usage: PYTHONPATH=. python scripts-dev/benchmark_auth.py [-n 10000]
+"""
+
+from synapse.api.auth import Auth
+from synapse.util.caches.descriptors import Cache
+
+from twisted.internet import defer
+
+import argparse
+import pymacaroons
+import timeit
+
+
+USER_ID = "@user:test"
+SECRET = "secret"
+
+
+class FakeStore(object):
+    def __init__(self):
+        self.access_token_user_info = Cache("access_token_user_info")
+
+    def get_app_service_by_token(self, token):
+        return defer.succeed(None)
+
+    def get_user_by_access_token(self, token):
+        return defer.succeed({"name": USER_ID, "token_id": 1})
+
+    def insert_client_ip(self, **kwargs):
+        pass
+
+
+class FakeConfig(object):
+    macaroon_secret_key = SECRET
+
+
+class FakeHomeServer(object):
+    config = FakeConfig()
+
+    def __init__(self):
+        self.store = FakeStore()
+
+    def get_datastore(self):
+        return self.store
+
+    def get_state_handler(self):
+        return None
+
+    def get_ip_from_request(self, request):
+        return "127.0.0.1"
+
+
+class FakeHeaders(object):
+    def getRawHeaders(self, name, default=None):
+        return ["bench"]
+
+
+class FakeRequest(object):
+    requestHeaders = FakeHeaders()
+
+    def __init__(self, token):
+        self.args = {"access_token": [token]}
+
+
+def make_token():
+    macaroon = pymacaroons.Macaroon(location="test", identifier="key", key=SECRET)
+    macaroon.add_first_party_caveat("gen = 1")
+    macaroon.add_first_party_caveat("user_id = %s" % (USER_ID,))
+    macaroon.add_first_party_caveat("type = access")
+    macaroon.add_first_party_caveat("time < 9999999999999")
+    return macaroon.serialize()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=10000)
+    args = parser.parse_args()
+
+    hs = FakeHomeServer()
+    auth = Auth(hs)
+    request = FakeRequest(make_token())
+
+    def uncached():
+        hs.store.access_token_user_info.invalidate_all()
+        auth.get_user_by_req(request)
+
+    def cached():
+        auth.get_user_by_req(request)
+
+    uncached_time = timeit.timeit(uncached, number=args.n)
+    cached_time = timeit.timeit(cached, number=args.n)
+
+    print "get_user_by_req uncached: %6.2fus cached: %6.2fus (%.0f%% saved)" % (
+        uncached_time * 1e6 / args.n,
+        cached_time * 1e6 / args.n,
+        100 * (1 - cached_time / uncached_time),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares waking every listener in a room for every event in a burst
+against coalescing the burst into a single wake up at the end of the tick.
+
+Usage: PYTHONPATH=. python scripts-dev/benchmark_notifier.py [-n 500]
+"""
+
+from synapse.notifier import Notifier, _NotifierUserStream
+from synapse.types import StreamToken
+
+import argparse
+import time
+
+
+ROOM_ID = "!room:test"
+
+
+class Clock(object):
+    """Runs call_later callbacks only when told to, so that each call to
+    tick() stands in for the end of a reactor tick.
+    """
+    def __init__(self):
+        self.pending = []
+
+    def time_msec(self):
+        return int(time.time() * 1000)
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        self.pending.append((callback, args, kwargs))
+
+    def looping_call(self, f, msec):
+        pass
+
+    def tick(self):
+        pending = self.pending
+        self.pending = []
+        for callback, args, kwargs in pending:
+            callback(*args, **kwargs)
+
+
+class Distributor(object):
+    def observe(self, name, observer):
+        pass
+
+
+class HomeServer(object):
+    def __init__(self, clock):
+        self.clock = clock
+
+    def get_clock(self):
+        return self.clock
+
+    def get_distributor(self):
+        return Distributor()
+
+    def get_event_sources(self):
+        return None
+
+    def get_datastore(self):
+        return None
+
+
+def make_notifier(num_streams, wakeups):
+    clock = Clock()
+    notifier = Notifier(HomeServer(clock))
+
+    # Keep a listener on every stream, re-registering after each wake up as a
+    # client would.
+    def listen(_, user_stream):
+        wakeups[0] += 1
+        d = user_stream.notify_deferred.observe()
+        d.addCallback(listen, user_stream)
+
+    for i in xrange(num_streams):
+        user_stream = _NotifierUserStream(
+            user_id="@user%d:test" % (i,),
+            rooms=[ROOM_ID],
+            current_token=StreamToken("s0", "0", "0", "0", "0"),
+            time_now_ms=clock.time_msec(),
+        )
+        notifier._register_with_keys(user_stream)
+        d = user_stream.notify_deferred.observe()
+        d.addCallback(listen, user_stream)
+
+    return notifier, clock
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=500,
+                        help="The number of listeners in the room")
+    parser.add_argument("-m", type=int, default=20,
+                        help="The number of events in each burst")
+    parser.add_argument("--bursts", type=int, default=20)
+    args = parser.parse_args()
+
+    # Uncoalesced: the reactor ticks between each event.
+    wakeups = [0]
+    notifier, clock = make_notifier(args.n, wakeups)
+    start = time.time()
+    for stream_id in xrange(1, args.bursts * args.m + 1):
+        notifier.on_new_event("room_key", stream_id, rooms=[ROOM_ID])
+        clock.tick()
+    uncoalesced = time.time() - start
+    uncoalesced_wakeups = wakeups[0]
+
+    # Coalesced: each burst arrives within a single tick.
+    wakeups = [0]
+    notifier, clock = make_notifier(args.n, wakeups)
+    start = time.time()
+    stream_id = 0
+    for _ in xrange(args.bursts):
+        for _ in xrange(args.m):
+            stream_id += 1
+            notifier.on_new_event("room_key", stream_id, rooms=[ROOM_ID])
+        clock.tick()
+    coalesced = time.time() - start
+
+    print "%d bursts of %d events to %d listeners:" % (
+        args.bursts, args.m, args.n,
+    )
+    print "  uncoalesced: %.3fs, %d wake ups" % (
+        uncoalesced, uncoalesced_wakeups,
+    )
+    print "  coalesced:   %.3fs, %d wake ups" % (coalesced, wakeups[0])
+
+
+if __name__ == "__main__":
+    main()
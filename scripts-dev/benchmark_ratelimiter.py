@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the cost of a ratelimit check with many active senders, each
+sending at random intervals over a simulated period.
+
+Usage: PYTHONPATH=. python scripts-dev/benchmark_ratelimiter.py [-n 100000]
+"""
+
+from synapse.api.ratelimiting import Ratelimiter
+
+import argparse
+import random
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100000,
+                        help="The number of active senders")
+    parser.add_argument("-m", type=int, default=1000000,
+                        help="The number of messages to send")
+    parser.add_argument("--duration", type=float, default=600.,
+                        help="The simulated time in seconds to send over")
+    parser.add_argument("--rate", type=float, default=0.2)
+    parser.add_argument("--burst", type=float, default=10.)
+    args = parser.parse_args()
+
+    senders = ["@user%d:test" % (i,) for i in range(args.n)]
+    sends = sorted(
+        (random.uniform(0, args.duration), random.choice(senders))
+        for _ in xrange(args.m)
+    )
+
+    limiter = Ratelimiter()
+    allowed_count = 0
+    max_entries = 0
+
+    start = time.time()
+    for i, (now, sender) in enumerate(sends):
+        allowed, _ = limiter.send_message(sender, now, args.rate, args.burst)
+        if allowed:
+            allowed_count += 1
+        if i % 1000 == 0:
+            max_entries = max(max_entries, len(limiter.message_counts))
+    elapsed = time.time() - start
+
+    print "%d senders, %d messages: %.2fus/check, %d allowed" % (
+        args.n, args.m, elapsed * 1e6 / args.m, allowed_count,
+    )
+    print "Tracking at most %d senders, %d at the end" % (
+        max_entries, len(limiter.message_counts),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the sqlite FTS event_search table with the separate SearchIndex,
+both for the time spent indexing in the persisting transaction and for query
+latency.
+
+Usage: PYTHONPATH=. python scripts-dev/benchmark_search_index.py [-n 100000]
+"""
+
+from synapse.storage.search_index import SearchIndex
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import timeit
+
+
+WORDS = [
+    "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(6))
+    for _ in range(5000)
+]
+
+ROOMS = ["!room%d:test" % (i,) for i in range(100)]
+
+
+def make_docs(n):
+    docs = []
+    for i in range(n):
+        # Skew towards common words, like real messages.
+        body = u" ".join(
+            WORDS[int(random.paretovariate(1)) % len(WORDS)] for _ in range(12)
+        )
+        docs.append((
+            "$%d:test" % (i,), random.choice(ROOMS), "content.body", body,
+            1000 * i, i,
+        ))
+    return docs
+
+
+def bench_fts(path, docs, queries, room_ids):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE VIRTUAL TABLE event_search"
+        " USING fts4 (event_id, room_id, key, value)"
+    )
+    conn.execute("CREATE TABLE events (event_id TEXT, stream_ordering BIGINT)")
+
+    # Each event is indexed in the transaction that persists it.
+    start = time.time()
+    for event_id, room_id, key, value, ts, stream in docs:
+        with conn:
+            conn.execute(
+                "INSERT INTO events VALUES (?, ?)", (event_id, stream)
+            )
+            conn.execute(
+                "INSERT INTO event_search (event_id, room_id, key, value)"
+                " VALUES (?,?,?,?)",
+                (event_id, room_id, key, value)
+            )
+    write_time = time.time() - start
+
+    sql = (
+        "SELECT event_id FROM event_search WHERE value MATCH ?"
+        " AND room_id IN (%s) LIMIT 10"
+    ) % (",".join("?" for _ in room_ids),)
+
+    def query():
+        for q in queries:
+            conn.execute(sql, [q + "*"] + room_ids).fetchall()
+
+    query_time = timeit.timeit(query, number=1) / len(queries)
+    conn.close()
+
+    return write_time, None, query_time
+
+
+def bench_index(path, docs, queries, room_ids):
+    conn = sqlite3.connect(os.path.join(os.path.dirname(path), "events.db"))
+    conn.execute("CREATE TABLE events (event_id TEXT, stream_ordering BIGINT)")
+
+    index = SearchIndex(path)
+    index.start()
+
+    # The persisting transaction only has to queue the event for the writer.
+    start = time.time()
+    for doc in docs:
+        with conn:
+            conn.execute("INSERT INTO events VALUES (?, ?)", (doc[0], doc[5]))
+        index.add_documents([doc])
+    write_time = time.time() - start
+
+    index.flush()
+    indexed_time = time.time() - start
+
+    def query():
+        for q in queries:
+            index.search(room_ids, q, ["content.body"], 10, "rank")
+
+    query_time = timeit.timeit(query, number=1) / len(queries)
+    index.stop()
+    conn.close()
+
+    return write_time, indexed_time, query_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100000)
+    parser.add_argument("-q", type=int, default=200)
+    args = parser.parse_args()
+
+    docs = make_docs(args.n)
+    queries = [random.choice(WORDS) for _ in range(args.q)]
+    room_ids = ROOMS[:20]
+
+    for name, bench in (("fts", bench_fts), ("search_index", bench_index)):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            write_time, indexed_time, query_time = bench(
+                os.path.join(tmpdir, "search.db"), docs, queries, room_ids,
+            )
+        finally:
+            shutil.rmtree(tmpdir)
+
+        print "%-13s persist: %6.1fus/event%s query: %7.2fms" % (
+            name,
+            write_time * 1e6 / args.n,
+            (
+                " (indexed after %.1fs)" % (indexed_time,)
+                if indexed_time is not None else ""
+            ),
+            query_time * 1e3,
+        )
+
+
+if __name__ == "__main__":
+    main()
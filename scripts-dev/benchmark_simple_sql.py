@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the per-call overhead of the _simple_* storage helpers, with and
+without the cache of generated SQL, against a cursor that does no work.
+
+Usage: PYTHONPATH=. python scripts-dev/benchmark_simple_sql.py [-n 100000]
+"""
+
+from synapse.storage import _base
+from synapse.storage._base import LoggingTransaction, SQLBaseStore
+
+import argparse
+import timeit
+
+
+class NullCursor(object):
+    """A cursor that accepts any statement and returns a single row"""
+    rowcount = 1
+
+    def execute(self, sql, args=()):
+        pass
+
+    def executemany(self, sql, args):
+        pass
+
+    def fetchone(self):
+        return (1, 2, 3)
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class PostgresLikeEngine(object):
+    """Converts param styles like the postgres engine does, without needing
+    psycopg2 to be installed"""
+    def convert_param_style(self, sql):
+        return sql.replace("?", "%s")
+
+
+def make_benchmarks(txn):
+    keyvalues = {"user_id": "@user:test", "room_id": "!room:test"}
+    retcols = ("event_id", "stream_ordering", "topological_ordering")
+    values = {
+        "user_id": "@user:test", "room_id": "!room:test", "event_id": "$e",
+        "data": "{}",
+    }
+
+    return [
+        ("_simple_select_one_txn", lambda: SQLBaseStore._simple_select_one_txn(
+            txn, "receipts_linearized", keyvalues, retcols,
+        )),
+        ("_simple_select_onecol_txn", lambda: SQLBaseStore._simple_select_onecol_txn(
+            txn, "receipts_linearized", keyvalues, "event_id",
+        )),
+        ("_simple_insert_txn", lambda: SQLBaseStore._simple_insert_txn(
+            txn, "receipts_linearized", values,
+        )),
+        ("_simple_update_one_txn", lambda: SQLBaseStore._simple_update_one_txn(
+            txn, "receipts_linearized", keyvalues, {"event_id": "$e", "data": "{}"},
+        )),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100000)
+    args = parser.parse_args()
+
+    txn = LoggingTransaction(NullCursor(), "bench", PostgresLikeEngine(), [])
+
+    for name, func in make_benchmarks(txn):
+        def uncached():
+            _base._simple_sql_cache.clear()
+            func()
+
+        # Clearing the cache is cheap compared to building the SQL, though it
+        # does mean this slightly overstates the saving.
+        uncached_time = timeit.timeit(uncached, number=args.n)
+        cached_time = timeit.timeit(func, number=args.n)
+
+        print "%-28s uncached: %6.2fus cached: %6.2fus (%.0f%% saved)" % (
+            name,
+            uncached_time * 1e6 / args.n,
+            cached_time * 1e6 / args.n,
+            100 * (1 - cached_time / uncached_time),
+        )
+
+
+if __name__ == "__main__":
+    main()
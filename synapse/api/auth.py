@@ -24,7 +24,6 @@ from synapse.api.constants import EventTypes, Membership, JoinRules
 from synapse.api.errors import AuthError, Codes, SynapseError, EventSizeError
 from synapse.types import Requester, RoomID, UserID, EventID
 from synapse.util.logutils import log_function
-from synapse.util.logcontext import preserve_context_over_fn
 from unpaddedbase64 import decode_base64
 
 import logging
@@ -530,8 +529,7 @@ class Auth(object):
                 default=[""]
             )[0]
             if user and access_token and ip_addr:
-                preserve_context_over_fn(
-                    self.store.insert_client_ip,
+                self.store.insert_client_ip(
                     user=user,
                     access_token=access_token,
                     ip=ip_addr,
@@ -590,12 +588,21 @@ class Auth(object):
         Raises:
             AuthError if no user by that token exists or the token is invalid.
         """
+        cache = self.store.access_token_user_info
+        ret = cache.get((token,), None)
+        if ret is not None:
+            defer.returnValue(ret)
+
+        # If the token is revoked while we're looking it up then the sequence
+        # number will have changed, and we won't cache the stale result.
+        sequence = cache.sequence
         try:
             ret = yield self.get_user_from_macaroon(token)
         except AuthError:
             # TODO(daniel): Remove this fallback when all existing access tokens
             # have been re-issued as macaroons.
             ret = yield self._look_up_user_by_access_token(token)
+        cache.update(sequence, (token,), ret)
         defer.returnValue(ret)
 
     @defer.inlineCallbacks
@@ -12,16 +12,37 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import collections
+import heapq
+import math
+
+
+# The width in seconds of the buckets that entries are pruned in.
+PRUNE_BUCKET_SECONDS = 1.
 
 
 class Ratelimiter(object):
     """
-    Ratelimit message sending by user.
+    Ratelimit actions by key, e.g. message sending by user.
+
+    Each key has a leaky bucket, which fills by one for each action and
+    drains at the action's rate. Once a bucket has drained it is forgotten.
+    To find them without scanning every key, each key is filed in a bucket of
+    the expiry wheel for the second its bucket will have drained in. The
+    wheel's buckets are visited in order as time passes, so checking and
+    pruning are O(1) amortized.
     """
 
     def __init__(self):
-        self.message_counts = collections.OrderedDict()
+        # key -> (action_count, time_start, rate_hz)
+        self.message_counts = {}
+
+        # Expiry wheel: bucket index -> set of keys that may have drained by
+        # the end of that bucket. Keys aren't removed from their old bucket
+        # when they move, so are checked again when the bucket is pruned.
+        self._expiry_buckets = {}
+
+        # Heap of the indices of _expiry_buckets.
+        self._expiry_bucket_heap = []
 
     def send_message(self, user_id, time_now_s, msg_rate_hz, burst_count):
         """Can the user send a message?
@@ -36,29 +57,47 @@ class Ratelimiter(object):
             A pair of a bool indicating if they can send a message now and a
                 time in seconds of when they can next send a message.
         """
+        return self.can_do_action(user_id, time_now_s, msg_rate_hz, burst_count)
+
+    def can_do_action(self, key, time_now_s, rate_hz, burst_count):
+        """Can the entity (e.g. user or IP address) perform the action?
+        Args:
+            key: The key we should use when rate limiting. Can be a user ID
+                (when sending events), an IP address, etc.
+            time_now_s: The time now.
+            rate_hz: The long term number of actions that can be performed in a
+                second.
+            burst_count: How many actions can be performed before being
+                limited.
+        Returns:
+            A pair of a bool indicating if they can do the action now and a
+                time in seconds of when they can next do it.
+        """
         self.prune_message_counts(time_now_s)
-        message_count, time_start, _ignored = self.message_counts.pop(
-            user_id, (0., time_now_s, None),
+        action_count, time_start, _ignored = self.message_counts.get(
+            key, (0., time_now_s, None),
         )
         time_delta = time_now_s - time_start
-        sent_count = message_count - time_delta * msg_rate_hz
-        if sent_count < 0:
+        performed_count = action_count - time_delta * rate_hz
+        if performed_count < 0:
             allowed = True
             time_start = time_now_s
-            message_count = 1.
-        elif sent_count > burst_count - 1.:
+            action_count = 1.
+        elif performed_count > burst_count - 1.:
             allowed = False
         else:
             allowed = True
-            message_count += 1
+            action_count += 1
 
-        self.message_counts[user_id] = (
-            message_count, time_start, msg_rate_hz
-        )
+        self.message_counts[key] = (action_count, time_start, rate_hz)
+
+        if rate_hz > 0:
+            self._add_to_expiry_bucket(
+                key, time_start + action_count / rate_hz
+            )
 
-        if msg_rate_hz > 0:
             time_allowed = (
-                time_start + (message_count - burst_count + 1) / msg_rate_hz
+                time_start + (action_count - burst_count + 1) / rate_hz
             )
             if time_allowed < time_now_s:
                 time_allowed = time_now_s
@@ -67,13 +106,26 @@ class Ratelimiter(object):
 
         return allowed, time_allowed
 
+    def _add_to_expiry_bucket(self, key, expiry_s):
+        index = int(math.ceil(expiry_s / PRUNE_BUCKET_SECONDS))
+        keys = self._expiry_buckets.get(index)
+        if keys is None:
+            keys = self._expiry_buckets[index] = set()
+            heapq.heappush(self._expiry_bucket_heap, index)
+        keys.add(key)
+
     def prune_message_counts(self, time_now_s):
-        for user_id in self.message_counts.keys():
-            message_count, time_start, msg_rate_hz = (
-                self.message_counts[user_id]
-            )
-            time_delta = time_now_s - time_start
-            if message_count - time_delta * msg_rate_hz > 0:
-                break
-            else:
-                del self.message_counts[user_id]
+        """Forget the keys whose buckets have drained by the start of the
+        current wheel bucket.
+        """
+        now_index = int(math.floor(time_now_s / PRUNE_BUCKET_SECONDS))
+        while self._expiry_bucket_heap and self._expiry_bucket_heap[0] <= now_index:
+            index = heapq.heappop(self._expiry_bucket_heap)
+            for key in self._expiry_buckets.pop(index):
+                entry = self.message_counts.get(key)
+                if entry is None:
+                    continue
+                action_count, time_start, rate_hz = entry
+                time_delta = time_now_s - time_start
+                if rate_hz > 0 and action_count - time_delta * rate_hz <= 0:
+                    del self.message_counts[key]
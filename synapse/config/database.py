@@ -45,8 +45,13 @@ class DatabaseConfig(Config):
 
         self.set_databasepath(config.get("database_path"))
 
+        self.search_index_path = config.get("search_index_path")
+        if self.search_index_path:
+            self.search_index_path = self.abspath(self.search_index_path)
+
     def default_config(self, **kwargs):
         database_path = self.abspath("homeserver.db")
+        search_index_path = self.abspath("search_index.db")
         return """\
         # Database configuration
         database:
@@ -59,6 +64,12 @@ class DatabaseConfig(Config):
 
         # Number of events to cache in memory.
         event_cache_size: "10K"
+
+        # If set, message search uses an index kept in this file rather than
+        # a table in the database. This avoids slowing down writes to sqlite
+        # databases. Existing events can be added to the index with the
+        # synapse_reindex_search script.
+        # search_index_path: "%(search_index_path)s"
         """ % locals()
 
     def read_arguments(self, args):
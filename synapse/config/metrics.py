@@ -22,6 +22,7 @@ class MetricsConfig(Config):
         self.report_stats = config.get("report_stats", None)
         self.metrics_port = config.get("metrics_port")
         self.metrics_bind_host = config.get("metrics_bind_host", "127.0.0.1")
+        self.profile_sql_statements = config.get("profile_sql_statements", False)
 
     def default_config(self, report_stats=None, **kwargs):
         suffix = "" if report_stats is None else "report_stats: %(report_stats)s\n"
@@ -30,4 +31,10 @@ class MetricsConfig(Config):
 
         # Enable collection and rendering of performance metrics
         enable_metrics: False
+
+        # Aggregate timings and row counts for each distinct SQL statement.
+        # The most expensive statements are exported as metrics and through
+        # the /admin/sql_statements client API. This has a small overhead on
+        # every database query.
+        profile_sql_statements: False
         """ + suffix) % locals()
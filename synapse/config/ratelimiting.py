@@ -21,6 +21,16 @@ class RatelimitConfig(Config):
         self.rc_messages_per_second = config["rc_messages_per_second"]
         self.rc_message_burst_count = config["rc_message_burst_count"]
 
+        self.rc_joins_per_second = config.get("rc_joins_per_second", 0.1)
+        self.rc_join_burst_count = config.get("rc_join_burst_count", 10.0)
+
+        self.rc_registrations_per_second = config.get(
+            "rc_registrations_per_second", 0.17
+        )
+        self.rc_registration_burst_count = config.get(
+            "rc_registration_burst_count", 3.0
+        )
+
         self.federation_rc_window_size = config["federation_rc_window_size"]
         self.federation_rc_sleep_limit = config["federation_rc_sleep_limit"]
         self.federation_rc_sleep_delay = config["federation_rc_sleep_delay"]
@@ -37,6 +47,20 @@ class RatelimitConfig(Config):
         # Number of message a client can send before being throttled
         rc_message_burst_count: 10.0
 
+        # Number of rooms a client can join per second
+        rc_joins_per_second: 0.1
+
+        # Number of rooms a client can join before being throttled
+        rc_join_burst_count: 10.0
+
+        # Number of accounts that can be registered from an IP address per
+        # second
+        rc_registrations_per_second: 0.17
+
+        # Number of accounts that can be registered from an IP address before
+        # being throttled
+        rc_registration_burst_count: 3.0
+
         # The federation window size in milliseconds
         federation_rc_window_size: 1000
 
@@ -59,6 +59,15 @@ class ContentRepositoryConfig(Config):
         self.thumbnail_requirements = parse_thumbnail_requirements(
             config["thumbnail_sizes"]
         )
+        self.thumbnail_threads = config.get("thumbnail_threads", 2)
+
+        max_remote_media_cache_size = config.get("max_remote_media_cache_size")
+        if max_remote_media_cache_size:
+            self.max_remote_media_cache_size = self.parse_size(
+                max_remote_media_cache_size
+            )
+        else:
+            self.max_remote_media_cache_size = None
 
     def default_config(self, **kwargs):
         media_store = self.default_path("media_store")
@@ -83,6 +92,15 @@ class ContentRepositoryConfig(Config):
         # from a precalcualted list.
         dynamic_thumbnails: false
 
+        # The number of threads used to generate thumbnails. Any more
+        # thumbnails than this are queued until a thread is free.
+        thumbnail_threads: 2
+
+        # The most disk space to use for media and thumbnails downloaded from
+        # other servers. The least recently used media is deleted to keep
+        # within this size. If unset, remote media is kept forever.
+        # max_remote_media_cache_size: "10G"
+
         # List of thumbnail to precalculate when an image is uploaded.
         thumbnail_sizes:
         - width: 32
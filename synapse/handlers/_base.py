@@ -145,6 +145,19 @@ class BaseHandler(object):
                 retry_after_ms=int(1000 * (time_allowed - time_now)),
             )
 
+    def ratelimit_action(self, ratelimiter, key, rate_hz, burst_count):
+        """Raises LimitExceededError if the key has done the action limited by
+        the ratelimiter too often.
+        """
+        time_now = self.clock.time()
+        allowed, time_allowed = ratelimiter.can_do_action(
+            key, time_now, rate_hz=rate_hz, burst_count=burst_count,
+        )
+        if not allowed:
+            raise LimitExceededError(
+                retry_after_ms=int(1000 * (time_allowed - time_now)),
+            )
+
     @defer.inlineCallbacks
     def _create_new_client_event(self, builder):
         latest_ret = yield self.store.get_latest_events_in_room(
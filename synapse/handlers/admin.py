@@ -54,3 +54,8 @@ class AdminHandler(BaseHandler):
         }
 
         defer.returnValue(ret)
+
+    def get_sql_statement_profile(self, limit, order_by):
+        """Returns the most expensive SQL statements, or None if statement
+        profiling isn't enabled."""
+        return self.store.get_statement_profile(limit, order_by=order_by)
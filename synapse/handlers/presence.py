@@ -25,7 +25,10 @@ import synapse.metrics
 
 from ._base import BaseHandler
 
+from collections import OrderedDict, deque
+
 import logging
+import sys
 
 
 logger = logging.getLogger(__name__)
@@ -36,8 +39,20 @@ metrics = synapse.metrics.get_metrics_for(__name__)
 # Don't bother bumping "last active" time if it differs by less than 60 seconds
 LAST_ACTIVE_GRANULARITY = 60 * 1000
 
-# Keep no more than this number of offline serial revisions
-MAX_OFFLINE_SERIALS = 1000
+# How long to collect presence updates for a remote server before sending them
+# to it together in one EDU, in seconds
+REMOTE_PUSH_BATCH_SECONDS = 0.5
+
+
+# Keep no more than this number of presence changes in the change log
+MAX_PRESENCE_CHANGES = 10000
+
+# How often to evict idle users from the presence cache
+PRUNE_USER_CACHEMAP_MS = 5 * 60 * 1000
+
+# Keep no more than this number of users in the presence cache, by evicting
+# the least recently updated remote users if needs be
+MAX_USER_CACHEMAP_SIZE = 100000
 
 
 # TODO(paul): Maybe there's one of these I can steal from somewhere
@@ -146,22 +161,47 @@ class PresenceHandler(BaseHandler):
         self._remote_sendmap = {}
         # map remote users to sets of local users who're interested in them
         self._remote_recvmap = {}
-        # list of (serial, set of(userids)) tuples, ordered by serial, latest
-        # first
-        self._remote_offline_serials = []
-
         # map any user to a UserPresenceCache
         self._user_cachemap = {}
         self._user_cachemap_latest_serial = 0
+        # users not updated since this serial are idle
+        self._user_cachemap_pruned_serial = 0
 
         # map room_ids to the latest presence serial for a member of that
         # room
         self._room_serials = {}
 
+        # (serial, user, frozenset of room_ids) for each change to the
+        # presence cache, oldest first, so that event streams only have to
+        # look at what changed since they last polled.
+        self._presence_changes = deque(maxlen=MAX_PRESENCE_CHANGES)
+        # the serial of the last change to fall off the front of the log
+        self._presence_changes_truncated_serial = 0
+
+        # map remote domains to dicts of user_id to the latest presence state
+        # waiting to be pushed to that domain
+        self._pending_remote_pushes = {}
+        self._remote_push_timer = None
+
         metrics.register_callback(
             "userCachemap:size",
             lambda: len(self._user_cachemap),
         )
+        metrics.register_callback(
+            "userCachemap:bytes",
+            self._user_cachemap_size_bytes,
+        )
+        self._evicted_counter = metrics.register_counter(
+            "userCachemap:evicted",
+        )
+
+        self.clock.looping_call(
+            self._prune_user_cachemap, PRUNE_USER_CACHEMAP_MS
+        )
+        metrics.register_callback(
+            "pending_remote_pushes",
+            lambda: sum(len(p) for p in self._pending_remote_pushes.values()),
+        )
 
     def _get_or_make_usercache(self, user):
         """If the cache entry doesn't exist, initialise a new one."""
@@ -177,6 +217,62 @@ class PresenceHandler(BaseHandler):
         else:
             return UserPresenceCache()
 
+    def _is_watched(self, user):
+        """Whether anyone has asked to be told about the user's presence."""
+        if self.hs.is_mine(user):
+            return bool(
+                self._local_pushmap.get(user.localpart)
+                or self._remote_sendmap.get(user.localpart)
+                or self._remote_sendmap.get(user)
+            )
+        else:
+            return bool(self._remote_recvmap.get(user))
+
+    def _prune_user_cachemap(self):
+        """Evict users from the presence cache who are offline, unwatched and
+        haven't changed since the last prune. Losing them doesn't lose any
+        state: offline is what we assume for users who aren't cached, and
+        local users' presence is persisted in the store.
+
+        If the cache is still too big, the least recently updated unwatched
+        remote users are evicted too, who we will assume are offline until we
+        next hear from their server.
+        """
+        idle_serial = self._user_cachemap_pruned_serial
+        self._user_cachemap_pruned_serial = self._user_cachemap_latest_serial
+
+        to_evict = []
+        remote_candidates = []
+        for user, cache in self._user_cachemap.iteritems():
+            if cache.serial > idle_serial or self._is_watched(user):
+                continue
+            if cache.state["presence"] == PresenceState.OFFLINE:
+                to_evict.append(user)
+            elif not self.hs.is_mine(user):
+                remote_candidates.append((cache.serial, user))
+
+        excess = len(self._user_cachemap) - len(to_evict) - MAX_USER_CACHEMAP_SIZE
+        if excess > 0:
+            remote_candidates.sort()
+            to_evict.extend(user for _, user in remote_candidates[:excess])
+
+        for user in to_evict:
+            del self._user_cachemap[user]
+
+        if to_evict:
+            self._evicted_counter.inc_by(len(to_evict))
+            logger.info(
+                "Evicted %d users from the presence cache, %d remain",
+                len(to_evict), len(self._user_cachemap),
+            )
+
+    def _user_cachemap_size_bytes(self):
+        """Approximate the memory used by the presence cache."""
+        size = sys.getsizeof(self._user_cachemap)
+        for cache in self._user_cachemap.itervalues():
+            size += sys.getsizeof(cache) + sys.getsizeof(cache.state)
+        return size
+
     def registered_user(self, user):
         return self.store.create_presence(user.localpart)
 
@@ -949,25 +1045,9 @@ class PresenceHandler(BaseHandler):
                 users_to_push=observers, room_ids=room_ids
             )
 
-            user_id = user.to_string()
-
             if state["presence"] == PresenceState.OFFLINE:
-                self._remote_offline_serials.insert(
-                    0,
-                    (self._user_cachemap_latest_serial, set([user_id]))
-                )
-                while len(self._remote_offline_serials) > MAX_OFFLINE_SERIALS:
-                    self._remote_offline_serials.pop()  # remove the oldest
-                if user in self._user_cachemap:
-                    del self._user_cachemap[user]
-            else:
-                # Remove the user from remote_offline_serials now that they're
-                # no longer offline
-                for idx, elem in enumerate(self._remote_offline_serials):
-                    (_, user_ids) = elem
-                    user_ids.discard(user_id)
-                    if not user_ids:
-                        self._remote_offline_serials.pop(idx)
+                # Event streams learn about this from the change log.
+                self._user_cachemap.pop(user, None)
 
         for poll in content.get("poll", []):
             user = UserID.from_string(poll)
@@ -1025,8 +1105,44 @@ class PresenceHandler(BaseHandler):
         else:
             statuscache = self._get_or_offline_usercache(user)
         statuscache.update(state, serial=self._user_cachemap_latest_serial)
+
+        if user in self._user_cachemap:
+            changes = self._presence_changes
+            if len(changes) == changes.maxlen:
+                self._presence_changes_truncated_serial = changes[0][0]
+            changes.append(
+                (self._user_cachemap_latest_serial, user, frozenset(room_ids))
+            )
+
         defer.returnValue(statuscache)
 
+    def get_changed_users(self, from_key, user_ids, room_ids):
+        """Get the users whose presence changed since the given serial, out of
+        the given users and those whose change was in one of the given rooms.
+
+        Args:
+            from_key(int): The serial to look for changes after.
+            user_ids(set): UserIDs to return if they changed.
+            room_ids(set): Return users who changed while in one of these
+                room_ids.
+        Returns:
+            A dict of UserID to the serial of their latest change, or None if
+            changes since from_key are no longer in the change log.
+        """
+        if from_key < self._presence_changes_truncated_serial:
+            return None
+
+        changed = {}
+        for serial, user, change_room_ids in reversed(self._presence_changes):
+            if serial <= from_key:
+                break
+            if user in changed:
+                continue
+            if user in user_ids or not change_room_ids.isdisjoint(room_ids):
+                changed[user] = serial
+
+        return changed
+
     @defer.inlineCallbacks
     def push_update_to_local_and_remote(self, observed_user, statuscache,
                                         users_to_push=[], room_ids=[],
@@ -1062,26 +1178,35 @@ class PresenceHandler(BaseHandler):
 
         remote_domains = set(remote_domains)
         remote_domains |= set([r.domain for r in remoteusers])
-        for room_id in room_ids:
-            remote_domains.update(
-                (yield self.store.get_joined_hosts_for_room(room_id))
-            )
+        if room_ids:
+            remote_domains |= yield self._get_interested_domains(room_ids)
 
         remote_domains.discard(self.hs.hostname)
 
-        deferreds = []
+        state = statuscache.get_state()
         for domain in remote_domains:
             logger.debug(" | push to remote domain %s", domain)
-            deferreds.append(
-                self._push_presence_remote(
-                    observed_user, domain, state=statuscache.get_state()
-                )
-            )
-
-        yield defer.DeferredList(deferreds, consumeErrors=True)
+            self._queue_remote_push(observed_user, domain, state)
 
         defer.returnValue((localusers, remote_domains))
 
+    @defer.inlineCallbacks
+    def _get_interested_domains(self, room_ids):
+        """Get the servers that are in any of the given rooms.
+
+        The servers in each room are cached by the store, which invalidates
+        them on any membership change in the room, including remote leaves.
+
+        Args:
+            room_ids([str]): The rooms.
+        Returns:
+            A Deferred set of domains.
+        """
+        domains = set()
+        for room_id in room_ids:
+            domains.update((yield self.store.get_joined_hosts_for_room(room_id)))
+        defer.returnValue(domains)
+
     def push_update_to_clients(self, users_to_push=[], room_ids=[]):
         """Notify clients of a new presence event.
 
@@ -1102,9 +1227,7 @@ class PresenceHandler(BaseHandler):
         """Push a user's presence to a remote server. If a presence state event
         that event is sent. Otherwise a new state event is constructed from the
         stored presence state.
-        The last_active is replaced with last_active_ago in case the wallclock
-        time on the remote server is different to the time on this server.
-        Sends an EDU to the remote server with the current presence state.
+        The update is queued to be sent with any others for the server.
 
         Args:
             user(UserID): The user to push the presence state for.
@@ -1126,20 +1249,50 @@ class PresenceHandler(BaseHandler):
 
             yield collect_presencelike_data(self.distributor, user, state)
 
-        if "last_active" in state:
-            state = dict(state)
-            state["last_active_ago"] = int(
-                self.clock.time_msec() - state.pop("last_active")
+        self._queue_remote_push(user, destination, state)
+
+    def _queue_remote_push(self, user, destination, state):
+        """Queue a user's presence state to be pushed to a remote server. A
+        later update for the same user replaces this one if it hasn't been sent
+        yet.
+        """
+        pending = self._pending_remote_pushes.setdefault(destination, OrderedDict())
+        pending[user.to_string()] = state
+
+        if self._remote_push_timer is None:
+            self._remote_push_timer = self.clock.call_later(
+                REMOTE_PUSH_BATCH_SECONDS, self._send_remote_pushes
             )
 
-        user_state = {"user_id": user.to_string(), }
-        user_state.update(state)
+    def _send_remote_pushes(self):
+        """Send the queued presence updates, in one m.presence EDU per remote
+        server.
+        The last_active is replaced with last_active_ago in case the wallclock
+        time on the remote server is different to the time on this server.
+        """
+        self._remote_push_timer = None
+
+        pending = self._pending_remote_pushes
+        self._pending_remote_pushes = {}
+
+        now = self.clock.time_msec()
+        for destination, states in pending.items():
+            push = []
+            for user_id, state in states.items():
+                user_state = {"user_id": user_id}
+                user_state.update(state)
+                if "last_active" in user_state:
+                    user_state["last_active_ago"] = int(
+                        now - user_state.pop("last_active")
+                    )
+                push.append(user_state)
 
-        yield self.federation.send_edu(
-            destination=destination,
-            edu_type="m.presence",
-            content={"push": [user_state, ], }
-        )
+            with PreserveLoggingContext():
+                self.federation.send_edu(
+                    destination=destination,
+                    edu_type="m.presence",
+                    content={"push": push},
+                )
 
 
 class PresenceEventSource(object):
@@ -1169,14 +1322,41 @@ class PresenceEventSource(object):
             user_ids_to_check |= set(
                 UserID.from_string(p["observed_user_id"]) for p in presence_list
             )
-        for room_id in set(room_ids) & set(presence._room_serials):
-            if presence._room_serials[room_id] > from_key:
-                joined = yield presence.get_joined_users_for_room_id(room_id)
-                user_ids_to_check |= set(joined)
+
+        changed_users = presence.get_changed_users(
+            from_key, user_ids_to_check, set(room_ids)
+        )
+        if changed_users is not None:
+            user_ids_to_check = set(changed_users)
+        else:
+            # The stream is too far behind for the change log, so look at
+            # everyone in rooms with a newer change instead.
+            for room_id in set(room_ids) & set(presence._room_serials):
+                if presence._room_serials[room_id] > from_key:
+                    joined = yield presence.get_joined_users_for_room_id(room_id)
+                    user_ids_to_check |= set(joined)
 
         updates = []
-        for observed_user in user_ids_to_check & set(cachemap):
-            cached = cachemap[observed_user]
+        for observed_user in user_ids_to_check:
+            cached = cachemap.get(observed_user)
+            if cached is None:
+                if changed_users is None:
+                    continue
+
+                # They went offline, and have been dropped from the cache.
+                serial = changed_users[observed_user]
+                if serial > max_serial:
+                    continue
+
+                latest_serial = max(serial, latest_serial)
+                updates.append({
+                    "type": "m.presence",
+                    "content": {
+                        "user_id": observed_user.to_string(),
+                        "presence": PresenceState.OFFLINE,
+                    },
+                })
+                continue
 
             if cached.serial <= from_key or cached.serial > max_serial:
                 continue
@@ -1186,23 +1366,10 @@ class PresenceEventSource(object):
 
         # TODO(paul): limit
 
-        for serial, user_ids in presence._remote_offline_serials:
-            if serial <= from_key:
-                break
-
-            if serial > max_serial:
-                continue
-
-            latest_serial = max(latest_serial, serial)
-            for u in user_ids:
-                updates.append({
-                    "type": "m.presence",
-                    "content": {"user_id": u, "presence": PresenceState.OFFLINE},
-                })
         # TODO(paul): For the v2 API we want to tell the client their from_key
-        #   is too old if we fell off the end of the _remote_offline_serials
-        #   list, and get them to invalidate+resync. In v1 we have no such
-        #   concept so this is a best-effort result.
+        #   is too old if we fell off the end of the change log, and get them
+        #   to invalidate+resync. In v1 we have no such concept so this is a
+        #   best-effort result.
 
         if updates:
             defer.returnValue((updates, latest_serial))
@@ -1266,6 +1433,8 @@ class UserPresenceCache(object):
 
     Includes the update timestamp.
     """
+    __slots__ = ("state", "serial")
+
     def __init__(self):
         self.state = {"presence": PresenceState.OFFLINE}
         self.serial = None
@@ -1286,11 +1455,6 @@ class UserPresenceCache(object):
 
         self.serial = serial
 
-        if "status_msg" in state:
-            self.status_msg = state["status_msg"]
-        else:
-            self.status_msg = None
-
     def get_state(self):
         # clone it so caller can't break our cache
         state = dict(self.state)
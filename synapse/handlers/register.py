@@ -17,6 +17,7 @@
 from twisted.internet import defer
 
 from synapse.types import UserID
+from synapse.api.ratelimiting import Ratelimiter
 from synapse.api.errors import (
     AuthError, Codes, SynapseError, RegistrationError, InvalidCaptchaError
 )
@@ -46,6 +47,8 @@ class RegistrationHandler(BaseHandler):
 
         self._next_generated_user_id = None
 
+        self.registration_ratelimiter = Ratelimiter()
+
     @defer.inlineCallbacks
     def check_username(self, localpart, guest_access_token=None):
         yield run_on_reactor()
@@ -86,7 +89,8 @@ class RegistrationHandler(BaseHandler):
         password=None,
         generate_token=True,
         guest_access_token=None,
-        make_guest=False
+        make_guest=False,
+        address=None,
     ):
         """Registers a new client on the server.
 
@@ -96,12 +100,22 @@ class RegistrationHandler(BaseHandler):
             password (str) : The password to assign to this user so they can
             login again. This can be None which means they cannot login again
             via a password (e.g. the user is an application service user).
+            address (str|None): The IP address the registration request came
+              from, which registrations are ratelimited by, if given.
         Returns:
             A tuple of (user_id, access_token).
         Raises:
             RegistrationError if there was a problem registering.
         """
         yield run_on_reactor()
+
+        if address is not None:
+            self.ratelimit_action(
+                self.registration_ratelimiter, address,
+                rate_hz=self.hs.config.rc_registrations_per_second,
+                burst_count=self.hs.config.rc_registration_burst_count,
+            )
+
         password_hash = None
         if password:
             password_hash = self.auth_handler().hash(password)
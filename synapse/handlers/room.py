@@ -19,12 +19,14 @@ from twisted.internet import defer
 from ._base import BaseHandler
 
 from synapse.types import UserID, RoomAlias, RoomID, RoomStreamToken
+from synapse.api.ratelimiting import Ratelimiter
 from synapse.api.constants import (
     EventTypes, Membership, JoinRules, RoomCreationPreset,
 )
 from synapse.api.errors import AuthError, StoreError, SynapseError, Codes
 from synapse.util import stringutils, unwrapFirstError
 from synapse.util.async import run_on_reactor
+from synapse.util.caches.snapshot_cache import SnapshotCache
 from synapse.util.logcontext import preserve_context_over_fn
 
 from signedjson.sign import verify_signed_json
@@ -33,6 +35,7 @@ from signedjson.key import decode_verify_key_bytes
 from collections import OrderedDict
 from unpaddedbase64 import decode_base64
 
+import bisect
 import logging
 import math
 import string
@@ -374,6 +377,15 @@ class RoomMemberHandler(BaseHandler):
         self.distributor.declare("user_joined_room")
         self.distributor.declare("user_left_room")
 
+        self.join_ratelimiter = Ratelimiter()
+
+    def ratelimit_join(self, user_id):
+        self.ratelimit_action(
+            self.join_ratelimiter, user_id,
+            rate_hz=self.hs.config.rc_joins_per_second,
+            burst_count=self.hs.config.rc_join_burst_count,
+        )
+
     @defer.inlineCallbacks
     def get_room_members(self, room_id):
         users = yield self.store.get_users_in_room(room_id)
@@ -411,6 +423,9 @@ class RoomMemberHandler(BaseHandler):
         elif action == "forget":
             effective_membership_state = "leave"
 
+        if action == "join":
+            self.ratelimit_join(requester.user.to_string())
+
         msg_handler = self.hs.get_handlers().message_handler
 
         content = {"membership": unicode(effective_membership_state)}
@@ -528,6 +543,8 @@ class RoomMemberHandler(BaseHandler):
 
     @defer.inlineCallbacks
     def join_room_alias(self, joinee, room_alias, content={}):
+        self.ratelimit_join(joinee.to_string())
+
         directory_handler = self.hs.get_handlers().directory_handler
         mapping = yield directory_handler.get_association(room_alias)
 
@@ -880,74 +897,134 @@ class RoomMemberHandler(BaseHandler):
 
 
 class RoomListHandler(BaseHandler):
+    def __init__(self, hs):
+        super(RoomListHandler, self).__init__(hs)
+        self.snapshot_cache = SnapshotCache()
 
     @defer.inlineCallbacks
-    def get_public_room_list(self):
-        room_ids = yield self.store.get_public_room_ids()
-
-        @defer.inlineCallbacks
-        def handle_room(room_id):
-            aliases = yield self.store.get_aliases_for_room(room_id)
-            if not aliases:
-                defer.returnValue(None)
-
-            state = yield self.state_handler.get_current_state(room_id)
-
-            result = {"aliases": aliases, "room_id": room_id}
-
-            name_event = state.get((EventTypes.Name, ""), None)
-            if name_event:
-                name = name_event.content.get("name", None)
-                if name:
-                    result["name"] = name
-
-            topic_event = state.get((EventTypes.Topic, ""), None)
-            if topic_event:
-                topic = topic_event.content.get("topic", None)
-                if topic:
-                    result["topic"] = topic
-
-            canonical_event = state.get((EventTypes.CanonicalAlias, ""), None)
-            if canonical_event:
-                canonical_alias = canonical_event.content.get("alias", None)
-                if canonical_alias:
-                    result["canonical_alias"] = canonical_alias
-
-            visibility_event = state.get((EventTypes.RoomHistoryVisibility, ""), None)
-            visibility = None
-            if visibility_event:
-                visibility = visibility_event.content.get("history_visibility", None)
-            result["world_readable"] = visibility == "world_readable"
-
-            guest_event = state.get((EventTypes.GuestAccess, ""), None)
-            guest = None
-            if guest_event:
-                guest = guest_event.content.get("guest_access", None)
-            result["guest_can_join"] = guest == "can_join"
-
-            avatar_event = state.get(("m.room.avatar", ""), None)
-            if avatar_event:
-                avatar_url = avatar_event.content.get("url", None)
-                if avatar_url:
-                    result["avatar_url"] = avatar_url
-
-            result["num_joined_members"] = sum(
-                1 for (event_type, _), ev in state.items()
-                if event_type == EventTypes.Member and ev.membership == Membership.JOIN
+    def get_public_room_list(self, limit=None, since_token=None):
+        """Get a page of the public room list, ordered by the number of joined
+        members, largest first.
+
+        The list is a snapshot, which may be a few minutes out of date.
+
+        Args:
+            limit (int|None): The most rooms to return, or None for all of
+                them.
+            since_token (str|None): The next_batch token of the previous page.
+        Returns:
+            Deferred dict
+        """
+        if limit is not None and limit < 1:
+            raise SynapseError(400, "Invalid limit")
+
+        if since_token:
+            try:
+                num_joined_members, room_id = since_token.split(",", 1)
+                since_key = (-int(num_joined_members), room_id)
+            except ValueError:
+                raise SynapseError(400, "Invalid since token")
+
+        now_ms = self.clock.time_msec()
+        rooms = self.snapshot_cache.get(now_ms, "public_rooms")
+        if rooms is None:
+            rooms = self.snapshot_cache.set(
+                now_ms, "public_rooms", self._get_public_rooms()
+            )
+        rooms = yield rooms
+
+        start = 0
+        if since_token:
+            start = bisect.bisect_right(
+                [(-r["num_joined_members"], r["room_id"]) for r in rooms],
+                since_key,
+            )
+
+        chunk = rooms[start:]
+        result = {"start": "START", "end": "END"}
+        if limit is not None and len(chunk) > limit:
+            chunk = chunk[:limit]
+            result["next_batch"] = "%d,%s" % (
+                chunk[-1]["num_joined_members"], chunk[-1]["room_id"],
             )
 
-            defer.returnValue(result)
+        # FIXME (erikj): START is no longer a valid value
+        result["chunk"] = chunk
+        defer.returnValue(result)
+
+    @defer.inlineCallbacks
+    def _get_public_rooms(self):
+        """Get the summaries of all public rooms with an alias, building any
+        that have been invalidated, ordered for the public room list.
+        """
+        summaries = yield self.store.get_public_room_summaries()
 
-        result = []
-        for chunk in (room_ids[i:i + 10] for i in xrange(0, len(room_ids), 10)):
+        to_build = [
+            room_id for room_id, summary in summaries.items() if summary is None
+        ]
+        for chunk in (to_build[i:i + 10] for i in xrange(0, len(to_build), 10)):
             chunk_result = yield defer.gatherResults([
-                handle_room(room_id)
+                self._build_public_room_summary(room_id)
                 for room_id in chunk
             ], consumeErrors=True).addErrback(unwrapFirstError)
-            result.extend(v for v in chunk_result if v)
+            summaries.update((s["room_id"], s) for s in chunk_result)
 
-        # FIXME (erikj): START is no longer a valid value
-        defer.returnValue({"start": "START", "end": "END", "chunk": result})
+        rooms = [s for s in summaries.values() if s["aliases"]]
+        rooms.sort(key=lambda s: (-s["num_joined_members"], s["room_id"]))
+
+        defer.returnValue(rooms)
+
+    @defer.inlineCallbacks
+    def _build_public_room_summary(self, room_id):
+        sequence = self.store.get_public_room_summaries_sequence(room_id)
+
+        aliases = yield self.store.get_aliases_for_room(room_id)
+        state = yield self.state_handler.get_current_state(room_id)
+
+        result = {"aliases": aliases, "room_id": room_id}
+
+        name_event = state.get((EventTypes.Name, ""), None)
+        if name_event:
+            name = name_event.content.get("name", None)
+            if name:
+                result["name"] = name
+
+        topic_event = state.get((EventTypes.Topic, ""), None)
+        if topic_event:
+            topic = topic_event.content.get("topic", None)
+            if topic:
+                result["topic"] = topic
+
+        canonical_event = state.get((EventTypes.CanonicalAlias, ""), None)
+        if canonical_event:
+            canonical_alias = canonical_event.content.get("alias", None)
+            if canonical_alias:
+                result["canonical_alias"] = canonical_alias
+
+        visibility_event = state.get((EventTypes.RoomHistoryVisibility, ""), None)
+        visibility = None
+        if visibility_event:
+            visibility = visibility_event.content.get("history_visibility", None)
+        result["world_readable"] = visibility == "world_readable"
+
+        guest_event = state.get((EventTypes.GuestAccess, ""), None)
+        guest = None
+        if guest_event:
+            guest = guest_event.content.get("guest_access", None)
+        result["guest_can_join"] = guest == "can_join"
+
+        avatar_event = state.get(("m.room.avatar", ""), None)
+        if avatar_event:
+            avatar_url = avatar_event.content.get("url", None)
+            if avatar_url:
+                result["avatar_url"] = avatar_url
+
+        stats = yield self.store.get_room_stats(room_id)
+        result["num_joined_members"] = stats["joined_members"]
+
+        yield self.store.store_public_room_summary(result, sequence)
+
+        defer.returnValue(result)
 
 
 class RoomContextHandler(BaseHandler):
@@ -30,6 +30,10 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# The most pages of search results we fetch for a single request while trying
+# to find enough results that the user is allowed to see.
+MAX_SEARCH_PAGES = 5
+
 
 class SearchHandler(BaseHandler):
 
@@ -143,6 +147,7 @@ class SearchHandler(BaseHandler):
             })
 
         rank_map = {}  # event_id -> rank of event
+        results_map = {}  # event_id -> search result
         allowed_events = []
         room_groups = {}  # Holds result of grouping by room, if applicable
         sender_group = {}  # Holds result of grouping by sender, if applicable
@@ -155,19 +160,34 @@ class SearchHandler(BaseHandler):
         count = None
 
         if order_by == "rank":
-            search_result = yield self.store.search_msgs(
-                room_ids, search_term, keys
+            search_func = self.store.search_msgs
+        elif order_by == "recent":
+            search_func = self.store.search_rooms
+        else:
+            # We should never get here due to the guard earlier.
+            raise NotImplementedError()
+
+        limit = search_filter.limit()
+        pagination_token = batch_token
+
+        # We fetch a page of results at a time, and keep fetching while so
+        # many are filtered out that we don't have enough to return. But only
+        # go around a few times since otherwise synapse will be sad.
+        for _ in range(MAX_SEARCH_PAGES):
+            search_result = yield search_func(
+                room_ids, search_term, keys, limit,
+                pagination_token=pagination_token,
             )
 
-            count = search_result["count"]
+            if count is None:
+                count = search_result["count"]
 
             if search_result["highlights"]:
                 highlights.update(search_result["highlights"])
 
             results = search_result["results"]
 
-            results_map = {r["event"].event_id: r for r in results}
-
+            results_map.update({r["event"].event_id: r for r in results})
             rank_map.update({r["event"].event_id: r["rank"] for r in results})
 
             filtered_events = search_filter.filter([r["event"] for r in results])
@@ -175,119 +195,89 @@ class SearchHandler(BaseHandler):
             events = yield self._filter_events_for_client(
                 user.to_string(), filtered_events
             )
+            allowed_events.extend(events)
 
-            events.sort(key=lambda e: -rank_map[e.event_id])
-            allowed_events = events[:search_filter.limit()]
-
-            for e in allowed_events:
-                rm = room_groups.setdefault(e.room_id, {
-                    "results": [],
-                    "order": rank_map[e.event_id],
-                })
-                rm["results"].append(e.event_id)
-
-                s = sender_group.setdefault(e.sender, {
-                    "results": [],
-                    "order": rank_map[e.event_id],
-                })
-                s["results"].append(e.event_id)
-
-        elif order_by == "recent":
-            room_events = []
-            i = 0
-
-            pagination_token = batch_token
-
-            # We keep looping and we keep filtering until we reach the limit
-            # or we run out of things.
-            # But only go around 5 times since otherwise synapse will be sad.
-            while len(room_events) < search_filter.limit() and i < 5:
-                i += 1
-                search_result = yield self.store.search_rooms(
-                    room_ids, search_term, keys, search_filter.limit() * 2,
-                    pagination_token=pagination_token,
-                )
-
-                if search_result["highlights"]:
-                    highlights.update(search_result["highlights"])
-
-                count = search_result["count"]
-
-                results = search_result["results"]
+            if len(results) < limit:
+                # There are no more results.
+                pagination_token = None
+                break
 
-                results_map = {r["event"].event_id: r for r in results}
+            pagination_token = results[-1]["pagination_token"]
 
-                rank_map.update({r["event"].event_id: r["rank"] for r in results})
+            if len(allowed_events) >= limit:
+                break
 
-                filtered_events = search_filter.filter([
-                    r["event"] for r in results
-                ])
+        if len(allowed_events) > limit:
+            allowed_events = allowed_events[:limit]
+            pagination_token = results_map[
+                allowed_events[-1].event_id
+            ]["pagination_token"]
 
-                events = yield self._filter_events_for_client(
-                    user.to_string(), filtered_events
-                )
+        for e in allowed_events:
+            rm = room_groups.setdefault(e.room_id, {
+                "results": [],
+            })
+            rm["results"].append(e.event_id)
 
-                room_events.extend(events)
-                room_events = room_events[:search_filter.limit()]
-
-                if len(results) < search_filter.limit() * 2:
-                    pagination_token = None
-                    break
-                else:
-                    pagination_token = results[-1]["pagination_token"]
-
-            for event in room_events:
-                group = room_groups.setdefault(event.room_id, {
-                    "results": [],
-                })
-                group["results"].append(event.event_id)
-
-            if room_events and len(room_events) >= search_filter.limit():
-                last_event_id = room_events[-1].event_id
-                pagination_token = results_map[last_event_id]["pagination_token"]
-
-                # We want to respect the given batch group and group keys so
-                # that if people blindly use the top level `next_batch` token
-                # it returns more from the same group (if applicable) rather
-                # than reverting to searching all results again.
-                if batch_group and batch_group_key:
-                    global_next_batch = encode_base64("%s\n%s\n%s" % (
-                        batch_group, batch_group_key, pagination_token
-                    ))
-                else:
-                    global_next_batch = encode_base64("%s\n%s\n%s" % (
-                        "all", "", pagination_token
-                    ))
-
-                for room_id, group in room_groups.items():
-                    group["next_batch"] = encode_base64("%s\n%s\n%s" % (
-                        "room_id", room_id, pagination_token
-                    ))
-
-            allowed_events.extend(room_events)
+            s = sender_group.setdefault(e.sender, {
+                "results": [],
+            })
+            s["results"].append(e.event_id)
+
+            if order_by == "rank":
+                rm.setdefault("order", rank_map[e.event_id])
+                s.setdefault("order", rank_map[e.event_id])
+
+        if pagination_token:
+            # We want to respect the given batch group and group keys so
+            # that if people blindly use the top level `next_batch` token
+            # it returns more from the same group (if applicable) rather
+            # than reverting to searching all results again.
+            if batch_group and batch_group_key:
+                global_next_batch = encode_base64("%s\n%s\n%s" % (
+                    batch_group, batch_group_key, pagination_token
+                ))
+            else:
+                global_next_batch = encode_base64("%s\n%s\n%s" % (
+                    "all", "", pagination_token
+                ))
 
-        else:
-            # We should never get here due to the guard earlier.
-            raise NotImplementedError()
+            for room_id, group in room_groups.items():
+                group["next_batch"] = encode_base64("%s\n%s\n%s" % (
+                    "room_id", room_id, pagination_token
+                ))
 
         # If client has asked for "context" for each event (i.e. some surrounding
         # events and state), fetch that
-        if event_context is not None:
+        if event_context is not None and allowed_events:
             now_token = yield self.hs.get_event_sources().get_current_token()
 
-            contexts = {}
-            for event in allowed_events:
-                res = yield self.store.get_events_around(
-                    event.room_id, event.event_id, before_limit, after_limit
-                )
-
-                res["events_before"] = yield self._filter_events_for_client(
-                    user.to_string(), res["events_before"]
-                )
+            contexts = yield self.store.get_events_around_many(
+                [(e.room_id, e.event_id) for e in allowed_events],
+                before_limit, after_limit,
+            )
 
-                res["events_after"] = yield self._filter_events_for_client(
-                    user.to_string(), res["events_after"]
-                )
+            # Filter the context of every result in one go.
+            context_events = yield self._filter_events_for_client(
+                user.to_string(), [
+                    ev
+                    for res in contexts.values()
+                    for ev in itertools.chain(
+                        res["events_before"], res["events_after"]
+                    )
+                ]
+            )
+            visible_event_ids = set(ev.event_id for ev in context_events)
+
+            for res in contexts.values():
+                res["events_before"] = [
+                    ev for ev in res["events_before"]
+                    if ev.event_id in visible_event_ids
+                ]
+                res["events_after"] = [
+                    ev for ev in res["events_after"]
+                    if ev.event_id in visible_event_ids
+                ]
 
                 res["start"] = now_token.copy_and_replace(
                     "room_key", res["start"]
@@ -297,34 +287,8 @@ class SearchHandler(BaseHandler):
                     "room_key", res["end"]
                 ).to_string()
 
-                if include_profile:
-                    senders = set(
-                        ev.sender
-                        for ev in itertools.chain(
-                            res["events_before"], [event], res["events_after"]
-                        )
-                    )
-
-                    if res["events_after"]:
-                        last_event_id = res["events_after"][-1].event_id
-                    else:
-                        last_event_id = event.event_id
-
-                    state = yield self.store.get_state_for_event(
-                        last_event_id,
-                        types=[(EventTypes.Member, sender) for sender in senders]
-                    )
-
-                    res["profile_info"] = {
-                        s.state_key: {
-                            "displayname": s.content.get("displayname", None),
-                            "avatar_url": s.content.get("avatar_url", None),
-                        }
-                        for s in state.values()
-                        if s.type == EventTypes.Member and s.state_key in senders
-                    }
-
-                contexts[event.event_id] = res
+            if include_profile:
+                yield self._add_profile_info(allowed_events, contexts)
         else:
             contexts = {}
 
@@ -389,3 +353,45 @@ class SearchHandler(BaseHandler):
                 "room_events": rooms_cat_res
             }
         })
+
+    @defer.inlineCallbacks
+    def _add_profile_info(self, events, contexts):
+        """Adds the historic display names and avatars of the senders in the
+        context of each search result, as "profile_info".
+        """
+        senders_by_event_id = {}
+        for event in events:
+            res = contexts[event.event_id]
+            senders = set(
+                ev.sender
+                for ev in itertools.chain(
+                    res["events_before"], [event], res["events_after"]
+                )
+            )
+
+            if res["events_after"]:
+                last_event_id = res["events_after"][-1].event_id
+            else:
+                last_event_id = event.event_id
+
+            senders_by_event_id[event.event_id] = (last_event_id, senders)
+
+        all_senders = set()
+        for _, senders in senders_by_event_id.values():
+            all_senders.update(senders)
+
+        state_by_event_id = yield self.store.get_state_for_events(
+            set(last_event_id for last_event_id, _ in senders_by_event_id.values()),
+            types=[(EventTypes.Member, sender) for sender in all_senders],
+        )
+
+        for event_id, (last_event_id, senders) in senders_by_event_id.items():
+            state = state_by_event_id[last_event_id]
+            contexts[event_id]["profile_info"] = {
+                s.state_key: {
+                    "displayname": s.content.get("displayname", None),
+                    "avatar_url": s.content.get("avatar_url", None),
+                }
+                for s in state.values()
+                if s.type == EventTypes.Member and s.state_key in senders
+            }
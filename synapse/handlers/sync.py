@@ -224,6 +224,17 @@ class SyncHandler(BaseHandler):
             sync_config.user.to_string()
         )
 
+        # Fill in the receipt cache for all the joined rooms in one go, rather
+        # than querying for each room in unread_notifs_for_room_id.
+        yield self.store.get_last_receipt_event_ids_for_user_for_rooms(
+            sync_config.user.to_string(),
+            [
+                event.room_id for event in room_list
+                if event.membership == Membership.JOIN
+            ],
+            "m.read",
+        )
+
         joined = []
         invited = []
         archived = []
@@ -463,6 +474,12 @@ class SyncHandler(BaseHandler):
 
         user_id = sync_config.user.to_string()
 
+        # Fill in the receipt cache for all the joined rooms in one go, rather
+        # than querying for each room in unread_notifs_for_room_id.
+        yield self.store.get_last_receipt_event_ids_for_user_for_rooms(
+            user_id, joined_room_ids, "m.read",
+        )
+
         timeline_limit = sync_config.filter_collection.timeline_limit()
 
         tags_by_room = yield self.store.get_updated_tags(
@@ -897,12 +914,15 @@ class SyncHandler(BaseHandler):
                 receipt_type="m.read"
             )
 
-            notifs = []
             if last_unread_event_id:
-                notifs = yield self.store.get_unread_event_push_actions_by_room_for_user(
-                    room_id, sync_config.user.to_string(), last_unread_event_id
+                # This is cached per user, so we only hit the database once
+                # for all the rooms in the sync.
+                notifs_by_room = yield self.store.get_unread_push_counts_for_user(
+                    sync_config.user.to_string()
                 )
-                defer.returnValue(notifs)
+                defer.returnValue(notifs_by_room.get(
+                    room_id, {"notify_count": 0, "highlight_count": 0}
+                ))
 
             # There is no new information in this period, so your notification
             # count is whatever it was last time.
@@ -21,13 +21,24 @@ from synapse.api.errors import SynapseError, AuthError
 from synapse.util.logcontext import PreserveLoggingContext
 from synapse.util.metrics import Measure
 from synapse.types import UserID
+import synapse.metrics
 
 import logging
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 logger = logging.getLogger(__name__)
 
+metrics = synapse.metrics.get_metrics_for(__name__)
+
+sent_edus_counter = metrics.register_counter("sent_edus")
+
+
+# How long to collect typing changes in a room for before sending them to
+# remote servers, in seconds. Someone who starts and stops typing within this
+# time isn't sent at all.
+TYPING_EDU_BATCH_SECONDS = 0.25
+
 
 # A tiny object useful for storing a user's membership in a room, as a mapping
 # key
@@ -57,12 +68,19 @@ class TypingNotificationHandler(BaseHandler):
         # map room IDs to sets of users currently typing
         self._room_typing = {}
 
+        # map room IDs to dicts of user to [typing before, typing now], for
+        # changes waiting to be sent to remote servers
+        self._pending_remote_updates = {}
+        self._remote_update_timer = None
+
     def tearDown(self):
         """Cancels all the pending timers.
         Normally this shouldn't be needed, but it's required from unit tests
         to avoid a "Reactor was unclean" warning."""
         for t in self._member_typing_timer.values():
             self.clock.cancel_call_later(t)
+        if self._remote_update_timer:
+            self.clock.cancel_call_later(self._remote_update_timer)
 
     @defer.inlineCallbacks
     def started_typing(self, target_user, auth_user, room_id, timeout):
@@ -154,36 +172,68 @@ class TypingNotificationHandler(BaseHandler):
             # stopped_typing() will cancel it
             del self._member_typing_timer[member]
 
-    @defer.inlineCallbacks
     def _push_update(self, room_id, user, typing):
-        localusers = set()
-        remotedomains = set()
-
-        rm_handler = self.homeserver.get_handlers().room_member_handler
-        yield rm_handler.fetch_room_distributions_into(
-            room_id, localusers=localusers, remotedomains=remotedomains
+        # The user is in the room, so there is always a local user to tell.
+        self._push_update_local(
+            room_id=room_id,
+            user=user,
+            typing=typing
         )
 
-        if localusers:
-            self._push_update_local(
-                room_id=room_id,
-                user=user,
-                typing=typing
+        pending = self._pending_remote_updates.setdefault(room_id, OrderedDict())
+        if user in pending:
+            pending[user][1] = typing
+        else:
+            pending[user] = [not typing, typing]
+
+        if self._remote_update_timer is None:
+            self._remote_update_timer = self.clock.call_later(
+                TYPING_EDU_BATCH_SECONDS, self._send_remote_updates
             )
 
-        deferreds = []
-        for domain in remotedomains:
-            deferreds.append(self.federation.send_edu(
-                destination=domain,
-                edu_type="m.typing",
-                content={
-                    "room_id": room_id,
-                    "user_id": user.to_string(),
-                    "typing": typing,
-                },
-            ))
+        return defer.succeed(None)
+
+    @defer.inlineCallbacks
+    def _send_remote_updates(self):
+        """Send the typing changes collected for each room to the remote
+        servers in the room, skipping users whose typing state ended up where
+        it started.
+        """
+        self._remote_update_timer = None
+
+        pending = self._pending_remote_updates
+        self._pending_remote_updates = {}
 
-        yield defer.DeferredList(deferreds, consumeErrors=True)
+        rm_handler = self.homeserver.get_handlers().room_member_handler
+        for room_id, updates in pending.items():
+            updates = [
+                (user, typing) for user, (was_typing, typing) in updates.items()
+                if was_typing != typing
+            ]
+            if not updates:
+                continue
+
+            remotedomains = set()
+            try:
+                yield rm_handler.fetch_room_distributions_into(
+                    room_id, localusers=None, remotedomains=remotedomains
+                )
+            except Exception:
+                logger.exception("Failed to get servers in %s", room_id)
+                continue
+
+            for domain in remotedomains:
+                for user, typing in updates:
+                    sent_edus_counter.inc()
+                    self.federation.send_edu(
+                        destination=domain,
+                        edu_type="m.typing",
+                        content={
+                            "room_id": room_id,
+                            "user_id": user.to_string(),
+                            "typing": typing,
+                        },
+                    )
 
     @defer.inlineCallbacks
     def _recv_edu(self, origin, content):
@@ -227,6 +277,10 @@ class TypingNotificationEventSource(object):
         self._handler = None
         self._room_member_handler = None
 
+        # map room IDs to (serial, event) for the latest typing event built
+        # for the room, which is shared by everyone polling for it
+        self._room_events = {}
+
     def handler(self):
         # Avoid cyclic dependency in handler setup
         if not self._handler:
@@ -239,14 +293,23 @@ class TypingNotificationEventSource(object):
         return self._room_member_handler
 
     def _make_event_for(self, room_id):
-        typing = self.handler()._room_typing[room_id]
-        return {
+        handler = self.handler()
+        serial = handler._room_serials[room_id]
+
+        cached = self._room_events.get(room_id)
+        if cached and cached[0] == serial:
+            return cached[1]
+
+        typing = handler._room_typing[room_id]
+        event = {
             "type": "m.typing",
             "room_id": room_id,
             "content": {
                 "user_ids": [u.to_string() for u in typing],
             },
         }
+        self._room_events[room_id] = (serial, event)
+        return event
 
     def get_new_events(self, from_key, room_ids, **kwargs):
         with Measure(self.clock, "typing.get_new_events"):
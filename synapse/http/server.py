@@ -69,6 +69,34 @@ response_db_txn_duration = metrics.register_distribution(
     "response_db_txn_duration", labels=["method", "servlet", "tag"]
 )
 
+# Per-request resource usage, labelled by the path pattern (or resource) that
+# handled the request rather than the raw URI. These are recorded from
+# SynapseRequest.finished_processing once the response has been sent. Times
+# are in msec.
+request_ru_utime = metrics.register_distribution(
+    "request_ru_utime", labels=["method", "name"]
+)
+
+request_ru_stime = metrics.register_distribution(
+    "request_ru_stime", labels=["method", "name"]
+)
+
+request_db_txn_count = metrics.register_distribution(
+    "request_db_txn_count", labels=["method", "name"]
+)
+
+request_db_txn_duration = metrics.register_distribution(
+    "request_db_txn_duration", labels=["method", "name"]
+)
+
+request_db_sched_duration = metrics.register_distribution(
+    "request_db_sched_duration", labels=["method", "name"]
+)
+
+request_response_size = metrics.register_distribution(
+    "request_response_size", labels=["method", "name"]
+)
+
 
 _next_request_id = 0
 
@@ -221,6 +249,10 @@ class JsonResource(HttpServer, resource.Resource):
             # returned response. We pass both the request and any
             # matched groups from the regex to the callback.
 
+            # Used to label the per-request resource metrics, so that we
+            # don't end up with one series per distinct URI.
+            request.request_metrics_name = path_entry.pattern.pattern
+
             callback = path_entry.callback
 
             servlet_instance = getattr(callback, "__self__", None)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from synapse.http.server import (
+    request_ru_utime, request_ru_stime, request_db_txn_count,
+    request_db_txn_duration, request_db_sched_duration, request_response_size,
+)
+from synapse.util.logcontext import LoggingContext
+
+from twisted.web.server import Site, Request
+
+from StringIO import StringIO
+import contextlib
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+ACCESS_TOKEN_RE = re.compile(r'(\?.*access(_|%5[Ff])token=)[^&]*(.*)$')
+
+
+class SynapseRequest(Request):
+    def __init__(self, site, *args, **kw):
+        Request.__init__(self, *args, **kw)
+        self.site = site
+        self.authenticated_entity = None
+        self.start_time = 0
+
+        # The largest body we will store for this request, if it is limited,
+        # and how much of it we have stored.
+        self._max_body_size = None
+        self._body_received = 0
+
+        # The name to label this request's metrics with. This is the name of
+        # the resource that rendered it, unless the resource refines it (e.g.
+        # JsonResource uses the matched path pattern).
+        self.request_metrics_name = None
+
+    def __repr__(self):
+        # We overwrite this so that we don't log ``access_token``
+        return '<%s at 0x%x method=%s uri=%s clientproto=%s site=%s>' % (
+            self.__class__.__name__,
+            id(self),
+            self.method,
+            self.get_redacted_uri(),
+            self.clientproto,
+            self.site.site_tag,
+        )
+
+    def gotLength(self, length):
+        # We aren't given the path until the whole body has arrived, but the
+        # channel has already parsed it from the request line.
+        self._max_body_size = self.site.get_max_request_body_size(
+            getattr(self.channel, "_path", b"")
+        )
+
+        max_size = self._max_body_size
+        if max_size is not None and length is not None and length > max_size:
+            # Don't read the body at all. The resource will see the
+            # Content-Length and respond with a 413 as usual, after which the
+            # connection is closed rather than the body being read as the next
+            # request.
+            self.content = StringIO()
+            self.channel.length = 0
+            self.channel.persistent = False
+
+            # Otherwise twisted would tell the client to go ahead and send it.
+            self.requestHeaders.removeHeader(b"expect")
+            return
+
+        Request.gotLength(self, length)
+
+    def handleContentChunk(self, data):
+        # Chunked requests don't give their length up front, so stop storing
+        # the body once it is over the limit. Keeping one byte more than the
+        # limit is enough for the resource to see that it is too large.
+        if self._max_body_size is not None:
+            remaining = self._max_body_size + 1 - self._body_received
+            if remaining <= 0:
+                return
+            data = data[:remaining]
+            self._body_received += len(data)
+
+        Request.handleContentChunk(self, data)
+
+    def get_redacted_uri(self):
+        return ACCESS_TOKEN_RE.sub(
+            r'\1<redacted>\3',
+            self.uri
+        )
+
+    def get_user_agent(self):
+        return self.requestHeaders.getRawHeaders("User-Agent", [None])[-1]
+
+    def render(self, resrc):
+        # This is called once the resource for the request has been found.
+        resrc = getattr(resrc, "_wrappedResource", resrc)
+        self.request_metrics_name = resrc.__class__.__name__
+        Request.render(self, resrc)
+
+    def started_processing(self):
+        self.site.access_logger.info(
+            "%s - %s - Received request: %s %s",
+            self.getClientIP(),
+            self.site.site_tag,
+            self.method,
+            self.get_redacted_uri()
+        )
+        self.start_time = int(time.time() * 1000)
+
+    def finished_processing(self):
+
+        try:
+            context = LoggingContext.current_context()
+            ru_utime, ru_stime = context.get_resource_usage()
+            db_txn_count = context.db_txn_count
+            db_txn_duration = context.db_txn_duration
+            db_sched_duration = context.db_sched_duration
+        except:
+            ru_utime, ru_stime = (0, 0)
+            db_txn_count, db_txn_duration, db_sched_duration = (0, 0, 0)
+
+        self.site.access_logger.info(
+            "%s - %s - {%s}"
+            " Processed request: %dms (%dms, %dms) (%dms/%dms/%d)"
+            " %sB %s \"%s %s %s\" \"%s\"",
+            self.getClientIP(),
+            self.site.site_tag,
+            self.authenticated_entity,
+            int(time.time() * 1000) - self.start_time,
+            int(ru_utime * 1000),
+            int(ru_stime * 1000),
+            int(db_txn_duration * 1000),
+            int(db_sched_duration * 1000),
+            int(db_txn_count),
+            self.sentLength,
+            self.code,
+            self.method,
+            self.get_redacted_uri(),
+            self.clientproto,
+            self.get_user_agent(),
+        )
+
+        name = self.request_metrics_name
+        if name is None:
+            return
+
+        request_ru_utime.inc_by(int(ru_utime * 1000), self.method, name)
+        request_ru_stime.inc_by(int(ru_stime * 1000), self.method, name)
+        request_db_txn_count.inc_by(db_txn_count, self.method, name)
+        request_db_txn_duration.inc_by(
+            int(db_txn_duration * 1000), self.method, name
+        )
+        request_db_sched_duration.inc_by(
+            int(db_sched_duration * 1000), self.method, name
+        )
+        request_response_size.inc_by(self.sentLength, self.method, name)
+
+    @contextlib.contextmanager
+    def processing(self):
+        self.started_processing()
+        yield
+        self.finished_processing()
+
+
+class XForwardedForRequest(SynapseRequest):
+    def __init__(self, *args, **kw):
+        SynapseRequest.__init__(self, *args, **kw)
+
+    """
+    Add a layer on top of another request that only uses the value of an
+    X-Forwarded-For header as the result of C{getClientIP}.
+    """
+    def getClientIP(self):
+        """
+        @return: The client address (the first address) in the value of the
+            I{X-Forwarded-For header}.  If the header is not present, return
+            C{b"-"}.
+        """
+        return self.requestHeaders.getRawHeaders(
+            b"x-forwarded-for", [b"-"])[0].split(b",")[0].strip()
+
+
+class SynapseRequestFactory(object):
+    def __init__(self, site, x_forwarded_for):
+        self.site = site
+        self.x_forwarded_for = x_forwarded_for
+
+    def __call__(self, *args, **kwargs):
+        if self.x_forwarded_for:
+            return XForwardedForRequest(self.site, *args, **kwargs)
+        else:
+            return SynapseRequest(self.site, *args, **kwargs)
+
+
+class SynapseSite(Site):
+    """
+    Subclass of a twisted http Site that does access logging with python's
+    standard logging
+    """
+    def __init__(self, logger_name, site_tag, config, resource,
+                 max_request_body_sizes={}, *args, **kwargs):
+        Site.__init__(self, resource, *args, **kwargs)
+
+        self.site_tag = site_tag
+
+        # Map from path to the largest request body that the resource at that
+        # path accepts. Larger bodies aren't read, so that the resource can
+        # reject them without them being spooled to disk first.
+        self.max_request_body_sizes = max_request_body_sizes
+
+        proxied = config.get("x_forwarded", False)
+        self.requestFactory = SynapseRequestFactory(self, proxied)
+        self.access_logger = logging.getLogger(logger_name)
+
+    def get_max_request_body_size(self, uri):
+        """Get the largest body that will be stored for a request to the given
+        URI, or None if it isn't limited.
+        """
+        path = uri.split(b"?", 1)[0].rstrip(b"/")
+        return self.max_request_body_sizes.get(path)
+
+    def log(self, request):
+        pass
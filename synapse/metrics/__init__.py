@@ -26,7 +26,8 @@ import time
 from twisted.internet import reactor
 
 from .metric import (
-    CounterMetric, CallbackMetric, DistributionMetric, CacheMetric
+    CounterMetric, CallbackMetric, DistributionMetric, HistogramMetric,
+    CacheMetric,
 )
 
 
@@ -65,6 +66,9 @@ class Metrics(object):
     def register_distribution(self, *args, **kwargs):
         return self._register(DistributionMetric, *args, **kwargs)
 
+    def register_histogram(self, *args, **kwargs):
+        return self._register(HistogramMetric, *args, **kwargs)
+
     def register_cache(self, *args, **kwargs):
         return self._register(CacheMetric, *args, **kwargs)
 
@@ -153,7 +157,7 @@ def _process_fds():
 get_metrics_for("process").register_callback("fds", _process_fds, labels=["type"])
 
 reactor_metrics = get_metrics_for("reactor")
-tick_time = reactor_metrics.register_distribution("tick_time")
+tick_time = reactor_metrics.register_histogram("tick_time")
 pending_calls_metric = reactor_metrics.register_distribution("pending_calls")
 
 
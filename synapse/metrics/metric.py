@@ -15,6 +15,13 @@
 
 
 from itertools import chain
+from bisect import bisect_left
+
+
+# Bucket upper bounds, in msec, used by default for timing histograms
+DEFAULT_TIME_BUCKETS = (
+    1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000,
+)
 
 
 # TODO(paul): I can't believe Python doesn't have one of these
@@ -36,7 +43,13 @@ class BaseMetric(object):
         return not len(self.labels)
 
     def _render_labelvalue(self, value):
-        # TODO: some kind of value escape
+        # Escape the characters that the exposition format treats specially,
+        # as label values may be things like regex path patterns.
+        value = "%s" % (value,)
+        if "\\" in value or '"' in value or "\n" in value:
+            value = value.replace("\\", "\\\\").replace('"', '\\"').replace(
+                "\n", "\\n"
+            )
         return '"%s"' % (value)
 
     def _render_key(self, values):
@@ -125,6 +138,90 @@ class DistributionMetric(object):
         return self.counts.render() + self.totals.render()
 
 
+class HistogramMetric(BaseMetric):
+    """A DistributionMetric that additionally sorts each observed value into
+    one of a fixed set of buckets, so that quantiles can be estimated from the
+    exported data rather than just the mean.
+
+    The output follows the Prometheus histogram layout, using cumulative
+    "le" (less-than-or-equal) buckets, alongside the same ":count" and
+    ":total" series that a DistributionMetric exports.
+    """
+
+    def __init__(self, name, buckets=DEFAULT_TIME_BUCKETS, labels=[]):
+        super(HistogramMetric, self).__init__(name, labels=labels)
+
+        self.buckets = sorted(buckets)
+
+        # Precompute the rendered bucket bounds so we don't have to format
+        # them on each render
+        self._bucket_bounds = ["%g" % (b,) for b in self.buckets] + ["+Inf"]
+
+        # Maps label values to a list of per-bucket (non-cumulative) counts,
+        # with the final slot holding the running total of observed values.
+        self.counts = {}
+
+        # Scalar metrics are never empty
+        if self.is_scalar():
+            self.counts[()] = self._new_entry()
+
+    def _new_entry(self):
+        # One slot per bucket, one for +Inf and one for the total
+        return [0] * (len(self.buckets) + 2)
+
+    def inc_by(self, inc, *values):
+        # This is called on hot paths, so we avoid doing anything more than a
+        # dict lookup and a bisect in the common case.
+        entry = self.counts.get(values)
+        if entry is None:
+            if len(values) != self.dimension():
+                raise ValueError(
+                    "Expected as many values to inc() as labels (%d)" % (
+                        self.dimension()
+                    )
+                )
+            entry = self.counts[values] = self._new_entry()
+
+        entry[bisect_left(self.buckets, inc)] += 1
+        entry[-1] += inc
+
+    def _render_bucket_key(self, values, bound):
+        return "{%s}" % (
+            ",".join(["%s=%s" % (k, self._render_labelvalue(v))
+                      for k, v in zip(self.labels, values)]
+                     + ["le=%s" % (self._render_labelvalue(bound),)])
+        )
+
+    def render_buckets(self, k):
+        entry = self.counts[k]
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._bucket_bounds, entry):
+            cumulative += count
+            lines.append("%s:bucket%s %d" % (
+                self.name, self._render_bucket_key(k, bound), cumulative
+            ))
+        return lines
+
+    def render_count(self, k):
+        return ["%s:count%s %d" % (
+            self.name, self._render_key(k), sum(self.counts[k][:-1])
+        )]
+
+    def render_total(self, k):
+        return ["%s:total%s %d" % (
+            self.name, self._render_key(k), self.counts[k][-1]
+        )]
+
+    def render(self):
+        keys = sorted(self.counts.keys())
+        return (
+            map_concat(self.render_buckets, keys)
+            + map_concat(self.render_count, keys)
+            + map_concat(self.render_total, keys)
+        )
+
+
 class CacheMetric(object):
     """A combination of two CounterMetrics, one to count cache hits and one to
     count a total, and a callback metric to yield the current size.
@@ -85,9 +85,19 @@ class _NotifierUserStream(object):
             stream_id(str): The new id for the stream the event came from.
             time_now_ms(int): The current time in milliseconds.
         """
-        self.current_token = self.current_token.copy_and_advance(
-            stream_key, stream_id
-        )
+        self.notify_many([(stream_key, stream_id)], time_now_ms)
+
+    def notify_many(self, updates, time_now_ms):
+        """Notify any listeners for this user of new events from one or more
+        event sources, waking them up only once.
+        Args:
+            updates(list): List of (stream_key, stream_id) tuples.
+            time_now_ms(int): The current time in milliseconds.
+        """
+        current_token = self.current_token
+        for stream_key, stream_id in updates:
+            current_token = current_token.copy_and_advance(stream_key, stream_id)
+        self.current_token = current_token
         self.last_notified_ms = time_now_ms
         noify_deferred = self.notify_deferred
 
@@ -124,6 +134,37 @@ class _NotifierUserStream(object):
             return _NotificationListener(self.notify_deferred.observe())
 
 
+def _stream_position(stream_key, stream_id):
+    """Returns the stream_id as an int, so that ids from the same stream can
+    be compared.
+    """
+    if stream_key == "room_key" and type(stream_id) is not int:
+        return int(stream_id[1:].split("-")[-1])
+    return int(stream_id)
+
+
+class _PendingWakeup(object):
+    """The listeners that need to be woken up for a single stream at the end
+    of the current reactor tick, and the token to wake them up with.
+    """
+    __slots__ = ["stream_key", "stream_id", "position", "users", "rooms",
+                 "extra_streams"]
+
+    def __init__(self, stream_key, stream_id):
+        self.stream_key = stream_key
+        self.stream_id = stream_id
+        self.position = _stream_position(stream_key, stream_id)
+        self.users = set()
+        self.rooms = set()
+        self.extra_streams = set()
+
+    def advance(self, stream_id):
+        position = _stream_position(self.stream_key, stream_id)
+        if position > self.position:
+            self.stream_id = stream_id
+            self.position = position
+
+
 class EventStreamResult(namedtuple("EventStreamResult", ("events", "tokens"))):
     def __nonzero__(self):
         return bool(self.events)
@@ -149,6 +190,11 @@ class Notifier(object):
         self.store = hs.get_datastore()
         self.pending_new_room_events = []
 
+        # Map of stream_key -> _PendingWakeup for the listeners we will wake
+        # at the end of this reactor tick.
+        self._pending_wakeups = {}
+        self._wakeup_scheduled = False
+
         self.clock = hs.get_clock()
 
         hs.get_distributor().observe(
@@ -256,23 +302,57 @@ class Notifier(object):
                      extra_streams=set()):
         """ Used to inform listeners that something has happend event wise.
 
-        Will wake up all listeners for the given users and rooms.
+        Will wake up all listeners for the given users and rooms. Wake ups are
+        coalesced until the end of the current reactor tick, so that a burst of
+        events only wakes each listener once, with the latest token for each
+        stream.
+        """
+        with PreserveLoggingContext():
+            wakeup = self._pending_wakeups.get(stream_key)
+            if wakeup is None:
+                wakeup = _PendingWakeup(stream_key, new_token)
+                self._pending_wakeups[stream_key] = wakeup
+            else:
+                wakeup.advance(new_token)
+
+            wakeup.users.update(str(user) for user in users)
+            wakeup.rooms.update(rooms)
+            wakeup.extra_streams.update(extra_streams)
+
+            if not self._wakeup_scheduled:
+                self._wakeup_scheduled = True
+                self.clock.call_later(0, self._wake_pending_streams)
+
+    def _wake_pending_streams(self):
+        """Wake up the listeners for everything passed to on_new_event since
+        the last time this was called.
         """
+        pending = self._pending_wakeups
+        self._pending_wakeups = {}
+        self._wakeup_scheduled = False
+
         with PreserveLoggingContext():
-            user_streams = set()
+            updates_by_stream = {}
+
+            for wakeup in pending.values():
+                user_streams = set(wakeup.extra_streams)
+
+                for user in wakeup.users:
+                    user_stream = self.user_to_user_stream.get(user)
+                    if user_stream is not None:
+                        user_streams.add(user_stream)
 
-            for user in users:
-                user_stream = self.user_to_user_stream.get(str(user))
-                if user_stream is not None:
-                    user_streams.add(user_stream)
+                for room in wakeup.rooms:
+                    user_streams |= self.room_to_user_streams.get(room, set())
 
-            for room in rooms:
-                user_streams |= self.room_to_user_streams.get(room, set())
+                update = (wakeup.stream_key, wakeup.stream_id)
+                for user_stream in user_streams:
+                    updates_by_stream.setdefault(user_stream, []).append(update)
 
             time_now_ms = self.clock.time_msec()
-            for user_stream in user_streams:
+            for user_stream, updates in updates_by_stream.items():
                 try:
-                    user_stream.notify(stream_key, new_token, time_now_ms)
+                    user_stream.notify_many(updates, time_now_ms)
                 except:
                     logger.exception("Failed to notify listener")
 
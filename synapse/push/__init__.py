@@ -327,18 +327,15 @@ class Pusher(object):
             "m.read",
         )
 
+        notifs_by_room = yield self.store.get_unread_push_counts_for_user(
+            self.user_id
+        )
+
         badge = len(invites)
 
         for r in joins:
-            if r.room_id in my_receipts_by_room:
-                last_unread_event_id = my_receipts_by_room[r.room_id]
-
-                notifs = yield (
-                    self.store.get_unread_event_push_actions_by_room_for_user(
-                        r.room_id, self.user_id, last_unread_event_id
-                    )
-                )
-                badge += notifs["notify_count"]
+            if r.room_id in my_receipts_by_room and r.room_id in notifs_by_room:
+                badge += notifs_by_room[r.room_id]["notify_count"]
         defer.returnValue(badge)
 
 
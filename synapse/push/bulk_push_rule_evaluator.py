@@ -107,7 +107,10 @@ class BulkPushRuleEvaluator:
             users_dict.items(), [event], {event.event_id: current_state}
         )
 
-        evaluator = PushRuleEvaluatorForEvent(event, len(self.users_in_room))
+        room_stats = yield self.store.get_room_stats(self.room_id)
+        evaluator = PushRuleEvaluatorForEvent(
+            event, room_stats["joined_members"]
+        )
 
         condition_cache = {}
 
@@ -125,10 +125,9 @@ class PushRuleEvaluator:
         if self.our_member_event:
             my_display_name = self.our_member_event[0].content.get("displayname")
 
-        room_members = yield self.store.get_users_in_room(room_id)
-        room_member_count = len(room_members)
+        room_stats = yield self.store.get_room_stats(room_id)
 
-        evaluator = PushRuleEvaluatorForEvent(ev, room_member_count)
+        evaluator = PushRuleEvaluatorForEvent(ev, room_stats["joined_members"])
 
         for r in self.rules:
             enabled = self.enabled_map.get(r['rule_id'], None)
@@ -46,5 +46,44 @@ class WhoisRestServlet(ClientV1RestServlet):
         defer.returnValue((200, ret))
 
 
+class SqlStatementsRestServlet(ClientV1RestServlet):
+    """Returns the most expensive SQL statements run by this server, if
+    statement profiling has been enabled with `profile_sql_statements`.
+    """
+    PATTERNS = client_path_patterns("/admin/sql_statements$")
+
+    ORDERINGS = ("total_time", "count", "max_time", "rows")
+
+    @defer.inlineCallbacks
+    def on_GET(self, request):
+        requester = yield self.auth.get_user_by_req(request)
+        is_admin = yield self.auth.is_server_admin(requester.user)
+
+        if not is_admin:
+            raise AuthError(403, "You are not a server admin")
+
+        try:
+            limit = int(request.args.get("limit", [50])[0])
+        except ValueError:
+            raise SynapseError(400, "limit must be an integer")
+        if limit < 1:
+            raise SynapseError(400, "limit must be positive")
+
+        order_by = request.args.get("order_by", ["total_time"])[0]
+        if order_by not in self.ORDERINGS:
+            raise SynapseError(
+                400, "order_by must be one of %s" % (", ".join(self.ORDERINGS),)
+            )
+
+        statements = self.handlers.admin_handler.get_sql_statement_profile(
+            limit, order_by
+        )
+        if statements is None:
+            raise SynapseError(404, "SQL statement profiling is not enabled")
+
+        defer.returnValue((200, {"statements": statements}))
+
+
 def register_servlets(hs, http_server):
     WhoisRestServlet(hs).register(http_server)
+    SqlStatementsRestServlet(hs).register(http_server)
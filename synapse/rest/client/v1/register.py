@@ -271,7 +271,8 @@ class RegisterRestServlet(ClientV1RestServlet):
         handler = self.handlers.registration_handler
         (user_id, token) = yield handler.register(
             localpart=desired_user_id,
-            password=password
+            password=password,
+            address=self.hs.get_ip_from_request(request),
         )
 
         if session[LoginType.EMAIL_IDENTITY]:
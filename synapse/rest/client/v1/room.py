@@ -22,6 +22,7 @@ from synapse.streams.config import PaginationConfig
 from synapse.api.constants import EventTypes, Membership
 from synapse.types import UserID, RoomID, RoomAlias
 from synapse.events.utils import serialize_event
+from synapse.http.servlet import parse_integer, parse_string
 
 import simplejson as json
 import logging
@@ -291,8 +292,13 @@ class PublicRoomListRestServlet(ClientV1RestServlet):
 
     @defer.inlineCallbacks
     def on_GET(self, request):
+        limit = parse_integer(request, "limit")
+        since_token = parse_string(request, "since")
+
         handler = self.handlers.room_list_handler
-        data = yield handler.get_public_room_list()
+        data = yield handler.get_public_room_list(
+            limit=limit, since_token=since_token,
+        )
         defer.returnValue((200, data))
 
 
@@ -61,7 +61,7 @@ class RegisterRestServlet(RestServlet):
             kind = request.args["kind"][0]
 
         if kind == "guest":
-            ret = yield self._do_guest_registration()
+            ret = yield self._do_guest_registration(request)
             defer.returnValue(ret)
             return
         elif kind != "user":
@@ -159,6 +159,7 @@ class RegisterRestServlet(RestServlet):
             localpart=desired_username,
             password=new_password,
             guest_access_token=guest_access_token,
+            address=self.hs.get_ip_from_request(request),
         )
 
         if result and LoginType.EMAIL_IDENTITY in result:
@@ -258,12 +259,13 @@ class RegisterRestServlet(RestServlet):
         defer.returnValue((200, ret))
 
     @defer.inlineCallbacks
-    def _do_guest_registration(self):
+    def _do_guest_registration(self, request):
         if not self.hs.config.allow_guest_access:
             defer.returnValue((403, "Guest access is disabled"))
         user_id, _ = yield self.registration_handler.register(
             generate_token=False,
-            make_guest=True
+            make_guest=True,
+            address=self.hs.get_ip_from_request(request),
         )
         access_token = self.auth_handler.generate_access_token(user_id, ["guest = true"])
         defer.returnValue((200, {
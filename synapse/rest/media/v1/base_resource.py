@@ -22,23 +22,45 @@ from synapse.api.errors import (
     cs_error, Codes, SynapseError
 )
 
-from twisted.internet import defer, threads
+from twisted.internet import defer
 from twisted.web.resource import Resource
 from twisted.protocols.basic import FileSender
+from twisted.python.failure import Failure
 
 from synapse.util.async import ObservableDeferred
 from synapse.util.stringutils import is_ascii
 from synapse.util.logcontext import preserve_context_over_fn
+import synapse.metrics
 
 import os
 
 import cgi
+import errno
+import hashlib
 import logging
+import time
 import urllib
 import urlparse
 
 logger = logging.getLogger(__name__)
 
+metrics = synapse.metrics.get_metrics_for(__name__)
+
+# Counts media whose content we already had stored, labelled by whether it was
+# a local upload or a remote download.
+deduplicated_media_counter = metrics.register_counter(
+    "deduplicated_media", labels=["source"],
+)
+deduplicated_bytes_counter = metrics.register_counter(
+    "deduplicated_bytes", labels=["source"],
+)
+
+# Time spent generating thumbnails in msec, split into waiting for a worker,
+# decoding the source image, resizing and encoding the thumbnails.
+thumbnail_stage_timer = metrics.register_histogram(
+    "thumbnail_stage_time", labels=["stage"],
+)
+
 
 def parse_media_id(request):
     try:
@@ -63,7 +85,7 @@ def parse_media_id(request):
 class BaseMediaResource(Resource):
     isLeaf = True
 
-    def __init__(self, hs, filepaths):
+    def __init__(self, hs, filepaths, thumbnail_pool):
         Resource.__init__(self)
         self.auth = hs.get_auth()
         self.client = MatrixFederationHttpClient(hs)
@@ -73,6 +95,7 @@ class BaseMediaResource(Resource):
         self.max_upload_size = hs.config.max_upload_size
         self.max_image_pixels = hs.config.max_image_pixels
         self.filepaths = filepaths
+        self.thumbnail_pool = thumbnail_pool
         self.version_string = hs.version_string
         self.downloads = {}
         self.dynamic_thumbnails = hs.config.dynamic_thumbnails
@@ -94,7 +117,99 @@ class BaseMediaResource(Resource):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+    def _move_to_blob(self, fname, sha256):
+        """Move a newly written file into the blob with the given hash, unless
+        we already have a copy of it.
+
+        This must only be called once the media referencing the blob has been
+        stored, so that the blob can't be evicted while we are moving it.
+        """
+        blob_path = self.filepaths.blob_filepath(sha256)
+        if os.path.exists(blob_path):
+            os.remove(fname)
+        else:
+            self._makedirs(blob_path)
+            os.rename(fname, blob_path)
+
+    @staticmethod
+    def _remove_upload(fname):
+        """Remove a partially stored file after a failure, without hiding the
+        failure if that fails too.
+        """
+        try:
+            os.remove(fname)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logger.warn("Failed to remove %s: %s", fname, e)
+
+    @staticmethod
+    def _record_deduplicated(source, media_length):
+        deduplicated_media_counter.inc(source)
+        deduplicated_bytes_counter.inc_by(media_length, source)
+
+    def _local_media_filepath(self, media_id, media_info):
+        sha256 = media_info.get("sha256")
+        if sha256:
+            return self.filepaths.blob_filepath(sha256)
+        return self.filepaths.local_media_filepath(media_id)
+
+    def _local_media_thumbnail(self, media_id, media_info, width, height,
+                               content_type, method):
+        sha256 = media_info.get("sha256")
+        if sha256:
+            return self.filepaths.blob_thumbnail(
+                sha256, width, height, content_type, method
+            )
+        return self.filepaths.local_media_thumbnail(
+            media_id, width, height, content_type, method
+        )
+
+    def _remote_media_filepath(self, server_name, media_info):
+        sha256 = media_info.get("sha256")
+        if sha256:
+            return self.filepaths.blob_filepath(sha256)
+        return self.filepaths.remote_media_filepath(
+            server_name, media_info["filesystem_id"]
+        )
+
+    def _remote_media_thumbnail(self, server_name, file_id, media_info, width,
+                                height, content_type, method):
+        sha256 = media_info.get("sha256")
+        if sha256:
+            return self.filepaths.blob_thumbnail(
+                sha256, width, height, content_type, method
+            )
+        return self.filepaths.remote_media_thumbnail(
+            server_name, file_id, width, height, content_type, method
+        )
+
+    def _store_local_thumbnail(self, media_id, media_info, t_width, t_height,
+                               t_type, t_method, t_len):
+        sha256 = media_info.get("sha256")
+        if sha256:
+            return self.store.store_media_blob_thumbnail(
+                sha256, t_width, t_height, t_type, t_method, t_len
+            )
+        return self.store.store_local_thumbnail(
+            media_id, t_width, t_height, t_type, t_method, t_len
+        )
+
+    def _store_remote_thumbnail(self, server_name, media_id, file_id,
+                                media_info, t_width, t_height, t_type,
+                                t_method, t_len):
+        sha256 = media_info.get("sha256")
+        if sha256:
+            return self.store.store_media_blob_thumbnail(
+                sha256, t_width, t_height, t_type, t_method, t_len
+            )
+        return self.store.store_remote_media_thumbnail(
+            server_name, media_id, file_id,
+            t_width, t_height, t_type, t_method, t_len
+        )
+
     def _get_remote_media(self, server_name, media_id):
+        self.store.mark_remote_media_accessed(server_name, media_id)
+
         key = (server_name, media_id)
         download = self.downloads.get(key)
         if download is None:
@@ -136,10 +251,12 @@ class BaseMediaResource(Resource):
                 request_path = "/".join((
                     "/_matrix/media/v1/download", server_name, media_id,
                 ))
+                output_stream = _HashingWriter(f)
                 length, headers = yield self.client.get_file(
-                    server_name, request_path, output_stream=f,
+                    server_name, request_path, output_stream=output_stream,
                     max_size=self.max_upload_size,
                 )
+            sha256 = output_stream.hexdigest()
             media_type = headers["Content-Type"][0]
             time_now_ms = self.clock.time_msec()
 
@@ -169,7 +286,7 @@ class BaseMediaResource(Resource):
             else:
                 upload_name = None
 
-            yield self.store.store_cached_remote_media(
+            sha256, deduplicated = yield self.store.store_cached_remote_media(
                 origin=server_name,
                 media_id=media_id,
                 media_type=media_type,
@@ -177,25 +294,60 @@ class BaseMediaResource(Resource):
                 upload_name=upload_name,
                 media_length=length,
                 filesystem_id=file_id,
+                sha256=sha256,
             )
-        except:
-            os.remove(fname)
+        except Exception:
+            self._remove_upload(fname)
             raise
 
+        if sha256:
+            try:
+                self._move_to_blob(fname, sha256)
+            except Exception:
+                # Forget the media, so that the next request downloads it
+                # again rather than finding it without a file. We capture the
+                # failure first, as yielding loses it.
+                f = Failure()
+                self._remove_upload(fname)
+                yield self.store.delete_remote_media([{
+                    "media_origin": server_name,
+                    "media_id": media_id,
+                    "sha256": sha256,
+                }])
+                f.raiseException()
+
         media_info = {
             "media_type": media_type,
             "media_length": length,
             "upload_name": upload_name,
             "created_ts": time_now_ms,
             "filesystem_id": file_id,
+            "sha256": sha256,
         }
 
+        if deduplicated:
+            self._record_deduplicated("remote", length)
+
+        # The blob may not have every thumbnail we want if it was first stored
+        # under a different media type, or if making them failed then.
         yield self._generate_remote_thumbnails(
             server_name, media_id, media_info
         )
 
         defer.returnValue(media_info)
 
+    def _make_etag(self, request, file_path):
+        """Media and thumbnails never change once written, so a strong ETag
+        only needs to identify the media that was requested and the file that
+        was served for it.
+        """
+        server_name, media_id = request.postpath[:2]
+        key = "\0".join((
+            server_name, media_id,
+            os.path.relpath(file_path, self.filepaths.base_path),
+        ))
+        return b'"%s"' % (hashlib.sha1(key).hexdigest(),)
+
     @defer.inlineCallbacks
     def _respond_with_file(self, request, media_type, file_path,
                            file_size=None, upload_name=None):
@@ -227,16 +379,54 @@ class BaseMediaResource(Resource):
             request.setHeader(
                 b"Cache-Control", b"public,max-age=86400,s-maxage=86400"
             )
+
+            etag = self._make_etag(request, file_path)
+            request.setHeader(b"ETag", etag)
+            request.setHeader(b"Accept-Ranges", b"bytes")
+
+            if _etag_matches(request.getHeader(b"If-None-Match"), etag):
+                request.setResponseCode(304)
+                request.finish()
+                return
+
             if file_size is None:
                 stat = os.stat(file_path)
                 file_size = stat.st_size
 
+            byte_range = None
+            range_header = request.getHeader(b"Range")
+            if range_header:
+                # Only honour the range if the client's copy is still current.
+                if_range = request.getHeader(b"If-Range")
+                if if_range is None or if_range.strip() == etag:
+                    try:
+                        byte_range = _parse_byte_range(range_header, file_size)
+                    except SynapseError:
+                        request.setHeader(
+                            b"Content-Range", b"bytes */%d" % (file_size,)
+                        )
+                        raise
+
+            if byte_range:
+                start, end = byte_range
+                length = end - start + 1
+                request.setResponseCode(206)
+                request.setHeader(
+                    b"Content-Range", b"bytes %d-%d/%d" % (start, end, file_size)
+                )
+            else:
+                start, length = 0, file_size
+
             request.setHeader(
-                b"Content-Length", b"%d" % (file_size,)
+                b"Content-Length", b"%d" % (length,)
             )
 
             with open(file_path, "rb") as f:
-                yield FileSender().beginFileTransfer(f, request)
+                if start:
+                    f.seek(start)
+                yield FileSender().beginFileTransfer(
+                    _BoundedFile(f, length), request
+                )
 
             request.finish()
         else:
@@ -245,75 +435,131 @@ class BaseMediaResource(Resource):
     def _get_thumbnail_requirements(self, media_type):
         return self.thumbnail_requirements.get(media_type, ())
 
-    def _generate_thumbnail(self, input_path, t_path, t_width, t_height,
-                            t_method, t_type):
-        thumbnailer = Thumbnailer(input_path)
-        m_width = thumbnailer.width
-        m_height = thumbnailer.height
-
-        if m_width * m_height >= self.max_image_pixels:
-            logger.info(
-                "Image too large to thumbnail %r x %r > %r",
-                m_width, m_height, self.max_image_pixels
-            )
-            return
+    @defer.inlineCallbacks
+    def _generate_thumbnails(self, input_path, thumbnails):
+        """Make thumbnails of an image in the thumbnail pool.
+
+        Args:
+            input_path (str): The image to thumbnail.
+            thumbnails (list): (t_path, t_width, t_height, t_method, t_type)
+                tuples describing the thumbnails to make.
+
+        Returns:
+            Deferred[list]: The length of each thumbnail, or None if it wasn't
+            made.
+        """
+        start = time.time()
+        stage_times, t_lens = yield preserve_context_over_fn(
+            self.thumbnail_pool.generate_thumbnails,
+            input_path, thumbnails, self.max_image_pixels,
+        )
 
-        if t_method == "crop":
-            t_len = thumbnailer.crop(t_path, t_width, t_height, t_type)
-        elif t_method == "scale":
-            t_len = thumbnailer.scale(t_path, t_width, t_height, t_type)
-        else:
-            t_len = None
+        # Anything we didn't spend in the worker was spent waiting for one.
+        queued = time.time() - start - sum(stage_times.values())
+        thumbnail_stage_timer.inc_by(max(queued, 0) * 1000, "queued")
+        for stage, duration in stage_times.items():
+            thumbnail_stage_timer.inc_by(duration * 1000, stage)
 
-        return t_len
+        defer.returnValue(t_lens)
 
     @defer.inlineCallbacks
-    def _generate_local_exact_thumbnail(self, media_id, t_width, t_height,
-                                        t_method, t_type):
-        input_path = self.filepaths.local_media_filepath(media_id)
+    def _generate_local_exact_thumbnail(self, media_id, media_info, t_width,
+                                        t_height, t_method, t_type):
+        input_path = self._local_media_filepath(media_id, media_info)
 
-        t_path = self.filepaths.local_media_thumbnail(
-            media_id, t_width, t_height, t_type, t_method
+        t_path = self._local_media_thumbnail(
+            media_id, media_info, t_width, t_height, t_type, t_method
         )
         self._makedirs(t_path)
 
-        t_len = yield preserve_context_over_fn(
-            threads.deferToThread,
-            self._generate_thumbnail,
-            input_path, t_path, t_width, t_height, t_method, t_type
+        t_len, = yield self._generate_thumbnails(
+            input_path, [(t_path, t_width, t_height, t_method, t_type)],
         )
 
         if t_len:
-            yield self.store.store_local_thumbnail(
-                media_id, t_width, t_height, t_type, t_method, t_len
+            yield self._store_local_thumbnail(
+                media_id, media_info, t_width, t_height, t_type, t_method, t_len
             )
 
             defer.returnValue(t_path)
 
     @defer.inlineCallbacks
     def _generate_remote_exact_thumbnail(self, server_name, file_id, media_id,
-                                         t_width, t_height, t_method, t_type):
-        input_path = self.filepaths.remote_media_filepath(server_name, file_id)
+                                         media_info, t_width, t_height,
+                                         t_method, t_type):
+        input_path = self._remote_media_filepath(server_name, media_info)
 
-        t_path = self.filepaths.remote_media_thumbnail(
-            server_name, file_id, t_width, t_height, t_type, t_method
+        t_path = self._remote_media_thumbnail(
+            server_name, file_id, media_info, t_width, t_height, t_type, t_method
         )
         self._makedirs(t_path)
 
-        t_len = yield preserve_context_over_fn(
-            threads.deferToThread,
-            self._generate_thumbnail,
-            input_path, t_path, t_width, t_height, t_method, t_type
+        t_len, = yield self._generate_thumbnails(
+            input_path, [(t_path, t_width, t_height, t_method, t_type)],
         )
 
         if t_len:
-            yield self.store.store_remote_media_thumbnail(
-                server_name, media_id, file_id,
+            yield self._store_remote_thumbnail(
+                server_name, media_id, file_id, media_info,
                 t_width, t_height, t_type, t_method, t_len
             )
 
             defer.returnValue(t_path)
 
+    def _get_thumbnail_sizes(self, thumbnailer, requirements):
+        """Work out which thumbnails to make to satisfy the requirements.
+
+        Returns:
+            list: (t_width, t_height, t_method, t_type) tuples.
+        """
+        m_width = thumbnailer.width
+        m_height = thumbnailer.height
+
+        scales = set()
+        crops = set()
+        for r_width, r_height, r_method, r_type in requirements:
+            if r_method == "scale":
+                t_width, t_height = thumbnailer.aspect(r_width, r_height)
+                scales.add((
+                    min(m_width, t_width), min(m_height, t_height), r_type,
+                ))
+            elif r_method == "crop":
+                crops.add((r_width, r_height, r_type))
+
+        sizes = [(w, h, "scale", t) for w, h, t in scales]
+        for t_width, t_height, t_type in crops:
+            if (t_width, t_height, t_type) in scales:
+                # If the aspect ratio of the cropped thumbnail matches a purely
+                # scaled one then there is no point in calculating a separate
+                # thumbnail.
+                continue
+            sizes.append((t_width, t_height, "crop", t_type))
+
+        return sizes
+
+    @defer.inlineCallbacks
+    def _get_missing_thumbnail_sizes(self, media_info, sizes):
+        """Filter out the thumbnails that the media's blob already has, e.g.
+        because other media with the same content made them.
+
+        Returns:
+            Deferred[list]: The (t_width, t_height, t_method, t_type) tuples
+            from sizes that still need making.
+        """
+        sha256 = media_info.get("sha256")
+        if not sha256:
+            defer.returnValue(sizes)
+
+        existing = yield self.store.get_media_blob_thumbnails(sha256)
+        existing = set(
+            (
+                t["thumbnail_width"], t["thumbnail_height"],
+                t["thumbnail_method"], t["thumbnail_type"],
+            )
+            for t in existing
+        )
+        defer.returnValue([size for size in sizes if size not in existing])
+
     @defer.inlineCallbacks
     def _generate_local_thumbnails(self, media_id, media_info):
         media_type = media_info["media_type"]
@@ -321,7 +567,7 @@ class BaseMediaResource(Resource):
         if not requirements:
             return
 
-        input_path = self.filepaths.local_media_filepath(media_id)
+        input_path = self._local_media_filepath(media_id, media_info)
         thumbnailer = Thumbnailer(input_path)
         m_width = thumbnailer.width
         m_height = thumbnailer.height
@@ -333,52 +579,30 @@ class BaseMediaResource(Resource):
             )
             return
 
-        local_thumbnails = []
-
-        def generate_thumbnails():
-            scales = set()
-            crops = set()
-            for r_width, r_height, r_method, r_type in requirements:
-                if r_method == "scale":
-                    t_width, t_height = thumbnailer.aspect(r_width, r_height)
-                    scales.add((
-                        min(m_width, t_width), min(m_height, t_height), r_type,
-                    ))
-                elif r_method == "crop":
-                    crops.add((r_width, r_height, r_type))
-
-            for t_width, t_height, t_type in scales:
-                t_method = "scale"
-                t_path = self.filepaths.local_media_thumbnail(
-                    media_id, t_width, t_height, t_type, t_method
-                )
-                self._makedirs(t_path)
-                t_len = thumbnailer.scale(t_path, t_width, t_height, t_type)
-
-                local_thumbnails.append((
-                    media_id, t_width, t_height, t_type, t_method, t_len
-                ))
-
-            for t_width, t_height, t_type in crops:
-                if (t_width, t_height, t_type) in scales:
-                    # If the aspect ratio of the cropped thumbnail matches a purely
-                    # scaled one then there is no point in calculating a separate
-                    # thumbnail.
-                    continue
-                t_method = "crop"
-                t_path = self.filepaths.local_media_thumbnail(
-                    media_id, t_width, t_height, t_type, t_method
-                )
-                self._makedirs(t_path)
-                t_len = thumbnailer.crop(t_path, t_width, t_height, t_type)
-                local_thumbnails.append((
-                    media_id, t_width, t_height, t_type, t_method, t_len
-                ))
+        sizes = self._get_thumbnail_sizes(thumbnailer, requirements)
+        sizes = yield self._get_missing_thumbnail_sizes(media_info, sizes)
+        if not sizes:
+            defer.returnValue({
+                "width": m_width,
+                "height": m_height,
+            })
+
+        thumbnails = []
+        for t_width, t_height, t_method, t_type in sizes:
+            t_path = self._local_media_thumbnail(
+                media_id, media_info, t_width, t_height, t_type, t_method
+            )
+            self._makedirs(t_path)
+            thumbnails.append((t_path, t_width, t_height, t_method, t_type))
 
-        yield preserve_context_over_fn(threads.deferToThread, generate_thumbnails)
+        t_lens = yield self._generate_thumbnails(input_path, thumbnails)
 
-        for l in local_thumbnails:
-            yield self.store.store_local_thumbnail(*l)
+        for (t_width, t_height, t_method, t_type), t_len in zip(sizes, t_lens):
+            if t_len is None:
+                continue
+            yield self._store_local_thumbnail(
+                media_id, media_info, t_width, t_height, t_type, t_method, t_len
+            )
 
         defer.returnValue({
             "width": m_width,
@@ -393,67 +617,131 @@ class BaseMediaResource(Resource):
         if not requirements:
             return
 
-        remote_thumbnails = []
-
-        input_path = self.filepaths.remote_media_filepath(server_name, file_id)
+        input_path = self._remote_media_filepath(server_name, media_info)
         thumbnailer = Thumbnailer(input_path)
         m_width = thumbnailer.width
         m_height = thumbnailer.height
 
-        def generate_thumbnails():
-            if m_width * m_height >= self.max_image_pixels:
-                logger.info(
-                    "Image too large to thumbnail %r x %r > %r",
-                    m_width, m_height, self.max_image_pixels
-                )
-                return
+        if m_width * m_height >= self.max_image_pixels:
+            logger.info(
+                "Image too large to thumbnail %r x %r > %r",
+                m_width, m_height, self.max_image_pixels
+            )
+            return
 
-            scales = set()
-            crops = set()
-            for r_width, r_height, r_method, r_type in requirements:
-                if r_method == "scale":
-                    t_width, t_height = thumbnailer.aspect(r_width, r_height)
-                    scales.add((
-                        min(m_width, t_width), min(m_height, t_height), r_type,
-                    ))
-                elif r_method == "crop":
-                    crops.add((r_width, r_height, r_type))
-
-            for t_width, t_height, t_type in scales:
-                t_method = "scale"
-                t_path = self.filepaths.remote_media_thumbnail(
-                    server_name, file_id, t_width, t_height, t_type, t_method
-                )
-                self._makedirs(t_path)
-                t_len = thumbnailer.scale(t_path, t_width, t_height, t_type)
-                remote_thumbnails.append([
-                    server_name, media_id, file_id,
-                    t_width, t_height, t_type, t_method, t_len
-                ])
-
-            for t_width, t_height, t_type in crops:
-                if (t_width, t_height, t_type) in scales:
-                    # If the aspect ratio of the cropped thumbnail matches a purely
-                    # scaled one then there is no point in calculating a separate
-                    # thumbnail.
-                    continue
-                t_method = "crop"
-                t_path = self.filepaths.remote_media_thumbnail(
-                    server_name, file_id, t_width, t_height, t_type, t_method
-                )
-                self._makedirs(t_path)
-                t_len = thumbnailer.crop(t_path, t_width, t_height, t_type)
-                remote_thumbnails.append([
-                    server_name, media_id, file_id,
-                    t_width, t_height, t_type, t_method, t_len
-                ])
+        sizes = self._get_thumbnail_sizes(thumbnailer, requirements)
+        sizes = yield self._get_missing_thumbnail_sizes(media_info, sizes)
+        if not sizes:
+            defer.returnValue({
+                "width": m_width,
+                "height": m_height,
+            })
+
+        thumbnails = []
+        for t_width, t_height, t_method, t_type in sizes:
+            t_path = self._remote_media_thumbnail(
+                server_name, file_id, media_info,
+                t_width, t_height, t_type, t_method
+            )
+            self._makedirs(t_path)
+            thumbnails.append((t_path, t_width, t_height, t_method, t_type))
 
-        yield preserve_context_over_fn(threads.deferToThread, generate_thumbnails)
+        t_lens = yield self._generate_thumbnails(input_path, thumbnails)
 
-        for r in remote_thumbnails:
-            yield self.store.store_remote_media_thumbnail(*r)
+        for (t_width, t_height, t_method, t_type), t_len in zip(sizes, t_lens):
+            if t_len is None:
+                continue
+            yield self._store_remote_thumbnail(
+                server_name, media_id, file_id, media_info,
+                t_width, t_height, t_type, t_method, t_len
+            )
 
         defer.returnValue({
             "width": m_width,
             "height": m_height,
         })
+
+
+def _etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header matches the given ETag"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison.
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
+def _parse_byte_range(range_header, file_size):
+    """Parse a Range header for a single byte range.
+
+    Returns:
+        (int, int): The first and last bytes of the range, or None if the
+        header is malformed or asks for several ranges, in which case the
+        whole file should be sent.
+
+    Raises:
+        SynapseError(416) if the range lies outside the file.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+
+    start, sep, end = ranges.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if start:
+            start = int(start)
+            end = int(end) if end else file_size - 1
+        elif end:
+            # A suffix range, for the last `end` bytes.
+            start = max(file_size - int(end), 0)
+            end = file_size - 1 if int(end) else -1
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if start > end and start < file_size:
+        return None
+
+    if start >= file_size or end < 0:
+        raise SynapseError(
+            416, "Requested range not satisfiable", Codes.UNKNOWN,
+        )
+
+    return start, min(end, file_size - 1)
+
+
+class _BoundedFile(object):
+    """Wraps a file so that at most `length` bytes can be read from it"""
+
+    def __init__(self, f, length):
+        self._f = f
+        self._remaining = length
+
+    def read(self, size):
+        data = self._f.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+
+class _HashingWriter(object):
+    """Wraps a file, keeping a running sha256 of everything written to it"""
+
+    def __init__(self, f):
+        self._f = f
+        self._hasher = hashlib.sha256()
+
+    def write(self, data):
+        self._hasher.update(data)
+        self._f.write(data)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
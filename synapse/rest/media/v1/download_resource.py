@@ -50,7 +50,7 @@ class DownloadResource(BaseMediaResource):
         media_type = media_info["media_type"]
         media_length = media_info["media_length"]
         upload_name = name if name else media_info["upload_name"]
-        file_path = self.filepaths.local_media_filepath(media_id)
+        file_path = self._local_media_filepath(media_id, media_info)
 
         yield self._respond_with_file(
             request, media_type, file_path, media_length,
@@ -63,12 +63,9 @@ class DownloadResource(BaseMediaResource):
 
         media_type = media_info["media_type"]
         media_length = media_info["media_length"]
-        filesystem_id = media_info["filesystem_id"]
         upload_name = name if name else media_info["upload_name"]
 
-        file_path = self.filepaths.remote_media_filepath(
-            server_name, filesystem_id
-        )
+        file_path = self._remote_media_filepath(server_name, media_info)
 
         yield self._respond_with_file(
             request, media_type, file_path, media_length,
@@ -56,12 +56,35 @@ class MediaFilePaths(object):
             file_id[0:2], file_id[2:4], file_id[4:]
         )
 
+    def remote_media_thumbnail_dir(self, server_name, file_id):
+        return os.path.join(
+            self.base_path, "remote_thumbnail", server_name,
+            file_id[0:2], file_id[2:4], file_id[4:]
+        )
+
     def remote_media_thumbnail(self, server_name, file_id, width, height,
                                content_type, method):
         top_level_type, sub_type = content_type.split("/")
         file_name = "%i-%i-%s-%s" % (width, height, top_level_type, sub_type)
         return os.path.join(
-            self.base_path, "remote_thumbnail", server_name,
-            file_id[0:2], file_id[2:4], file_id[4:],
-            file_name
+            self.remote_media_thumbnail_dir(server_name, file_id), file_name
+        )
+
+    def blob_filepath(self, sha256):
+        return os.path.join(
+            self.base_path, "blobs",
+            sha256[0:2], sha256[2:4], sha256[4:]
+        )
+
+    def blob_thumbnail_dir(self, sha256):
+        return os.path.join(
+            self.base_path, "blob_thumbnails",
+            sha256[0:2], sha256[2:4], sha256[4:]
+        )
+
+    def blob_thumbnail(self, sha256, width, height, content_type, method):
+        top_level_type, sub_type = content_type.split("/")
+        file_name = "%i-%i-%s-%s-%s" % (
+            width, height, top_level_type, sub_type, method
         )
+        return os.path.join(self.blob_thumbnail_dir(sha256), file_name)
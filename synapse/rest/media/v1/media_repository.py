@@ -18,6 +18,8 @@ from .download_resource import DownloadResource
 from .thumbnail_resource import ThumbnailResource
 from .identicon_resource import IdenticonResource
 from .filepath import MediaFilePaths
+from .thumbnailer import ThumbnailPool
+from .remote_media_evictor import RemoteMediaEvictor
 
 from twisted.web.resource import Resource
 
@@ -74,7 +76,13 @@ class MediaRepositoryResource(Resource):
     def __init__(self, hs):
         Resource.__init__(self)
         filepaths = MediaFilePaths(hs.config.media_store_path)
-        self.putChild("upload", UploadResource(hs, filepaths))
-        self.putChild("download", DownloadResource(hs, filepaths))
-        self.putChild("thumbnail", ThumbnailResource(hs, filepaths))
+        thumbnail_pool = ThumbnailPool(
+            hs.get_clock(), hs.config.thumbnail_threads
+        )
+        self.putChild("upload", UploadResource(hs, filepaths, thumbnail_pool))
+        self.putChild("download", DownloadResource(hs, filepaths, thumbnail_pool))
+        self.putChild("thumbnail", ThumbnailResource(hs, filepaths, thumbnail_pool))
         self.putChild("identicon", IdenticonResource())
+
+        self.remote_media_evictor = RemoteMediaEvictor(hs, filepaths)
+        self.remote_media_evictor.start()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014-2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer, threads
+
+from synapse.util.logcontext import preserve_context_over_fn
+import synapse.metrics
+
+import errno
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+metrics = synapse.metrics.get_metrics_for(__name__)
+
+evicted_media_counter = metrics.register_counter("evicted_remote_media")
+evicted_bytes_counter = metrics.register_counter("evicted_remote_media_bytes")
+
+# How often we check whether the remote media cache is over its size limit.
+EVICTION_INTERVAL_MS = 10 * 60 * 1000
+
+# How many pieces of media to delete in each transaction.
+EVICTION_BATCH_SIZE = 500
+
+
+class RemoteMediaEvictor(object):
+    """Keeps the cache of remote media and its thumbnails within
+    `max_remote_media_cache_size` by periodically deleting the least recently
+    accessed media.
+    """
+
+    def __init__(self, hs, filepaths):
+        self.store = hs.get_datastore()
+        self.clock = hs.get_clock()
+        self.filepaths = filepaths
+        self.max_size = hs.config.max_remote_media_cache_size
+        self._evicting = False
+
+    def start(self):
+        if self.max_size:
+            self.clock.looping_call(self.evict, EVICTION_INTERVAL_MS)
+
+    @defer.inlineCallbacks
+    def evict(self):
+        """Delete remote media until the cache is within its size limit.
+
+        Returns:
+            Deferred[int]: The number of bytes freed on disk.
+        """
+        if self._evicting:
+            defer.returnValue(0)
+
+        self._evicting = True
+        try:
+            freed = yield self._evict()
+        except Exception:
+            # This is called from a looping call, which would stop if we let
+            # the failure propagate.
+            logger.exception("Failed to evict remote media")
+            freed = 0
+        finally:
+            self._evicting = False
+
+        defer.returnValue(freed)
+
+    @defer.inlineCallbacks
+    def _evict(self):
+        size = yield self.store.get_remote_media_cache_size()
+        excess = size - self.max_size
+
+        evicted = 0
+        freed = 0
+        while excess > 0:
+            # Write out any recent accesses first, so that we don't evict media
+            # that has just been served.
+            yield self.store.flush_remote_media_accesses()
+
+            media = yield self.store.get_least_recently_accessed_remote_media(
+                EVICTION_BATCH_SIZE
+            )
+            if not media:
+                break
+
+            # We don't count the thumbnails here, so we may evict slightly
+            # more than we strictly need to.
+            batch = []
+            batch_excess = excess
+            for m in media:
+                if batch_excess <= 0:
+                    break
+                batch.append(m)
+                batch_excess -= m["media_length"]
+
+            unused_blobs = yield self.store.delete_remote_media(batch)
+
+            # The blobs may have been reused since we deleted the media, so
+            # only delete the ones that are still unused after marking them.
+            unused_blobs = yield self.store.mark_media_blobs_deleting(
+                unused_blobs
+            )
+
+            # Blobs are counted once however many media use them, so evicting
+            # media whose blob is still used by other media frees nothing.
+            blob_lengths = {
+                m["sha256"]: m["media_length"] for m in batch if m["sha256"]
+            }
+            excess -= sum(m["media_length"] for m in batch if not m["sha256"])
+            excess -= sum(
+                blob_lengths[sha256] for sha256 in set(unused_blobs)
+                if sha256 in blob_lengths
+            )
+            freed += yield preserve_context_over_fn(
+                threads.deferToThread, self._delete_files, batch, unused_blobs
+            )
+            yield self.store.delete_media_blobs(unused_blobs)
+            evicted += len(batch)
+
+        if evicted:
+            evicted_media_counter.inc_by(evicted)
+            evicted_bytes_counter.inc_by(freed)
+            logger.info(
+                "Evicted %d remote media, freeing %d bytes", evicted, freed
+            )
+
+        defer.returnValue(freed)
+
+    def _delete_files(self, media, unused_blobs):
+        """Delete the files of evicted remote media. Media stored in a blob
+        is only deleted once nothing else uses the blob.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        freed = 0
+        for m in media:
+            if m["sha256"]:
+                continue
+            freed += _remove_path(self.filepaths.remote_media_filepath(
+                m["media_origin"], m["filesystem_id"]
+            ))
+            freed += _remove_path(self.filepaths.remote_media_thumbnail_dir(
+                m["media_origin"], m["filesystem_id"]
+            ))
+
+        for sha256 in unused_blobs:
+            freed += _remove_path(self.filepaths.blob_filepath(sha256))
+            freed += _remove_path(self.filepaths.blob_thumbnail_dir(sha256))
+
+        return freed
+
+
+def _remove_path(path):
+    """Remove a file or directory tree, if it exists.
+
+    Returns:
+        int: The total size of the files removed.
+    """
+    try:
+        if not os.path.isdir(path):
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+        shutil.rmtree(path)
+        return size
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return 0
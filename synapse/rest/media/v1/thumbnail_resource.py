@@ -83,8 +83,8 @@ class ThumbnailResource(BaseMediaResource):
             t_type = thumbnail_info["thumbnail_type"]
             t_method = thumbnail_info["thumbnail_method"]
 
-            file_path = self.filepaths.local_media_thumbnail(
-                media_id, t_width, t_height, t_type, t_method,
+            file_path = self._local_media_thumbnail(
+                media_id, media_info, t_width, t_height, t_type, t_method,
             )
             yield self._respond_with_file(request, t_type, file_path)
 
@@ -111,8 +111,9 @@ class ThumbnailResource(BaseMediaResource):
             t_type = info["thumbnail_type"] == desired_type
 
             if t_w and t_h and t_method and t_type:
-                file_path = self.filepaths.local_media_thumbnail(
-                    media_id, desired_width, desired_height, desired_type, desired_method,
+                file_path = self._local_media_thumbnail(
+                    media_id, media_info, desired_width, desired_height,
+                    desired_type, desired_method,
                 )
                 yield self._respond_with_file(request, desired_type, file_path)
                 return
@@ -121,7 +122,8 @@ class ThumbnailResource(BaseMediaResource):
 
         # Okay, so we generate one.
         file_path = yield self._generate_local_exact_thumbnail(
-            media_id, desired_width, desired_height, desired_method, desired_type
+            media_id, media_info, desired_width, desired_height, desired_method,
+            desired_type
         )
 
         if file_path:
@@ -151,9 +153,9 @@ class ThumbnailResource(BaseMediaResource):
             t_type = info["thumbnail_type"] == desired_type
 
             if t_w and t_h and t_method and t_type:
-                file_path = self.filepaths.remote_media_thumbnail(
-                    server_name, file_id, desired_width, desired_height,
-                    desired_type, desired_method,
+                file_path = self._remote_media_thumbnail(
+                    server_name, file_id, media_info, desired_width,
+                    desired_height, desired_type, desired_method,
                 )
                 yield self._respond_with_file(request, desired_type, file_path)
                 return
@@ -162,7 +164,7 @@ class ThumbnailResource(BaseMediaResource):
 
         # Okay, so we generate one.
         file_path = yield self._generate_remote_exact_thumbnail(
-            server_name, file_id, media_id, desired_width,
+            server_name, file_id, media_id, media_info, desired_width,
             desired_height, desired_method, desired_type
         )
 
@@ -196,8 +198,9 @@ class ThumbnailResource(BaseMediaResource):
             file_id = thumbnail_info["filesystem_id"]
             t_length = thumbnail_info["thumbnail_length"]
 
-            file_path = self.filepaths.remote_media_thumbnail(
-                server_name, file_id, t_width, t_height, t_type, t_method,
+            file_path = self._remote_media_thumbnail(
+                server_name, file_id, media_info,
+                t_width, t_height, t_type, t_method,
             )
             yield self._respond_with_file(request, t_type, file_path, t_length)
         else:
@@ -239,7 +242,7 @@ class ThumbnailResource(BaseMediaResource):
         file_path = self.filepaths.default_thumbnail(
             top_level_type, sub_type, t_width, t_height, t_type, t_method,
         )
-        yield self.respond_with_file(request, t_type, file_path, t_length)
+        yield self._respond_with_file(request, t_type, file_path, t_length)
 
     def _select_thumbnail(self, desired_width, desired_height, desired_method,
                           desired_type, thumbnail_infos):
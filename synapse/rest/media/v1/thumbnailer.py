@@ -13,9 +13,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
 import PIL.Image as Image
 from io import BytesIO
 
+import time
+
+
+# How long to wait for the thumbnails of an image before giving up on them.
+THUMBNAIL_TIMEOUT_SECONDS = 60
+
 
 class Thumbnailer(object):
 
@@ -46,11 +55,40 @@ class Thumbnailer(object):
         else:
             return ((max_height * self.width) // self.height, max_height)
 
+    def load(self, width, height):
+        """Decode the image, which is only needed for thumbnails no bigger
+        than the given size. JPEGs are decoded at a reduced resolution if they
+        are much larger than that, which is far quicker and uses far less
+        memory than decoding the full image.
+        """
+        self.image.draft(self.image.mode, (width, height))
+        self.image.load()
+
+    def shrink(self, width, height):
+        """Replace the image with a copy resized to the given size, if it is
+        larger than that, so that smaller thumbnails can be made from the
+        copy rather than from the full image.
+        """
+        if width * height < self.image.size[0] * self.image.size[1]:
+            self.image = self.image.resize((width, height), Image.ANTIALIAS)
+
+    def crop_size(self, width, height):
+        """The size the image is scaled to before being cropped to the given
+        dimensions.
+        """
+        if width * self.height > height * self.width:
+            return (width, (width * self.height) // self.width)
+        else:
+            return ((height * self.width) // self.height, height)
+
     def scale(self, output_path, width, height, output_type):
         """Rescales the image to the given dimensions"""
-        scaled = self.image.resize((width, height), Image.ANTIALIAS)
+        scaled = self.scale_image(width, height)
         return self.save_image(scaled, output_type, output_path)
 
+    def scale_image(self, width, height):
+        return self.image.resize((width, height), Image.ANTIALIAS)
+
     def crop(self, output_path, width, height, output_type):
         """Rescales and crops the image to the given dimensions preserving
         aspect::
@@ -62,23 +100,22 @@ class Thumbnailer(object):
             max_width: The largest possible width.
             max_height: The larget possible height.
         """
-        if width * self.height > height * self.width:
-            scaled_height = (width * self.height) // self.width
-            scaled_image = self.image.resize(
-                (width, scaled_height), Image.ANTIALIAS
-            )
+        cropped = self.crop_image(width, height)
+        return self.save_image(cropped, output_type, output_path)
+
+    def crop_image(self, width, height):
+        scaled_width, scaled_height = self.crop_size(width, height)
+        scaled_image = self.image.resize(
+            (scaled_width, scaled_height), Image.ANTIALIAS
+        )
+        if scaled_width == width:
             crop_top = (scaled_height - height) // 2
             crop_bottom = height + crop_top
-            cropped = scaled_image.crop((0, crop_top, width, crop_bottom))
+            return scaled_image.crop((0, crop_top, width, crop_bottom))
         else:
-            scaled_width = (height * self.width) // self.height
-            scaled_image = self.image.resize(
-                (scaled_width, height), Image.ANTIALIAS
-            )
             crop_left = (scaled_width - width) // 2
             crop_right = width + crop_left
-            cropped = scaled_image.crop((crop_left, 0, crop_right, height))
-        return self.save_image(cropped, output_type, output_path)
+            return scaled_image.crop((crop_left, 0, crop_right, height))
 
     def save_image(self, output_image, output_type, output_path):
         output_bytes_io = BytesIO()
@@ -87,3 +124,131 @@ class Thumbnailer(object):
         with open(output_path, "wb") as output_file:
             output_file.write(output_bytes)
         return len(output_bytes)
+
+
+def generate_thumbnails(input_path, thumbnails, max_image_pixels):
+    """Make a set of thumbnails of an image, decoding the image once and at
+    the lowest resolution we can get away with. The largest thumbnail is made
+    from the decoded image, and each smaller one from the one before it.
+
+    Args:
+        input_path (str): The image to thumbnail.
+        thumbnails (list): (t_path, t_width, t_height, t_method, t_type)
+            tuples describing the thumbnails to make.
+        max_image_pixels (int): Images with more pixels than this are not
+            thumbnailed.
+
+    Returns:
+        (dict, list): The time spent in seconds in each of the "decode",
+        "resize" and "encode" stages, and the length of each thumbnail, or
+        None if it wasn't made.
+    """
+    stage_times = {"decode": 0., "resize": 0., "encode": 0.}
+    t_lens = [None] * len(thumbnails)
+
+    start = time.time()
+    thumbnailer = Thumbnailer(input_path)
+    if thumbnailer.width * thumbnailer.height >= max_image_pixels:
+        return stage_times, t_lens
+
+    jobs = []
+    for i, (t_path, t_width, t_height, t_method, t_type) in enumerate(thumbnails):
+        if t_method == "crop":
+            size = thumbnailer.crop_size(t_width, t_height)
+        elif t_method == "scale":
+            size = (t_width, t_height)
+        else:
+            continue
+        jobs.append((size, i))
+
+    if not jobs:
+        return stage_times, t_lens
+
+    # Largest first, so that each thumbnail can be made from the one before.
+    jobs.sort(key=lambda job: job[0][0] * job[0][1], reverse=True)
+
+    largest_width, largest_height = jobs[0][0]
+    thumbnailer.load(largest_width, largest_height)
+    now = time.time()
+    stage_times["decode"] += now - start
+    start = now
+
+    for (width, height), i in jobs:
+        t_path, t_width, t_height, t_method, t_type = thumbnails[i]
+
+        thumbnailer.shrink(width, height)
+        if t_method == "crop":
+            output_image = thumbnailer.crop_image(t_width, t_height)
+        else:
+            output_image = thumbnailer.scale_image(t_width, t_height)
+        now = time.time()
+        stage_times["resize"] += now - start
+        start = now
+
+        t_lens[i] = thumbnailer.save_image(output_image, t_type, t_path)
+        now = time.time()
+        stage_times["encode"] += now - start
+        start = now
+
+    return stage_times, t_lens
+
+
+class ThumbnailPool(object):
+    """Runs generate_thumbnails in a fixed size pool of threads, so that a
+    burst of uploads can only use a bounded amount of CPU and memory for
+    thumbnailing. Requests beyond that are queued. PIL releases the GIL while
+    it decodes, resizes and encodes, so the threads do run in parallel.
+
+    Args:
+        clock (synapse.util.Clock)
+        threads (int): The number of threads.
+        timeout_s (float): How long to wait for an image's thumbnails before
+            failing the request for them.
+    """
+
+    def __init__(self, clock, threads, timeout_s=THUMBNAIL_TIMEOUT_SECONDS):
+        self.clock = clock
+        self.timeout_s = timeout_s
+
+        self._threadpool = ThreadPool(
+            minthreads=0, maxthreads=threads, name="thumbnailer",
+        )
+        reactor.callWhenRunning(self._threadpool.start)
+        reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+
+    def stop(self):
+        """Wait for the thumbnails being made to finish, and stop the threads.
+        """
+        if self._threadpool.started:
+            self._threadpool.stop()
+
+    def generate_thumbnails(self, input_path, thumbnails, max_image_pixels):
+        """Returns a Deferred which resolves to the result of
+        generate_thumbnails, or fails if that raises or takes longer than the
+        timeout.
+        """
+        d = defer.Deferred()
+
+        def on_timeout():
+            d.errback(defer.TimeoutError(
+                "Timed out generating thumbnails for %s" % (input_path,)
+            ))
+
+        timer = self.clock.call_later(self.timeout_s, on_timeout)
+
+        def fire(result, fire_d):
+            # We might have already given up on the result.
+            if d.called:
+                return
+            self.clock.cancel_call_later(timer)
+            fire_d(result)
+
+        result = threads.deferToThreadPool(
+            reactor, self._threadpool,
+            generate_thumbnails, input_path, thumbnails, max_image_pixels,
+        )
+        result.addCallbacks(
+            fire, fire, callbackArgs=(d.callback,), errbackArgs=(d.errback,),
+        )
+
+        return d
@@ -17,16 +17,23 @@ from synapse.http.server import respond_with_json, request_handler
 
 from synapse.util.stringutils import random_string
 from synapse.api.errors import SynapseError
+from synapse.util.logcontext import preserve_context_over_fn
 
 from twisted.web.server import NOT_DONE_YET
-from twisted.internet import defer
+from twisted.internet import defer, threads
+from twisted.python.failure import Failure
 
 from .base_resource import BaseMediaResource
 
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
+# How much of an upload to read into memory at a time when copying it to the
+# media store.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 
 class UploadResource(BaseMediaResource):
     def render_POST(self, request):
@@ -40,50 +47,135 @@ class UploadResource(BaseMediaResource):
     @defer.inlineCallbacks
     def create_content(self, media_type, upload_name, content, content_length,
                        auth_user):
+        """Store the content of an upload as new local media.
+
+        Args:
+            media_type (str): The content type of the upload.
+            upload_name (unicode|None): The filename given by the uploader.
+            content (file): A file-like object to read the upload from. It is
+                copied to the media store in chunks, so is never held in
+                memory in its entirety.
+            content_length (int): The length given in the request headers.
+            auth_user (UserID): The user doing the upload.
+
+        Returns:
+            Deferred[str]: The mxc:// URI of the new media.
+        """
         media_id = random_string(24)
 
         fname = self.filepaths.local_media_filepath(media_id)
         self._makedirs(fname)
 
-        # This shouldn't block for very long because the content will have
-        # already been uploaded at this point.
-        with open(fname, "wb") as f:
-            f.write(content)
-
-        yield self.store.store_local_media(
-            media_id=media_id,
-            media_type=media_type,
-            time_now_ms=self.clock.time_msec(),
-            upload_name=upload_name,
-            media_length=content_length,
-            user_id=auth_user,
+        try:
+            media_length, sha256 = yield preserve_context_over_fn(
+                threads.deferToThread,
+                self._write_upload_to_file, content, fname,
+            )
+
+            if media_length != content_length:
+                logger.warn(
+                    "Upload for %s was %d bytes, but Content-Length was %d",
+                    media_id, media_length, content_length,
+                )
+
+            sha256, deduplicated = yield self.store.store_local_media(
+                media_id=media_id,
+                media_type=media_type,
+                time_now_ms=self.clock.time_msec(),
+                upload_name=upload_name,
+                media_length=media_length,
+                user_id=auth_user,
+                sha256=sha256,
+            )
+        except Exception:
+            self._remove_upload(fname)
+            raise
+
+        if sha256:
+            try:
+                self._move_to_blob(fname, sha256)
+            except Exception:
+                # Forget the media, so that it doesn't refer to a blob without
+                # a file. We capture the failure first, as yielding loses it.
+                f = Failure()
+                self._remove_upload(fname)
+                yield self.store.delete_local_media(media_id, sha256)
+                f.raiseException()
+
+        logger.info(
+            "Stored local media %s (%d bytes, sha256 %s)",
+            media_id, media_length, sha256,
         )
+
         media_info = {
             "media_type": media_type,
-            "media_length": content_length,
+            "media_length": media_length,
+            "sha256": sha256,
         }
 
+        if deduplicated:
+            self._record_deduplicated("local", media_length)
+
+        # The blob may not have every thumbnail we want if it was first stored
+        # under a different media type, or if making them failed then.
         yield self._generate_local_thumbnails(media_id, media_info)
 
         defer.returnValue("mxc://%s/%s" % (self.server_name, media_id))
 
+    def _write_upload_to_file(self, content, fname):
+        """Copy an upload into the media store, hashing it and checking it
+        against the max upload size as it goes. This blocks, so should be run
+        in a thread.
+
+        Returns:
+            (int, str): The length of the upload and the hex encoded sha256 of
+            its contents.
+        """
+        hasher = hashlib.sha256()
+        length = 0
+        with open(fname, "wb") as f:
+            while True:
+                chunk = content.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                length += len(chunk)
+                if length > self.max_upload_size:
+                    raise SynapseError(
+                        msg="Upload request body is too large",
+                        code=413,
+                    )
+
+                hasher.update(chunk)
+                f.write(chunk)
+
+        return length, hasher.hexdigest()
+
     @request_handler
     @defer.inlineCallbacks
     def _async_render_POST(self, request):
-        requester = yield self.auth.get_user_by_req(request)
-        # TODO: The checks here are a bit late. The content will have
-        # already been uploaded to a tmp file at this point
+        # Check the size before doing anything else, and in particular before
+        # touching the body, which twisted will have spooled to a temporary
+        # file.
         content_length = request.getHeader("Content-Length")
         if content_length is None:
             raise SynapseError(
                 msg="Request must specify a Content-Length", code=400
             )
-        if int(content_length) > self.max_upload_size:
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            raise SynapseError(
+                msg="Invalid Content-Length", code=400
+            )
+        if content_length > self.max_upload_size:
             raise SynapseError(
                 msg="Upload request body is too large",
                 code=413,
             )
 
+        requester = yield self.auth.get_user_by_req(request)
+
         upload_name = request.args.get("filename", None)
         if upload_name:
             try:
@@ -109,7 +201,7 @@ class UploadResource(BaseMediaResource):
         # TODO(markjh): parse content-dispostion
 
         content_uri = yield self.create_content(
-            media_type, upload_name, request.content.read(),
+            media_type, upload_name, request.content,
             content_length, requester.user
         )
 
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from .appservice import (
     ApplicationServiceStore, ApplicationServiceTransactionStore
 )
@@ -61,6 +61,13 @@ logger = logging.getLogger(__name__)
 # 120 seconds == 2 minutes
 LAST_SEEN_GRANULARITY = 120 * 1000
 
+# How often we write out the buffered client IPs.
+CLIENT_IP_FLUSH_MS = 5 * 1000
+
+# The most client IP sightings we buffer between flushes. Any more are dropped
+# until the buffer has been written out.
+MAX_CLIENT_IP_BUFFER_SIZE = 10000
+
 
 class DataStore(RoomMemberStore, RoomStore,
                 RegistrationStore, StreamStore, ProfileStore,
@@ -140,8 +147,17 @@ class DataStore(RoomMemberStore, RoomStore,
             "AccountDataAndTagsChangeCache", account_max,
         )
 
+        # (user_id, access_token, ip, user_agent) -> last_seen of client IPs
+        # that haven't been written to the database yet.
+        self._client_ip_buffer = {}
+
         super(DataStore, self).__init__(hs)
 
+        self._clock.looping_call(self._flush_client_ips, CLIENT_IP_FLUSH_MS)
+        reactor.addSystemEventTrigger(
+            "before", "shutdown", self._flush_client_ips
+        )
+
     def _get_cache_dict(self, db_conn, table, entity_column, stream_column, max_value):
         # Fetch a mapping of room_id -> max stream position for "recent" rooms.
         # It doesn't really matter how many we get, the StreamChangeCache will
@@ -174,8 +190,11 @@ class DataStore(RoomMemberStore, RoomStore,
 
         return cache, min_val
 
-    @defer.inlineCallbacks
     def insert_client_ip(self, user, access_token, ip, user_agent):
+        """Record that a user's access token was used from an IP. This doesn't
+        wait for the database; sightings are buffered and written out in bulk
+        by _flush_client_ips.
+        """
         now = int(self._clock.time_msec())
         key = (user.to_string(), access_token, ip)
 
@@ -186,26 +205,74 @@ class DataStore(RoomMemberStore, RoomStore,
 
         # Rate-limited inserts
         if last_seen is not None and (now - last_seen) < LAST_SEEN_GRANULARITY:
-            defer.returnValue(None)
+            return
+
+        buffer_key = key + (user_agent,)
+        if (
+            len(self._client_ip_buffer) >= MAX_CLIENT_IP_BUFFER_SIZE
+            and buffer_key not in self._client_ip_buffer
+        ):
+            # We don't update client_ip_last_seen, so we'll try again next
+            # time this client makes a request.
+            return
 
         self.client_ip_last_seen.prefill(key, now)
+        self._client_ip_buffer[buffer_key] = now
 
-        # It's safe not to lock here: a) no unique constraint,
-        # b) LAST_SEEN_GRANULARITY makes concurrent updates incredibly unlikely
-        yield self._simple_upsert(
-            "user_ips",
-            keyvalues={
-                "user_id": user.to_string(),
-                "access_token": access_token,
-                "ip": ip,
-                "user_agent": user_agent,
-            },
-            values={
-                "last_seen": now,
-            },
-            desc="insert_client_ip",
-            lock=False,
-        )
+    @defer.inlineCallbacks
+    def _flush_client_ips(self):
+        if not self._client_ip_buffer:
+            return
+
+        client_ips = self._client_ip_buffer
+        self._client_ip_buffer = {}
+
+        def update_client_ips_txn(txn):
+            for (user_id, access_token, ip, user_agent), last_seen in (
+                client_ips.items()
+            ):
+                # It's safe not to lock here: a) no unique constraint,
+                # b) LAST_SEEN_GRANULARITY makes concurrent updates incredibly
+                # unlikely
+                self._simple_upsert_txn(
+                    txn, "user_ips",
+                    keyvalues={
+                        "user_id": user_id,
+                        "access_token": access_token,
+                        "ip": ip,
+                        "user_agent": user_agent,
+                    },
+                    values={
+                        "last_seen": last_seen,
+                    },
+                    lock=False,
+                )
+
+        # This is called from a looping call, which would stop if we let the
+        # failure propagate.
+        try:
+            yield self.runBackgroundInteraction(
+                "update_client_ips", update_client_ips_txn
+            )
+        except Exception:
+            logger.exception("Failed to update client IPs")
+            self._requeue_client_ips(client_ips)
+
+    def _requeue_client_ips(self, client_ips):
+        """Put sightings that failed to be written back in the buffer, so
+        that the next flush retries them.
+        """
+        for buffer_key, last_seen in client_ips.items():
+            if buffer_key in self._client_ip_buffer:
+                # There's been a newer sighting since.
+                continue
+
+            if len(self._client_ip_buffer) < MAX_CLIENT_IP_BUFFER_SIZE:
+                self._client_ip_buffer[buffer_key] = last_seen
+            else:
+                # No room: forget that we've seen it so that it's recorded
+                # again the next time this client makes a request.
+                self.client_ip_last_seen.invalidate(buffer_key[:3])
 
     @defer.inlineCallbacks
     def count_daily_users(self):
@@ -23,9 +23,11 @@ import synapse.metrics
 
 from twisted.internet import defer
 
+import re
 import sys
 import time
 import threading
+import weakref
 
 
 logger = logging.getLogger(__name__)
@@ -39,8 +41,118 @@ metrics = synapse.metrics.get_metrics_for("synapse.storage")
 
 sql_scheduling_timer = metrics.register_distribution("schedule_time")
 
-sql_query_timer = metrics.register_distribution("query_time", labels=["verb"])
-sql_txn_timer = metrics.register_distribution("transaction_time", labels=["desc"])
+sql_query_timer = metrics.register_histogram("query_time", labels=["verb"])
+sql_txn_timer = metrics.register_histogram("transaction_time", labels=["desc"])
+
+
+# Priority classes ("lanes") for database interactions. Interactive work, i.e.
+# anything done on behalf of a client or federation request, may use every
+# connection in the pool. The other lanes are bounded so that, between them,
+# they always leave at least DB_RESERVED_INTERACTIVE_CONNECTIONS connections
+# free for interactive work, provided the pool is large enough to do so (see
+# _compute_db_lane_limits).
+DB_LANE_INTERACTIVE = "interactive"
+DB_LANE_EVENT_FETCH = "event_fetch"
+DB_LANE_BACKGROUND = "background"
+
+DB_RESERVED_INTERACTIVE_CONNECTIONS = 1
+
+
+def _compute_db_lane_limits(pool_size):
+    """Works out how many concurrent interactions each of the bounded lanes
+    may have for a connection pool of the given size.
+
+    Each bounded lane always gets at least one interaction, so a pool with no
+    more than DB_RESERVED_INTERACTIVE_CONNECTIONS connections has nothing
+    reserved for interactive work. This is always the case with SQLite, which
+    uses a single connection: there the lanes only stop background work and
+    event fetches from queuing up more than one interaction each ahead of
+    interactive work.
+
+    Returns:
+        dict: lane name -> maximum number of concurrent interactions
+    """
+    shareable = max(1, pool_size - DB_RESERVED_INTERACTIVE_CONNECTIONS)
+    background = max(1, shareable // 2)
+    event_fetch = max(1, shareable - background)
+    return {
+        DB_LANE_BACKGROUND: background,
+        DB_LANE_EVENT_FETCH: event_fetch,
+    }
+
+
+# The stores reported on by the db_lane_* metrics. There is normally only one
+# per process, but the metrics are registered once here rather than per store
+# so that creating more (e.g. in tests) doesn't register duplicates.
+_db_lane_stores = weakref.WeakSet()
+
+
+def _sum_db_lane_counts(get_counts):
+    totals = {}
+    for store in list(_db_lane_stores):
+        for lane, count in get_counts(store).items():
+            totals[(lane,)] = totals.get((lane,), 0) + count
+    return totals
+
+
+metrics.register_callback(
+    "db_lane_inflight",
+    lambda: _sum_db_lane_counts(lambda store: store._get_db_lane_inflight()),
+    labels=["lane"],
+)
+metrics.register_callback(
+    "db_lane_waiting",
+    lambda: _sum_db_lane_counts(lambda store: store._get_db_lane_waiting()),
+    labels=["lane"],
+)
+
+
+# The stores reported on by the statement_* metrics, i.e. those with statement
+# profiling enabled. As with the db_lane_* metrics, these are registered once
+# here rather than per store.
+_profiled_stores = weakref.WeakSet()
+
+
+def _top_statements(field):
+    combine = max if field == "max_time_ms" else sum
+    values = {}
+    for store in list(_profiled_stores):
+        for s in store._statement_profiler.get_top(
+            store.STATEMENT_METRICS_TOP_N
+        ):
+            values.setdefault((s["statement"], s["desc"]), []).append(s[field])
+    return {key: combine(v) for key, v in values.items()}
+
+
+for _field in ("count", "total_time_ms", "max_time_ms", "rows"):
+    metrics.register_callback(
+        "statement_%s" % (_field,),
+        lambda field=_field: _top_statements(field),
+        labels=["statement", "desc"],
+    )
+
+
+# The SQL generated by the _simple_* helpers, already converted to the database
+# engine's parameter style. This is keyed on the kind of statement, the table,
+# the columns involved (in the order their values are passed) and the engine.
+# The keys come from a fixed set of call sites so this stays small, but we cap
+# it anyway in case something generates an unbounded set of column lists.
+_simple_sql_cache = {}
+
+SIMPLE_SQL_CACHE_MAX_ENTRIES = 5000
+
+
+def _cache_simple_sql(cache_key, engine, sql):
+    """Converts the SQL to the engine's parameter style and, space permitting,
+    caches it under the given key.
+
+    Returns:
+        str: The converted SQL.
+    """
+    sql = engine.convert_param_style(sql)
+    if len(_simple_sql_cache) < SIMPLE_SQL_CACHE_MAX_ENTRIES:
+        _simple_sql_cache[cache_key] = sql
+    return sql
 
 
 class LoggingTransaction(object):
@@ -69,17 +181,30 @@ class LoggingTransaction(object):
         setattr(self.txn, name, value)
 
     def execute(self, sql, *args):
-        self._do_execute(self.txn.execute, sql, *args)
+        self._do_execute(
+            self.txn.execute, self.database_engine.convert_param_style(sql), *args
+        )
 
     def executemany(self, sql, *args):
+        self._do_execute(
+            self.txn.executemany, self.database_engine.convert_param_style(sql),
+            *args
+        )
+
+    def execute_converted(self, sql, *args):
+        """Like execute, but for SQL that has already been converted to the
+        database engine's parameter style, e.g. that cached by the _simple_*
+        helpers.
+        """
+        self._do_execute(self.txn.execute, sql, *args)
+
+    def executemany_converted(self, sql, *args):
         self._do_execute(self.txn.executemany, sql, *args)
 
     def _do_execute(self, func, sql, *args):
         # TODO(paul): Maybe use 'info' and 'debug' for values?
         sql_logger.debug("[SQL] {%s} %s", self.name, sql)
 
-        sql = self.database_engine.convert_param_style(sql)
-
         if args:
             try:
                 sql_logger.debug(
@@ -105,6 +230,185 @@ class LoggingTransaction(object):
             sql_query_timer.inc_by(msecs, sql.split()[0])
 
 
+class ProfilingLoggingTransaction(LoggingTransaction):
+    """A LoggingTransaction that additionally reports each statement it runs,
+    and the number of rows each returns, to a StatementProfiler.
+
+    This is only used when statement profiling is turned on, so that the
+    common case doesn't pay for it.
+    """
+    __slots__ = ["profiler", "desc", "current_entry"]
+
+    def __init__(self, txn, name, database_engine, after_callbacks, profiler,
+                 desc):
+        super(ProfilingLoggingTransaction, self).__init__(
+            txn, name, database_engine, after_callbacks
+        )
+        object.__setattr__(self, "profiler", profiler)
+        object.__setattr__(self, "desc", desc)
+        object.__setattr__(self, "current_entry", None)
+
+    def _do_execute(self, func, sql, *args):
+        start = time.time() * 1000
+        try:
+            return super(ProfilingLoggingTransaction, self)._do_execute(
+                func, sql, *args
+            )
+        finally:
+            entry = self.profiler.record(
+                sql, self.desc, (time.time() * 1000) - start
+            )
+            object.__setattr__(self, "current_entry", entry)
+
+            # For SELECTs we count the rows as they're fetched instead, as
+            # not every driver populates rowcount for them.
+            if sql.lstrip()[:6].upper() != "SELECT":
+                rowcount = self.txn.rowcount
+                if rowcount > 0:
+                    self.profiler.add_rows(entry, rowcount)
+
+    def _count_fetched(self, rows):
+        if self.current_entry is not None and rows:
+            self.profiler.add_rows(self.current_entry, len(rows))
+        return rows
+
+    def fetchall(self):
+        return self._count_fetched(self.txn.fetchall())
+
+    def fetchmany(self, *args):
+        return self._count_fetched(self.txn.fetchmany(*args))
+
+    def fetchone(self):
+        row = self.txn.fetchone()
+        if row is not None and self.current_entry is not None:
+            self.profiler.add_rows(self.current_entry, 1)
+        return row
+
+
+# Used to collapse runs of placeholders, e.g. "IN (?,?,?)" or the tuples of a
+# multi-row VALUES clause, so that statements that only differ in the number of
+# parameters are aggregated together.
+_PLACEHOLDER_LIST_RE = re.compile(
+    r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)"
+)
+_PLACEHOLDER_TUPLES_RE = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """Reduces an SQL statement to a canonical form that can be used to group
+    together executions of "the same" query.
+
+    Literals are replaced with placeholders, whitespace is collapsed and lists
+    of placeholders are collapsed to "(...)".
+    """
+    sql = _STRING_LITERAL_RE.sub("?", sql)
+    sql = _NUMBER_LITERAL_RE.sub("?", sql)
+    sql = _PLACEHOLDER_LIST_RE.sub("(...)", sql)
+    sql = _PLACEHOLDER_TUPLES_RE.sub("(...)", sql)
+    sql = _WHITESPACE_RE.sub(" ", sql)
+    return sql.strip()
+
+
+class StatementProfiler(object):
+    """Aggregates the count, total and max duration and rows returned for each
+    normalized SQL statement, per transaction desc.
+
+    This is called from the database threads, so all access to the stats is
+    done under a lock.
+
+    Args:
+        max_entries (int): The maximum number of distinct (statement, desc)
+            pairs to track. Once reached, further statements are aggregated
+            under a single catch-all statement.
+    """
+
+    OTHER_STATEMENT = "<other>"
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        # (normalized sql, desc) -> [count, total_ms, max_ms, rows]
+        self._stats = {}
+
+        # Raw SQL -> normalized SQL. Most statements are built from a small
+        # set of templates so this saves repeatedly running the regexes.
+        self._normalized = {}
+
+    def _normalize(self, sql):
+        normalized = self._normalized.get(sql)
+        if normalized is None:
+            normalized = normalize_sql(sql)
+            if len(self._normalized) < self.max_entries * 4:
+                self._normalized[sql] = normalized
+        return normalized
+
+    def record(self, sql, desc, duration_ms):
+        """Records an execution of the given statement.
+
+        Returns:
+            list: The entry that was updated, to be passed to add_rows.
+        """
+        key = (self._normalize(sql), desc)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                if len(self._stats) >= self.max_entries:
+                    key = (self.OTHER_STATEMENT, desc)
+                    entry = self._stats.get(key)
+                if entry is None:
+                    entry = self._stats[key] = [0, 0., 0., 0]
+
+            entry[0] += 1
+            entry[1] += duration_ms
+            if duration_ms > entry[2]:
+                entry[2] = duration_ms
+        return entry
+
+    def add_rows(self, entry, rows):
+        with self._lock:
+            entry[3] += rows
+
+    def get_top(self, limit, order_by="total_time"):
+        """Returns the most expensive statements.
+
+        Args:
+            limit (int): The maximum number of statements to return.
+            order_by (str): One of "total_time", "count", "max_time" or "rows".
+        Returns:
+            list(dict): The top statements, most expensive first.
+        """
+        index = {
+            "count": 0, "total_time": 1, "max_time": 2, "rows": 3,
+        }[order_by]
+
+        with self._lock:
+            items = [
+                (key, list(entry)) for key, entry in self._stats.items()
+            ]
+
+        items.sort(key=lambda item: item[1][index], reverse=True)
+
+        return [
+            {
+                "statement": statement,
+                "desc": desc,
+                "count": count,
+                "total_time_ms": total_ms,
+                "max_time_ms": max_ms,
+                "rows": rows,
+            }
+            for (statement, desc), (count, total_ms, max_ms, rows) in items[:limit]
+        ]
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
 class PerformanceCounters(object):
     def __init__(self):
         self.current_counters = {}
@@ -145,6 +449,10 @@ class PerformanceCounters(object):
 class SQLBaseStore(object):
     _TXN_ID = 0
 
+    # The number of statements exported as metrics when statement profiling is
+    # enabled. The full list is available through the admin API.
+    STATEMENT_METRICS_TOP_N = 20
+
     def __init__(self, hs):
         self.hs = hs
         self._db_pool = hs.get_db_pool()
@@ -173,6 +481,49 @@ class SQLBaseStore(object):
 
         self.database_engine = hs.database_engine
 
+        if hs.config.profile_sql_statements:
+            self._statement_profiler = StatementProfiler()
+            _profiled_stores.add(self)
+        else:
+            self._statement_profiler = None
+
+        # Not every pool we get given (e.g. in tests) is a ConnectionPool
+        self._db_lane_limits = _compute_db_lane_limits(
+            getattr(self._db_pool, "max", 1)
+        )
+        self._db_background_lane = defer.DeferredSemaphore(
+            self._db_lane_limits[DB_LANE_BACKGROUND]
+        )
+        self._db_lane_inflight = {
+            DB_LANE_INTERACTIVE: 0,
+            DB_LANE_BACKGROUND: 0,
+        }
+
+        _db_lane_stores.add(self)
+
+    def _get_db_lane_inflight(self):
+        return {
+            DB_LANE_INTERACTIVE: self._db_lane_inflight[DB_LANE_INTERACTIVE],
+            DB_LANE_BACKGROUND: self._db_lane_inflight[DB_LANE_BACKGROUND],
+            DB_LANE_EVENT_FETCH: self._event_fetch_ongoing,
+        }
+
+    def _get_db_lane_waiting(self):
+        return {
+            DB_LANE_BACKGROUND: len(self._db_background_lane.waiting),
+            DB_LANE_EVENT_FETCH: len(self._event_fetch_list),
+        }
+
+    def get_statement_profile(self, limit, order_by="total_time"):
+        """Returns the most expensive SQL statements run since startup, or
+        None if statement profiling isn't enabled.
+
+        See StatementProfiler.get_top.
+        """
+        if self._statement_profiler is None:
+            return None
+        return self._statement_profiler.get_top(limit, order_by=order_by)
+
     def start_profiling(self):
         self._previous_loop_ts = self._clock.time_msec()
 
@@ -221,9 +572,15 @@ class SQLBaseStore(object):
             while True:
                 try:
                     txn = conn.cursor()
-                    txn = LoggingTransaction(
-                        txn, name, self.database_engine, after_callbacks
-                    )
+                    if self._statement_profiler is None:
+                        txn = LoggingTransaction(
+                            txn, name, self.database_engine, after_callbacks
+                        )
+                    else:
+                        txn = ProfilingLoggingTransaction(
+                            txn, name, self.database_engine, after_callbacks,
+                            self._statement_profiler, desc,
+                        )
                     r = func(txn, *args, **kwargs)
                     conn.commit()
                     return r
@@ -275,9 +632,37 @@ class SQLBaseStore(object):
             self._txn_perf_counters.update(desc, start, end)
             sql_txn_timer.inc_by(duration, desc)
 
-    @defer.inlineCallbacks
     def runInteraction(self, desc, func, *args, **kwargs):
         """Wraps the .runInteraction() method on the underlying db_pool."""
+        return self._run_interaction(
+            DB_LANE_INTERACTIVE, desc, func, *args, **kwargs
+        )
+
+    @defer.inlineCallbacks
+    def runBackgroundInteraction(self, desc, func, *args, **kwargs):
+        """Like runInteraction, but for work that isn't being done on behalf
+        of a request, e.g. background updates and stats reporting.
+
+        Only a bounded number of these run concurrently, so that they can't
+        tie up every connection in the pool and starve interactive requests.
+        """
+        with PreserveLoggingContext():
+            yield self._db_background_lane.acquire()
+
+        try:
+            result = yield self._run_interaction(
+                DB_LANE_BACKGROUND, desc, func, *args, **kwargs
+            )
+        finally:
+            # Releasing may resume a waiting interaction, which will restore
+            # its own logging context.
+            with PreserveLoggingContext():
+                self._db_background_lane.release()
+
+        defer.returnValue(result)
+
+    @defer.inlineCallbacks
+    def _run_interaction(self, lane, desc, func, *args, **kwargs):
         current_context = LoggingContext.current_context()
 
         start_time = time.time() * 1000
@@ -286,7 +671,9 @@ class SQLBaseStore(object):
 
         def inner_func(conn, *args, **kwargs):
             with LoggingContext("runInteraction") as context:
-                sql_scheduling_timer.inc_by(time.time() * 1000 - start_time)
+                sched_duration_ms = time.time() * 1000 - start_time
+                sql_scheduling_timer.inc_by(sched_duration_ms)
+                current_context.add_database_scheduled(sched_duration_ms)
 
                 if self.database_engine.is_connection_closed(conn):
                     logger.debug("Reconnecting closed database connection")
@@ -298,10 +685,14 @@ class SQLBaseStore(object):
                     func, *args, **kwargs
                 )
 
-        with PreserveLoggingContext():
-            result = yield self._db_pool.runWithConnection(
-                inner_func, *args, **kwargs
-            )
+        self._db_lane_inflight[lane] += 1
+        try:
+            with PreserveLoggingContext():
+                result = yield self._db_pool.runWithConnection(
+                    inner_func, *args, **kwargs
+                )
+        finally:
+            self._db_lane_inflight[lane] -= 1
 
         for after_callback, after_args in after_callbacks:
             after_callback(*after_args)
@@ -316,7 +707,9 @@ class SQLBaseStore(object):
 
         def inner_func(conn, *args, **kwargs):
             with LoggingContext("runWithConnection") as context:
-                sql_scheduling_timer.inc_by(time.time() * 1000 - start_time)
+                sched_duration_ms = time.time() * 1000 - start_time
+                sql_scheduling_timer.inc_by(sched_duration_ms)
+                current_context.add_database_scheduled(sched_duration_ms)
 
                 if self.database_engine.is_connection_closed(conn):
                     logger.debug("Reconnecting closed database connection")
@@ -395,13 +788,19 @@ class SQLBaseStore(object):
     def _simple_insert_txn(txn, table, values):
         keys, vals = zip(*values.items())
 
-        sql = "INSERT INTO %s (%s) VALUES(%s)" % (
-            table,
-            ", ".join(k for k in keys),
-            ", ".join("?" for _ in keys)
-        )
+        cache_key = ("insert", table, keys, txn.database_engine)
+        sql = _simple_sql_cache.get(cache_key)
+        if sql is None:
+            sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                "INSERT INTO %s (%s) VALUES(%s)" % (
+                    table,
+                    ", ".join(k for k in keys),
+                    ", ".join("?" for _ in keys)
+                )
+            )
 
-        txn.execute(sql, vals)
+        txn.execute_converted(sql, vals)
 
     @staticmethod
     def _simple_insert_many_txn(txn, table, values):
@@ -430,13 +829,19 @@ class SQLBaseStore(object):
                     "All items must have the same keys"
                 )
 
-        sql = "INSERT INTO %s (%s) VALUES(%s)" % (
-            table,
-            ", ".join(k for k in keys[0]),
-            ", ".join("?" for _ in keys[0])
-        )
+        cache_key = ("insert", table, keys[0], txn.database_engine)
+        sql = _simple_sql_cache.get(cache_key)
+        if sql is None:
+            sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                "INSERT INTO %s (%s) VALUES(%s)" % (
+                    table,
+                    ", ".join(k for k in keys[0]),
+                    ", ".join("?" for _ in keys[0])
+                )
+            )
 
-        txn.executemany(sql, vals)
+        txn.executemany_converted(sql, vals)
 
     def _simple_upsert(self, table, keyvalues, values,
                        insertion_values={}, desc="_simple_upsert", lock=True):
@@ -461,18 +866,23 @@ class SQLBaseStore(object):
             self.database_engine.lock_table(txn, table)
 
         # Try to update
-        sql = "UPDATE %s SET %s WHERE %s" % (
-            table,
-            ", ".join("%s = ?" % (k,) for k in values),
-            " AND ".join("%s = ?" % (k,) for k in keyvalues)
+        cache_key = (
+            "upsert_update", table, tuple(values), tuple(keyvalues),
+            txn.database_engine,
         )
+        sql = _simple_sql_cache.get(cache_key)
+        if sql is None:
+            sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                "UPDATE %s SET %s WHERE %s" % (
+                    table,
+                    ", ".join("%s = ?" % (k,) for k in values),
+                    " AND ".join("%s = ?" % (k,) for k in keyvalues)
+                )
+            )
         sqlargs = values.values() + keyvalues.values()
-        logger.debug(
-            "[SQL] %s Args=%s",
-            sql, sqlargs,
-        )
 
-        txn.execute(sql, sqlargs)
+        txn.execute_converted(sql, sqlargs)
         if txn.rowcount == 0:
             # We didn't update and rows so insert a new one
             allvalues = {}
@@ -480,16 +890,18 @@ class SQLBaseStore(object):
             allvalues.update(values)
             allvalues.update(insertion_values)
 
-            sql = "INSERT INTO %s (%s) VALUES (%s)" % (
-                table,
-                ", ".join(k for k in allvalues),
-                ", ".join("?" for _ in allvalues)
-            )
-            logger.debug(
-                "[SQL] %s Args=%s",
-                sql, keyvalues.values(),
-            )
-            txn.execute(sql, allvalues.values())
+            cache_key = ("upsert_insert", table, tuple(allvalues), txn.database_engine)
+            sql = _simple_sql_cache.get(cache_key)
+            if sql is None:
+                sql = _cache_simple_sql(
+                    cache_key, txn.database_engine,
+                    "INSERT INTO %s (%s) VALUES (%s)" % (
+                        table,
+                        ", ".join(k for k in allvalues),
+                        ", ".join("?" for _ in allvalues)
+                    )
+                )
+            txn.execute_converted(sql, allvalues.values())
 
     def _simple_select_one(self, table, keyvalues, retcols,
                            allow_none=False, desc="_simple_select_one"):
@@ -547,15 +959,23 @@ class SQLBaseStore(object):
 
     @staticmethod
     def _simple_select_onecol_txn(txn, table, keyvalues, retcol):
-        sql = (
-            "SELECT %(retcol)s FROM %(table)s WHERE %(where)s"
-        ) % {
-            "retcol": retcol,
-            "table": table,
-            "where": " AND ".join("%s = ?" % k for k in keyvalues.keys()),
-        }
+        cache_key = (
+            "select_onecol", table, retcol, tuple(keyvalues), txn.database_engine,
+        )
+        sql = _simple_sql_cache.get(cache_key)
+        if sql is None:
+            sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                (
+                    "SELECT %(retcol)s FROM %(table)s WHERE %(where)s"
+                ) % {
+                    "retcol": retcol,
+                    "table": table,
+                    "where": " AND ".join("%s = ?" % k for k in keyvalues.keys()),
+                }
+            )
 
-        txn.execute(sql, keyvalues.values())
+        txn.execute_converted(sql, keyvalues.values())
 
         return [r[0] for r in txn.fetchall()]
 
@@ -607,12 +1027,21 @@ class SQLBaseStore(object):
             retcols : list of strings giving the names of the columns to return
         """
         if keyvalues:
-            sql = "SELECT %s FROM %s WHERE %s" % (
-                ", ".join(retcols),
-                table,
-                " AND ".join("%s = ?" % (k, ) for k in keyvalues)
+            cache_key = (
+                "select_list", table, tuple(retcols), tuple(keyvalues),
+                txn.database_engine,
             )
-            txn.execute(sql, keyvalues.values())
+            sql = _simple_sql_cache.get(cache_key)
+            if sql is None:
+                sql = _cache_simple_sql(
+                    cache_key, txn.database_engine,
+                    "SELECT %s FROM %s WHERE %s" % (
+                        ", ".join(retcols),
+                        table,
+                        " AND ".join("%s = ?" % (k, ) for k in keyvalues)
+                    )
+                )
+            txn.execute_converted(sql, keyvalues.values())
         else:
             sql = "SELECT %s FROM %s" % (
                 ", ".join(retcols),
@@ -676,26 +1105,30 @@ class SQLBaseStore(object):
         if not iterable:
             return []
 
-        sql = "SELECT %s FROM %s" % (", ".join(retcols), table)
+        keys, keyvals = zip(*keyvalues.items()) if keyvalues else ((), ())
 
-        clauses = []
-        values = []
-        clauses.append(
-            "%s IN (%s)" % (column, ",".join("?" for _ in iterable))
+        # The number of items is part of the key, which is bounded in
+        # practice by the batch size of _simple_select_many_batch.
+        cache_key = (
+            "select_many", table, column, len(iterable), tuple(retcols), keys,
+            txn.database_engine,
         )
-        values.extend(iterable)
-
-        for key, value in keyvalues.items():
-            clauses.append("%s = ?" % (key,))
-            values.append(value)
-
-        if clauses:
-            sql = "%s WHERE %s" % (
-                sql,
-                " AND ".join(clauses),
+        sql = _simple_sql_cache.get(cache_key)
+        if sql is None:
+            clauses = ["%s IN (%s)" % (column, ",".join("?" for _ in iterable))]
+            clauses.extend("%s = ?" % (key,) for key in keys)
+
+            sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                "SELECT %s FROM %s WHERE %s" % (
+                    ", ".join(retcols), table, " AND ".join(clauses),
+                )
             )
 
-        txn.execute(sql, values)
+        values = list(iterable)
+        values.extend(keyvals)
+
+        txn.execute_converted(sql, values)
         return cls.cursor_to_dict(txn)
 
     def _simple_update_one(self, table, keyvalues, updatevalues,
@@ -725,13 +1158,22 @@ class SQLBaseStore(object):
 
     @staticmethod
     def _simple_update_one_txn(txn, table, keyvalues, updatevalues):
-        update_sql = "UPDATE %s SET %s WHERE %s" % (
-            table,
-            ", ".join("%s = ?" % (k,) for k in updatevalues),
-            " AND ".join("%s = ?" % (k,) for k in keyvalues)
+        cache_key = (
+            "update_one", table, tuple(updatevalues), tuple(keyvalues),
+            txn.database_engine,
         )
+        update_sql = _simple_sql_cache.get(cache_key)
+        if update_sql is None:
+            update_sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                "UPDATE %s SET %s WHERE %s" % (
+                    table,
+                    ", ".join("%s = ?" % (k,) for k in updatevalues),
+                    " AND ".join("%s = ?" % (k,) for k in keyvalues)
+                )
+            )
 
-        txn.execute(
+        txn.execute_converted(
             update_sql,
             updatevalues.values() + keyvalues.values()
         )
@@ -744,13 +1186,22 @@ class SQLBaseStore(object):
     @staticmethod
     def _simple_select_one_txn(txn, table, keyvalues, retcols,
                                allow_none=False):
-        select_sql = "SELECT %s FROM %s WHERE %s" % (
-            ", ".join(retcols),
-            table,
-            " AND ".join("%s = ?" % (k,) for k in keyvalues)
+        cache_key = (
+            "select_one", table, tuple(retcols), tuple(keyvalues),
+            txn.database_engine,
         )
+        select_sql = _simple_sql_cache.get(cache_key)
+        if select_sql is None:
+            select_sql = _cache_simple_sql(
+                cache_key, txn.database_engine,
+                "SELECT %s FROM %s WHERE %s" % (
+                    ", ".join(retcols),
+                    table,
+                    " AND ".join("%s = ?" % (k,) for k in keyvalues)
+                )
+            )
 
-        txn.execute(select_sql, keyvalues.values())
+        txn.execute_converted(select_sql, keyvalues.values())
 
         row = txn.fetchone()
         if not row:
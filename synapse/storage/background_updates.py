@@ -194,6 +194,9 @@ class BackgroundUpdateStore(SQLBaseStore):
 
         The handler should return a deferred integer count of items updated.
         The hander is responsible for updating the progress of the update.
+        It should use runBackgroundInteraction rather than runInteraction for
+        its transactions, so that it doesn't compete with client requests for
+        database connections.
 
         Args:
             update_name(str): The name of the update that this code handles.
@@ -16,12 +16,15 @@
 from ._base import SQLBaseStore
 from synapse.util.caches.descriptors import cached
 
+from synapse.api.constants import EventTypes
 from synapse.api.errors import SynapseError
 
 from twisted.internet import defer
 
 from collections import namedtuple
 
+import ujson as json
+
 
 RoomAliasMapping = namedtuple(
     "RoomAliasMapping",
@@ -29,8 +32,27 @@ RoomAliasMapping = namedtuple(
 )
 
 
+# The types of state event that public room summaries are made from
+PUBLIC_ROOM_SUMMARY_TYPES = (
+    EventTypes.Name,
+    EventTypes.Topic,
+    EventTypes.CanonicalAlias,
+    EventTypes.RoomHistoryVisibility,
+    EventTypes.GuestAccess,
+    "m.room.avatar",
+)
+
+
 class DirectoryStore(SQLBaseStore):
 
+    def __init__(self, hs):
+        super(DirectoryStore, self).__init__(hs)
+
+        # Room ID -> a number bumped whenever the room's public room summary
+        # is invalidated, so that a summary built from state that has since
+        # changed isn't stored.
+        self._public_room_summaries_sequences = {}
+
     @defer.inlineCallbacks
     def get_association_from_room_alias(self, room_alias):
         """ Get's the room_id and server list for a given room_alias
@@ -81,30 +103,36 @@ class DirectoryStore(SQLBaseStore):
         Returns:
             Deferred
         """
-        try:
-            yield self._simple_insert(
+        def alias_txn(txn):
+            self._simple_insert_txn(
+                txn,
                 "room_aliases",
                 {
                     "room_alias": room_alias.to_string(),
                     "room_id": room_id,
                 },
-                desc="create_room_alias_association",
+            )
+
+            self._simple_insert_many_txn(
+                txn,
+                table="room_alias_servers",
+                values=[{
+                    "room_alias": room_alias.to_string(),
+                    "server": server,
+                } for server in servers],
+            )
+
+            self._invalidate_public_room_summary_txn(txn, room_id)
+
+        try:
+            yield self.runInteraction(
+                "create_room_alias_association", alias_txn
             )
         except self.database_engine.module.IntegrityError:
             raise SynapseError(
                 409, "Room alias %s already exists" % room_alias.to_string()
             )
 
-        for server in servers:
-            # TODO(erikj): Fix this to bulk insert
-            yield self._simple_insert(
-                "room_alias_servers",
-                {
-                    "room_alias": room_alias.to_string(),
-                    "server": server,
-                },
-                desc="create_room_alias_association",
-            )
         self.get_aliases_for_room.invalidate((room_id,))
 
     @defer.inlineCallbacks
@@ -140,6 +168,8 @@ class DirectoryStore(SQLBaseStore):
             (room_alias.to_string(),)
         )
 
+        self._invalidate_public_room_summary_txn(txn, room_id)
+
         return room_id
 
     @cached()
@@ -150,3 +180,106 @@ class DirectoryStore(SQLBaseStore):
             "room_alias",
             desc="get_aliases_for_room",
         )
+
+    def get_public_room_summaries(self):
+        """Get the summaries of the public rooms for the public room list.
+
+        Returns:
+            Deferred dict of room_id to summary dict, or to None if the room's
+            summary needs building with store_public_room_summary.
+        """
+        def get_public_room_summaries_txn(txn):
+            txn.execute(
+                "SELECT r.room_id, s.room_id, s.aliases, s.name, s.topic,"
+                " s.canonical_alias, s.avatar_url, st.joined_members,"
+                " s.world_readable, s.guest_can_join"
+                " FROM rooms AS r"
+                " LEFT JOIN public_room_summaries AS s ON s.room_id = r.room_id"
+                " LEFT JOIN room_stats AS st ON st.room_id = r.room_id"
+                " WHERE r.is_public = ?",
+                (True,)
+            )
+
+            summaries = {}
+            for row in txn.fetchall():
+                room_id, summary_room_id = row[:2]
+                if summary_room_id is None:
+                    summaries[room_id] = None
+                    continue
+
+                (
+                    aliases, name, topic, canonical_alias, avatar_url,
+                    num_joined_members, world_readable, guest_can_join,
+                ) = row[2:]
+
+                summary = {
+                    "room_id": room_id,
+                    "aliases": json.loads(aliases),
+                    "num_joined_members": num_joined_members or 0,
+                    "world_readable": bool(world_readable),
+                    "guest_can_join": bool(guest_can_join),
+                }
+                for key, value in (
+                    ("name", name),
+                    ("topic", topic),
+                    ("canonical_alias", canonical_alias),
+                    ("avatar_url", avatar_url),
+                ):
+                    if value:
+                        summary[key] = value
+
+                summaries[room_id] = summary
+
+            return summaries
+
+        return self.runInteraction(
+            "get_public_room_summaries", get_public_room_summaries_txn
+        )
+
+    def get_public_room_summaries_sequence(self, room_id):
+        """Get a token to pass to store_public_room_summary, which should be
+        fetched before the state the summary is built from.
+        """
+        return self._public_room_summaries_sequences.get(room_id, 0)
+
+    def store_public_room_summary(self, summary, sequence):
+        """Store a summary built by the public room list.
+
+        Args:
+            summary (dict): The summary, as returned by
+                get_public_room_summaries.
+            sequence (int): From get_public_room_summaries_sequence. If the
+                room's summary has been invalidated since, this one might be
+                out of date so isn't stored.
+        """
+        room_id = summary["room_id"]
+        if sequence != self.get_public_room_summaries_sequence(room_id):
+            return defer.succeed(None)
+
+        return self._simple_upsert(
+            table="public_room_summaries",
+            keyvalues={"room_id": room_id},
+            values={
+                "aliases": json.dumps(summary["aliases"]),
+                "name": summary.get("name"),
+                "topic": summary.get("topic"),
+                "canonical_alias": summary.get("canonical_alias"),
+                "avatar_url": summary.get("avatar_url"),
+                "world_readable": summary["world_readable"],
+                "guest_can_join": summary["guest_can_join"],
+            },
+            desc="store_public_room_summary",
+        )
+
+    def _invalidate_public_room_summary_txn(self, txn, room_id):
+        self._simple_delete_txn(
+            txn,
+            table="public_room_summaries",
+            keyvalues={"room_id": room_id},
+        )
+        txn.call_after(self._bump_public_room_summaries_sequence, room_id)
+
+    def _bump_public_room_summaries_sequence(self, room_id):
+        self._public_room_summaries_sequences[room_id] = (
+            self.get_public_room_summaries_sequence(room_id) + 1
+        )
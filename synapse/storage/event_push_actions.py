@@ -30,7 +30,9 @@ class EventPushActionsStore(SQLBaseStore):
         :param tuples: list of tuples of (user_id, profile_tag, actions)
         """
         values = []
+        counts = []
         for uid, profile_tag, actions in tuples:
+            highlight = 1 if _action_has_highlight(actions) else 0
             values.append({
                 'room_id': event.room_id,
                 'event_id': event.event_id,
@@ -40,36 +42,159 @@ class EventPushActionsStore(SQLBaseStore):
                 'stream_ordering': event.internal_metadata.stream_ordering,
                 'topological_ordering': event.depth,
                 'notif': 1,
-                'highlight': 1 if _action_has_highlight(actions) else 0,
+                'highlight': highlight,
             })
 
-        for uid, _, __ in tuples:
-            txn.call_after(
-                self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
-                (event.room_id, uid)
-            )
+            counts.append((uid, 1, highlight))
+
         self._simple_insert_many_txn(txn, "event_push_actions", values)
 
-    @cachedInlineCallbacks(num_args=3, lru=True, tree=True)
-    def get_unread_event_push_actions_by_room_for_user(
-            self, room_id, user_id, last_read_event_id
-    ):
-        def _get_unread_event_push_actions_by_room(txn):
-            sql = (
-                "SELECT stream_ordering, topological_ordering"
-                " FROM events"
-                " WHERE room_id = ? AND event_id = ?"
-            )
-            txn.execute(
-                sql, (room_id, last_read_event_id)
+        # New events are always after the users' read receipts, so we can just
+        # bump their counts.
+        self._add_to_push_summaries_txn(txn, event.room_id, counts)
+
+    @cachedInlineCallbacks(num_args=1, lru=True)
+    def get_unread_push_counts_for_user(self, user_id):
+        """Get the number of notifications and highlights the user has in each
+        room after their read receipt.
+
+        Returns:
+            Deferred: dict of room_id -> {"notify_count": int,
+                "highlight_count": int}. Rooms without any notifications may
+                be missing.
+        """
+        rows = yield self._simple_select_list(
+            table="event_push_summary",
+            keyvalues={"user_id": user_id},
+            retcols=("room_id", "notif_count", "highlight_count"),
+            desc="get_unread_push_counts_for_user",
+        )
+
+        defer.returnValue({
+            row["room_id"]: {
+                "notify_count": row["notif_count"],
+                "highlight_count": row["highlight_count"],
+            }
+            for row in rows
+        })
+
+    def _add_to_push_summaries_txn(self, txn, room_id, counts):
+        """Add to the notification and highlight counts of several users in a
+        room.
+
+        Args:
+            counts (list): (user_id, notif, highlight) tuples.
+        """
+        self._update_push_summaries_txn(
+            txn, room_id, counts,
+            sql=(
+                "UPDATE event_push_summary"
+                " SET notif_count = notif_count + ?,"
+                " highlight_count = highlight_count + ?"
+                " WHERE user_id = ? AND room_id = ?"
+            ),
+        )
+
+    def _set_push_summary_txn(self, txn, user_id, room_id, notif, highlight):
+        self._update_push_summaries_txn(
+            txn, room_id, [(user_id, notif, highlight)],
+            sql=(
+                "UPDATE event_push_summary"
+                " SET notif_count = ?, highlight_count = ?"
+                " WHERE user_id = ? AND room_id = ?"
+            ),
+        )
+
+    def _update_push_summaries_txn(self, txn, room_id, counts, sql):
+        """Run an UPDATE of the push summaries of several users in a room,
+        inserting the summaries that don't exist yet.
+
+        Args:
+            counts (list): (user_id, notif, highlight) tuples for the UPDATE.
+                The counts are also used for any summaries we insert.
+            sql (str): An UPDATE taking notif, highlight, user_id and room_id.
+        """
+        if not counts:
+            return
+
+        for user_id, _, _ in counts:
+            txn.call_after(
+                self.get_unread_push_counts_for_user.invalidate, (user_id,)
             )
-            results = txn.fetchall()
-            if len(results) == 0:
-                return {"notify_count": 0, "highlight_count": 0}
 
-            stream_ordering = results[0][0]
-            topological_ordering = results[0][1]
+        txn.executemany(sql, [
+            (notif, highlight, user_id, room_id)
+            for user_id, notif, highlight in counts
+        ])
+        if txn.rowcount == len(counts):
+            return
+
+        missing = self._get_missing_push_summaries_txn(txn, room_id, counts)
+        if not missing:
+            return
+
+        # This only happens the first time a user gets a notification in a
+        # room, so it's fine to take the lock to avoid racing another insert.
+        self.database_engine.lock_table(txn, "event_push_summary")
 
+        # Anything inserted since our UPDATE needs updating rather than
+        # inserting.
+        still_missing = self._get_missing_push_summaries_txn(
+            txn, room_id, missing
+        )
+        txn.executemany(sql, [
+            (notif, highlight, user_id, room_id)
+            for user_id, notif, highlight in missing
+            if (user_id, notif, highlight) not in still_missing
+        ])
+
+        self._simple_insert_many_txn(
+            txn,
+            table="event_push_summary",
+            values=[
+                {
+                    "user_id": user_id,
+                    "room_id": room_id,
+                    "notif_count": notif,
+                    "highlight_count": highlight,
+                }
+                for user_id, notif, highlight in still_missing
+            ],
+        )
+
+    def _get_missing_push_summaries_txn(self, txn, room_id, counts):
+        """Filter the counts down to those for users without a push summary in
+        the room.
+        """
+        txn.execute(
+            "SELECT user_id FROM event_push_summary WHERE room_id = ?",
+            (room_id,)
+        )
+        existing = set(row[0] for row in txn.fetchall())
+        return [c for c in counts if c[0] not in existing]
+
+    def _recalculate_push_summary_txn(self, txn, user_id, room_id):
+        """Recounts the user's notifications in the room from the push actions
+        after their read receipt. Used when the receipt moves.
+        """
+        sql = (
+            "SELECT e.event_id, e.topological_ordering, e.stream_ordering"
+            " FROM receipts_linearized AS r"
+            " LEFT JOIN events AS e USING (room_id, event_id)"
+            " WHERE r.room_id = ? AND r.user_id = ? AND r.receipt_type = ?"
+        )
+        txn.execute(sql, (room_id, user_id, "m.read"))
+        receipt = txn.fetchone()
+
+        if receipt and receipt[0] is None:
+            # We don't have the event the receipt is for, so we can't tell
+            # which notifications are after it. We assume it's for an event
+            # newer than any we have.
+            self._set_push_summary_txn(txn, user_id, room_id, 0, 0)
+            return
+
+        if receipt:
+            _, topological_ordering, stream_ordering = receipt
             sql = (
                 "SELECT sum(notif), sum(highlight)"
                 " FROM event_push_actions ea"
@@ -85,32 +210,69 @@ class EventPushActionsStore(SQLBaseStore):
                 user_id, room_id,
                 topological_ordering, topological_ordering, stream_ordering
             ))
-            row = txn.fetchone()
-            if row:
-                return {
-                    "notify_count": row[0] or 0,
-                    "highlight_count": row[1] or 0,
-                }
-            else:
-                return {"notify_count": 0, "highlight_count": 0}
+        else:
+            sql = (
+                "SELECT sum(notif), sum(highlight)"
+                " FROM event_push_actions ea"
+                " WHERE user_id = ? AND room_id = ?"
+            )
+            txn.execute(sql, (user_id, room_id))
 
-        ret = yield self.runInteraction(
-            "get_unread_event_push_actions_by_room",
-            _get_unread_event_push_actions_by_room
-        )
-        defer.returnValue(ret)
+        row = txn.fetchone()
+        notif, highlight = (row[0] or 0, row[1] or 0) if row else (0, 0)
+
+        self._set_push_summary_txn(txn, user_id, room_id, notif, highlight)
 
     def _remove_push_actions_for_event_id_txn(self, txn, room_id, event_id):
-        # Sad that we have to blow away the cache for the whole room here
-        txn.call_after(
-            self.get_unread_event_push_actions_by_room_for_user.invalidate_many,
-            (room_id,)
+        # Take the removed actions off the counts of the users they were
+        # counted for, i.e. those that haven't read past the event.
+        sql = (
+            "SELECT ea.user_id, SUM(ea.notif), SUM(ea.highlight)"
+            " FROM event_push_actions AS ea"
+            " LEFT JOIN receipts_linearized AS r"
+            " ON r.room_id = ea.room_id AND r.user_id = ea.user_id"
+            " AND r.receipt_type = ?"
+            " LEFT JOIN events AS e"
+            " ON e.room_id = r.room_id AND e.event_id = r.event_id"
+            " WHERE ea.room_id = ? AND ea.event_id = ?"
+            " AND ("
+            "       e.event_id IS NULL"
+            "       OR ea.topological_ordering > e.topological_ordering"
+            "       OR ("
+            "           ea.topological_ordering = e.topological_ordering"
+            "           AND ea.stream_ordering > e.stream_ordering"
+            "       )"
+            " )"
+            " GROUP BY ea.user_id"
         )
+        txn.execute(sql, ("m.read", room_id, event_id))
+        counts = txn.fetchall()
+
         txn.execute(
             "DELETE FROM event_push_actions WHERE room_id = ? AND event_id = ?",
             (room_id, event_id)
         )
 
+        # The counts may already be zero if the user has a receipt for an
+        # event we don't have, so don't let them go negative.
+        txn.executemany(
+            "UPDATE event_push_summary"
+            " SET notif_count = CASE WHEN notif_count > ?"
+            "     THEN notif_count - ? ELSE 0 END,"
+            " highlight_count = CASE WHEN highlight_count > ?"
+            "     THEN highlight_count - ? ELSE 0 END"
+            " WHERE user_id = ? AND room_id = ?",
+            [
+                (notif, notif, highlight, highlight, user_id, room_id)
+                for user_id, notif, highlight in counts
+            ]
+        )
+
+        for user_id, _, _ in counts:
+            txn.call_after(
+                self.get_unread_push_counts_for_user.invalidate, (user_id,)
+            )
+
 
 def _action_has_highlight(actions):
     for action in actions:
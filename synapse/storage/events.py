@@ -12,7 +12,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from _base import SQLBaseStore, _RollbackButIsFineException
+from _base import (
+    SQLBaseStore, _RollbackButIsFineException, DB_LANE_EVENT_FETCH,
+)
 
 from twisted.internet import defer, reactor
 
@@ -22,6 +24,7 @@ from synapse.events.utils import prune_event
 from synapse.util.logcontext import preserve_fn, PreserveLoggingContext
 from synapse.util.logutils import log_function
 from synapse.api.constants import EventTypes
+from synapse.storage.directory import PUBLIC_ROOM_SUMMARY_TYPES
 
 from canonicaljson import encode_canonical_json
 from contextlib import contextmanager
@@ -177,6 +180,8 @@ class EventsStore(SQLBaseStore):
             txn.call_after(self.get_joined_hosts_for_room.invalidate, (event.room_id,))
             txn.call_after(self.get_room_name_and_aliases, event.room_id)
 
+            self._invalidate_public_room_summary_txn(txn, event.room_id)
+
             self._simple_delete_txn(
                 txn,
                 table="current_state_events",
@@ -195,13 +200,18 @@ class EventsStore(SQLBaseStore):
                     }
                 )
 
-        return self._persist_events_txn(
+        self._persist_events_txn(
             txn,
             [(event, context)],
             backfilled=backfilled,
             is_new_state=is_new_state,
         )
 
+        if current_state:
+            # This is done last, as the room_memberships of the event has to
+            # have been stored.
+            self._recalculate_room_stats_txn(txn, event.room_id)
+
     @log_function
     def _persist_events_txn(self, txn, events_and_contexts, backfilled,
                             is_new_state=True):
@@ -452,6 +462,12 @@ class EventsStore(SQLBaseStore):
         )
 
         if is_new_state:
+            if not context.rejected:
+                self._update_room_stats_txn(
+                    txn, [event for event, _ in state_events_and_contexts]
+                )
+
+            summaries_to_invalidate = set()
             for event, _ in state_events_and_contexts:
                 if not context.rejected:
                     txn.call_after(
@@ -459,6 +475,9 @@ class EventsStore(SQLBaseStore):
                         (event.room_id, event.type, event.state_key,)
                     )
 
+                    if event.type in PUBLIC_ROOM_SUMMARY_TYPES:
+                        summaries_to_invalidate.add(event.room_id)
+
                     if event.type in [EventTypes.Name, EventTypes.Aliases]:
                         txn.call_after(
                             self.get_room_name_and_aliases.invalidate,
@@ -478,6 +497,9 @@ class EventsStore(SQLBaseStore):
                         }
                     )
 
+            for room_id in summaries_to_invalidate:
+                self._invalidate_public_room_summary_txn(txn, room_id)
+
         return
 
     def _store_redaction(self, txn, event):
@@ -712,7 +734,10 @@ class EventsStore(SQLBaseStore):
 
             self._event_fetch_lock.notify()
 
-            if self._event_fetch_ongoing < EVENT_QUEUE_THREADS:
+            max_threads = min(
+                EVENT_QUEUE_THREADS, self._db_lane_limits[DB_LANE_EVENT_FETCH]
+            )
+            if self._event_fetch_ongoing < max_threads:
                 self._event_fetch_ongoing += 1
                 should_start = True
             else:
@@ -994,7 +1019,9 @@ class EventsStore(SQLBaseStore):
                 return None
             return rows[0]["messages"]
 
-        ret = yield self.runInteraction("count_messages", _count_messages)
+        ret = yield self.runBackgroundInteraction(
+            "count_messages", _count_messages
+        )
         defer.returnValue(ret)
 
     @defer.inlineCallbacks
@@ -1056,7 +1083,7 @@ class EventsStore(SQLBaseStore):
 
             return len(rows)
 
-        result = yield self.runInteraction(
+        result = yield self.runBackgroundInteraction(
             self.EVENT_ORIGIN_SERVER_TS_NAME, reindex_search_txn
         )
 
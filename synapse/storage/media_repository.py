@@ -13,12 +13,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from twisted.internet import defer
+
 from _base import SQLBaseStore
 
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How often we write out the access times of remote media.
+REMOTE_MEDIA_ACCESS_FLUSH_MS = 60 * 1000
+
 
 class MediaRepositoryStore(SQLBaseStore):
     """Persistence for attachments and avatars"""
 
+    def __init__(self, hs):
+        super(MediaRepositoryStore, self).__init__(hs)
+
+        # (origin, media_id) -> ts of remote media that has been accessed
+        # since we last wrote the access times out to the database.
+        self._pending_remote_media_accesses = {}
+
+        self._clock.looping_call(
+            self.flush_remote_media_accesses, REMOTE_MEDIA_ACCESS_FLUSH_MS
+        )
+
     def get_default_thumbnails(self, top_level_type, sub_type):
         return []
 
@@ -30,35 +50,87 @@ class MediaRepositoryStore(SQLBaseStore):
         return self._simple_select_one(
             "local_media_repository",
             {"media_id": media_id},
-            ("media_type", "media_length", "upload_name", "created_ts"),
+            (
+                "media_type", "media_length", "upload_name", "created_ts",
+                "sha256",
+            ),
             allow_none=True,
             desc="get_local_media",
         )
 
     def store_local_media(self, media_id, media_type, time_now_ms, upload_name,
-                          media_length, user_id):
-        return self._simple_insert(
-            "local_media_repository",
-            {
-                "media_id": media_id,
-                "media_type": media_type,
-                "created_ts": time_now_ms,
-                "upload_name": upload_name,
-                "media_length": media_length,
-                "user_id": user_id.to_string(),
-            },
-            desc="store_local_media",
-        )
+                          media_length, user_id, sha256=None):
+        """Store the metadata for a new piece of local media.
+
+        The reference to the blob is taken before the caller moves the
+        content into it, so that the blob can't be evicted in the meantime.
+
+        Args:
+            sha256 (str|None): The blob to store the content in, if any.
+
+        Returns:
+            Deferred[(str|None, bool)]: The blob the content should be moved
+            into, which is None if the blob is being deleted and the content
+            should stay under its media_id, and whether the blob was already
+            in use by other media.
+        """
+        def store_local_media_txn(txn):
+            blob, deduplicated = self._add_media_blob_reference_txn(
+                txn, sha256, media_length, time_now_ms,
+            )
+            self._simple_insert_txn(
+                txn,
+                "local_media_repository",
+                {
+                    "media_id": media_id,
+                    "media_type": media_type,
+                    "created_ts": time_now_ms,
+                    "upload_name": upload_name,
+                    "media_length": media_length,
+                    "user_id": user_id.to_string(),
+                    "sha256": blob,
+                },
+            )
+            return blob, deduplicated
+
+        return self.runInteraction("store_local_media", store_local_media_txn)
+
+    def delete_local_media(self, media_id, sha256):
+        """Delete the row for a piece of local media and its thumbnails, and
+        drop its reference to its blob, if any.
+        """
+        def delete_local_media_txn(txn):
+            self._simple_delete_txn(
+                txn, "local_media_repository_thumbnails", {"media_id": media_id}
+            )
+            self._simple_delete_txn(
+                txn, "local_media_repository", {"media_id": media_id}
+            )
+            if sha256:
+                self._remove_media_blob_reference_txn(txn, sha256)
+
+        return self.runInteraction("delete_local_media", delete_local_media_txn)
 
     def get_local_media_thumbnails(self, media_id):
-        return self._simple_select_list(
-            "local_media_repository_thumbnails",
-            {"media_id": media_id},
-            (
-                "thumbnail_width", "thumbnail_height", "thumbnail_method",
-                "thumbnail_type", "thumbnail_length",
-            ),
-            desc="get_local_media_thumbnails",
+        def get_local_media_thumbnails_txn(txn):
+            # Media stored in a blob will only have thumbnails for the blob,
+            # and other media will only have thumbnails of its own.
+            sql = (
+                "SELECT thumbnail_width, thumbnail_height, thumbnail_method,"
+                " thumbnail_type, thumbnail_length"
+                " FROM local_media_repository_thumbnails WHERE media_id = ?"
+                " UNION ALL"
+                " SELECT t.thumbnail_width, t.thumbnail_height,"
+                " t.thumbnail_method, t.thumbnail_type, t.thumbnail_length"
+                " FROM local_media_repository AS m"
+                " INNER JOIN media_blob_thumbnails AS t USING (sha256)"
+                " WHERE m.media_id = ?"
+            )
+            txn.execute(sql, (media_id, media_id))
+            return self.cursor_to_dict(txn)
+
+        return self.runInteraction(
+            "get_local_media_thumbnails", get_local_media_thumbnails_txn
         )
 
     def store_local_thumbnail(self, media_id, thumbnail_width,
@@ -83,7 +155,7 @@ class MediaRepositoryStore(SQLBaseStore):
             {"media_origin": origin, "media_id": media_id},
             (
                 "media_type", "media_length", "upload_name", "created_ts",
-                "filesystem_id",
+                "filesystem_id", "sha256",
             ),
             allow_none=True,
             desc="get_cached_remote_media",
@@ -91,47 +163,364 @@ class MediaRepositoryStore(SQLBaseStore):
 
     def store_cached_remote_media(self, origin, media_id, media_type,
                                   media_length, time_now_ms, upload_name,
-                                  filesystem_id):
+                                  filesystem_id, sha256=None):
+        """Store the metadata for a newly downloaded piece of remote media.
+
+        Args:
+            sha256 (str|None): The blob to store the content in, if any.
+
+        Returns:
+            Deferred[(str|None, bool)]: As for store_local_media.
+        """
+        def store_cached_remote_media_txn(txn):
+            blob, deduplicated = self._add_media_blob_reference_txn(
+                txn, sha256, media_length, time_now_ms,
+            )
+            self._simple_insert_txn(
+                txn,
+                "remote_media_cache",
+                {
+                    "media_origin": origin,
+                    "media_id": media_id,
+                    "media_type": media_type,
+                    "media_length": media_length,
+                    "created_ts": time_now_ms,
+                    "last_access_ts": time_now_ms,
+                    "upload_name": upload_name,
+                    "filesystem_id": filesystem_id,
+                    "sha256": blob,
+                },
+            )
+            return blob, deduplicated
+
+        return self.runInteraction(
+            "store_cached_remote_media", store_cached_remote_media_txn
+        )
+
+    def mark_remote_media_accessed(self, origin, media_id):
+        """Note that a piece of remote media has been served. The access time
+        is written out to the database in the background, in a batch with
+        other accesses.
+        """
+        self._pending_remote_media_accesses[(origin, media_id)] = (
+            self._clock.time_msec()
+        )
+
+    @defer.inlineCallbacks
+    def flush_remote_media_accesses(self):
+        """Write out the access times recorded by mark_remote_media_accessed.
+        """
+        if not self._pending_remote_media_accesses:
+            return
+
+        accesses = self._pending_remote_media_accesses
+        self._pending_remote_media_accesses = {}
+
+        def update_remote_media_access_txn(txn):
+            txn.executemany(
+                "UPDATE remote_media_cache SET last_access_ts = ?"
+                " WHERE media_origin = ? AND media_id = ?",
+                [
+                    (ts, origin, media_id)
+                    for (origin, media_id), ts in accesses.items()
+                ]
+            )
+
+        # This is called from a looping call, which would stop if we let the
+        # failure propagate.
+        try:
+            yield self.runBackgroundInteraction(
+                "update_remote_media_access", update_remote_media_access_txn
+            )
+        except Exception:
+            logger.exception("Failed to update remote media access times")
+
+    def get_remote_media_cache_size(self):
+        """Get the total size of the cached remote media and its thumbnails.
+
+        Blobs used by remote media are counted once, however many pieces of
+        media use them, along with their thumbnails.
+
+        Returns:
+            Deferred[int]: The size in bytes.
+        """
+        def get_remote_media_cache_size_txn(txn):
+            txn.execute(
+                "SELECT COALESCE(SUM(media_length), 0) FROM remote_media_cache"
+                " WHERE sha256 IS NULL"
+            )
+            media_size, = txn.fetchone()
+
+            txn.execute(
+                "SELECT COALESCE(SUM(thumbnail_length), 0)"
+                " FROM remote_media_cache_thumbnails"
+            )
+            thumbnail_size, = txn.fetchone()
+
+            txn.execute(
+                "SELECT COALESCE(SUM(media_length), 0) FROM media_blobs"
+                " WHERE sha256 IN (SELECT sha256 FROM remote_media_cache)"
+            )
+            blob_size, = txn.fetchone()
+
+            txn.execute(
+                "SELECT COALESCE(SUM(thumbnail_length), 0)"
+                " FROM media_blob_thumbnails"
+                " WHERE sha256 IN (SELECT sha256 FROM remote_media_cache)"
+            )
+            blob_thumbnail_size, = txn.fetchone()
+
+            return (
+                media_size + thumbnail_size + blob_size + blob_thumbnail_size
+            )
+
+        return self.runBackgroundInteraction(
+            "get_remote_media_cache_size", get_remote_media_cache_size_txn
+        )
+
+    def get_least_recently_accessed_remote_media(self, limit):
+        """Get the remote media that was accessed the longest time ago.
+
+        Returns:
+            Deferred[list[dict]]: The media, ordered by last access time.
+        """
+        def get_least_recently_accessed_remote_media_txn(txn):
+            txn.execute(
+                "SELECT media_origin, media_id, filesystem_id, sha256,"
+                " media_length FROM remote_media_cache"
+                " ORDER BY last_access_ts ASC LIMIT ?",
+                (limit,)
+            )
+            return self.cursor_to_dict(txn)
+
+        return self.runBackgroundInteraction(
+            "get_least_recently_accessed_remote_media",
+            get_least_recently_accessed_remote_media_txn,
+        )
+
+    def delete_remote_media(self, media):
+        """Delete the rows for a batch of cached remote media and its
+        thumbnails.
+
+        Args:
+            media (list[dict]): As returned by
+                get_least_recently_accessed_remote_media.
+
+        Returns:
+            Deferred[list[str]]: The sha256 of the blobs that are no longer
+            used, which can be passed to mark_media_blobs_deleting.
+        """
+        def delete_remote_media_txn(txn):
+            keys = [(m["media_origin"], m["media_id"]) for m in media]
+
+            txn.executemany(
+                "DELETE FROM remote_media_cache_thumbnails"
+                " WHERE media_origin = ? AND media_id = ?",
+                keys
+            )
+            txn.executemany(
+                "DELETE FROM remote_media_cache"
+                " WHERE media_origin = ? AND media_id = ?",
+                keys
+            )
+
+            return [
+                m["sha256"] for m in media
+                if m["sha256"] and self._remove_media_blob_reference_txn(
+                    txn, m["sha256"]
+                )
+            ]
+
+        return self.runBackgroundInteraction(
+            "delete_remote_media", delete_remote_media_txn
+        )
+
+    def get_remote_media_thumbnails(self, origin, media_id):
+        def get_remote_media_thumbnails_txn(txn):
+            # Media stored in a blob will only have thumbnails for the blob,
+            # and other media will only have thumbnails of its own.
+            sql = (
+                "SELECT thumbnail_width, thumbnail_height, thumbnail_method,"
+                " thumbnail_type, thumbnail_length, filesystem_id"
+                " FROM remote_media_cache_thumbnails"
+                " WHERE media_origin = ? AND media_id = ?"
+                " UNION ALL"
+                " SELECT t.thumbnail_width, t.thumbnail_height,"
+                " t.thumbnail_method, t.thumbnail_type, t.thumbnail_length,"
+                " m.filesystem_id"
+                " FROM remote_media_cache AS m"
+                " INNER JOIN media_blob_thumbnails AS t USING (sha256)"
+                " WHERE m.media_origin = ? AND m.media_id = ?"
+            )
+            txn.execute(sql, (origin, media_id, origin, media_id))
+            return self.cursor_to_dict(txn)
+
+        return self.runInteraction(
+            "get_remote_media_thumbnails", get_remote_media_thumbnails_txn
+        )
+
+    def store_remote_media_thumbnail(self, origin, media_id, filesystem_id,
+                                     thumbnail_width, thumbnail_height,
+                                     thumbnail_type, thumbnail_method,
+                                     thumbnail_length):
         return self._simple_insert(
-            "remote_media_cache",
+            "remote_media_cache_thumbnails",
             {
                 "media_origin": origin,
                 "media_id": media_id,
-                "media_type": media_type,
+                "thumbnail_width": thumbnail_width,
+                "thumbnail_height": thumbnail_height,
+                "thumbnail_method": thumbnail_method,
+                "thumbnail_type": thumbnail_type,
+                "thumbnail_length": thumbnail_length,
+                "filesystem_id": filesystem_id,
+            },
+            desc="store_remote_media_thumbnail",
+        )
+
+    def _add_media_blob_reference_txn(self, txn, sha256, media_length,
+                                      time_now_ms):
+        """Add a reference to a blob, creating it if it doesn't exist yet.
+
+        Blobs with a negative refcount are being deleted by
+        mark_media_blobs_deleting and can't be referenced again.
+
+        Returns:
+            (str|None, bool): The blob, or None if it can't be used, and
+            whether it was already in use.
+        """
+        if not sha256:
+            return None, False
+
+        sql = (
+            "UPDATE media_blobs SET refcount = refcount + 1"
+            " WHERE sha256 = ? AND refcount >= 0"
+        )
+
+        txn.execute(sql, (sha256,))
+        if txn.rowcount:
+            return sha256, True
+
+        # Lock the table so that we don't race with another upload of the same
+        # content.
+        self.database_engine.lock_table(txn, "media_blobs")
+
+        txn.execute(sql, (sha256,))
+        if txn.rowcount:
+            return sha256, True
+
+        refcount = self._simple_select_one_onecol_txn(
+            txn,
+            table="media_blobs",
+            keyvalues={"sha256": sha256},
+            retcol="refcount",
+            allow_none=True,
+        )
+        if refcount is not None:
+            return None, False
+
+        self._simple_insert_txn(
+            txn,
+            "media_blobs",
+            {
+                "sha256": sha256,
                 "media_length": media_length,
+                "refcount": 1,
                 "created_ts": time_now_ms,
-                "upload_name": upload_name,
-                "filesystem_id": filesystem_id,
             },
-            desc="store_cached_remote_media",
         )
+        return sha256, False
 
-    def get_remote_media_thumbnails(self, origin, media_id):
+    def _remove_media_blob_reference_txn(self, txn, sha256):
+        """Remove a reference to a blob. The blob isn't deleted here, as it
+        may be referenced again before the caller gets round to deleting its
+        files.
+
+        Returns:
+            bool: True if the blob is no longer used.
+        """
+        txn.execute(
+            "UPDATE media_blobs SET refcount = refcount - 1 WHERE sha256 = ?",
+            (sha256,)
+        )
+
+        refcount = self._simple_select_one_onecol_txn(
+            txn,
+            table="media_blobs",
+            keyvalues={"sha256": sha256},
+            retcol="refcount",
+            allow_none=True,
+        )
+        return refcount == 0
+
+    def mark_media_blobs_deleting(self, sha256s):
+        """Mark blobs that are still unused as being deleted, so that nothing
+        can start using them while their files are removed.
+
+        Args:
+            sha256s (list[str]): Blobs returned by delete_remote_media.
+
+        Returns:
+            Deferred[list[str]]: The blobs whose files should be deleted and
+            then passed to delete_media_blobs. This includes any blobs that
+            were being deleted when we were last stopped.
+        """
+        def mark_media_blobs_deleting_txn(txn):
+            txn.executemany(
+                "UPDATE media_blobs SET refcount = -1"
+                " WHERE sha256 = ? AND refcount = 0",
+                [(sha256,) for sha256 in sha256s]
+            )
+            txn.execute("SELECT sha256 FROM media_blobs WHERE refcount < 0")
+            return [row[0] for row in txn.fetchall()]
+
+        return self.runBackgroundInteraction(
+            "mark_media_blobs_deleting", mark_media_blobs_deleting_txn
+        )
+
+    def delete_media_blobs(self, sha256s):
+        """Delete the rows of blobs returned by mark_media_blobs_deleting,
+        once their files have been deleted.
+        """
+        def delete_media_blobs_txn(txn):
+            args = [(sha256,) for sha256 in sha256s]
+            txn.executemany(
+                "DELETE FROM media_blob_thumbnails WHERE sha256 = ?", args
+            )
+            txn.executemany(
+                "DELETE FROM media_blobs WHERE sha256 = ? AND refcount < 0", args
+            )
+
+        return self.runBackgroundInteraction(
+            "delete_media_blobs", delete_media_blobs_txn
+        )
+
+    def get_media_blob_thumbnails(self, sha256):
         return self._simple_select_list(
-            "remote_media_cache_thumbnails",
-            {"media_origin": origin, "media_id": media_id},
+            "media_blob_thumbnails",
+            {"sha256": sha256},
             (
                 "thumbnail_width", "thumbnail_height", "thumbnail_method",
-                "thumbnail_type", "thumbnail_length", "filesystem_id",
+                "thumbnail_type", "thumbnail_length",
             ),
-            desc="get_remote_media_thumbnails",
+            desc="get_media_blob_thumbnails",
         )
 
-    def store_remote_media_thumbnail(self, origin, media_id, filesystem_id,
-                                     thumbnail_width, thumbnail_height,
-                                     thumbnail_type, thumbnail_method,
-                                     thumbnail_length):
+    def store_media_blob_thumbnail(self, sha256, thumbnail_width,
+                                   thumbnail_height, thumbnail_type,
+                                   thumbnail_method, thumbnail_length):
         return self._simple_insert(
-            "remote_media_cache_thumbnails",
+            "media_blob_thumbnails",
             {
-                "media_origin": origin,
-                "media_id": media_id,
+                "sha256": sha256,
                 "thumbnail_width": thumbnail_width,
                 "thumbnail_height": thumbnail_height,
                 "thumbnail_method": thumbnail_method,
                 "thumbnail_type": thumbnail_type,
                 "thumbnail_length": thumbnail_length,
-                "filesystem_id": filesystem_id,
             },
-            desc="store_remote_media_thumbnail",
+            # Media sharing the blob may have made the same thumbnail
+            # concurrently, in which case we have just rewritten its file.
+            or_ignore=True,
+            desc="store_media_blob_thumbnail",
         )
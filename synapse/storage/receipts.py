@@ -60,6 +60,38 @@ class ReceiptsStore(SQLBaseStore):
             allow_none=True,
         )
 
+    @cachedList(cache=get_last_receipt_event_id_for_user.cache, list_name="room_ids",
+                num_args=3, inlineCallbacks=True)
+    def get_last_receipt_event_ids_for_user_for_rooms(self, user_id, room_ids,
+                                                      receipt_type):
+        """Get the last receipt of the given type for each of the given rooms.
+
+        Fetches all of the user's receipts of that type in a single query, and
+        fills in the `get_last_receipt_event_id_for_user` cache for each room.
+
+        Returns:
+            Deferred[dict]: map of room_id to event_id, or None if the user has
+            no receipt in the room.
+        """
+        def f(txn):
+            sql = (
+                "SELECT room_id, event_id FROM receipts_linearized"
+                " WHERE user_id = ? AND receipt_type = ?"
+            )
+            txn.execute(sql, (user_id, receipt_type))
+            return txn.fetchall()
+
+        rows = yield self.runInteraction(
+            "get_last_receipt_event_ids_for_user_for_rooms", f
+        )
+
+        room_ids = set(room_ids)
+        defer.returnValue({
+            room_id: event_id
+            for room_id, event_id in rows
+            if room_id in room_ids
+        })
+
     @cachedInlineCallbacks(num_args=2)
     def get_receipts_for_user(self, user_id, receipt_type):
         def f(txn):
@@ -295,6 +327,9 @@ class ReceiptsStore(SQLBaseStore):
             }
         )
 
+        if receipt_type == "m.read":
+            self._recalculate_push_summary_txn(txn, user_id, room_id)
+
         return True
 
     @defer.inlineCallbacks
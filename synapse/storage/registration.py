@@ -20,7 +20,12 @@ from twisted.internet import defer
 from synapse.api.errors import StoreError, Codes
 
 from ._base import SQLBaseStore
-from synapse.util.caches.descriptors import cached, cachedInlineCallbacks, cachedList
+from synapse.util.caches.descriptors import (
+    Cache, cached, cachedInlineCallbacks, cachedList,
+)
+
+# The number of access tokens whose user info we keep in memory.
+ACCESS_TOKEN_CACHE_SIZE = 10000
 
 
 class RegistrationStore(SQLBaseStore):
@@ -30,6 +35,14 @@ class RegistrationStore(SQLBaseStore):
 
         self.clock = hs.get_clock()
 
+        # Maps (access_token,) to the user info that Auth derived from it, so
+        # that we don't need to validate the macaroon on every request. This
+        # must be invalidated whenever a token is revoked.
+        self.access_token_user_info = Cache(
+            name="access_token_user_info",
+            max_entries=ACCESS_TOKEN_CACHE_SIZE,
+        )
+
     @defer.inlineCallbacks
     def add_access_token_to_user(self, user_id, token):
         """Adds an access token for the given user.
@@ -174,20 +187,30 @@ class RegistrationStore(SQLBaseStore):
         )
 
     def _user_delete_access_tokens(self, txn, user_id):
+        # Invalidate the caches before the tokens are gone, otherwise we
+        # wouldn't be able to find them.
+        self._invalidate_access_tokens_txn(txn, user_id)
+
         txn.execute(
             "DELETE FROM access_tokens WHERE user_id = ?",
             (user_id, )
         )
 
-    @defer.inlineCallbacks
     def flush_user(self, user_id):
-        rows = yield self._execute(
-            'flush_user', None,
-            "SELECT token FROM access_tokens WHERE user_id = ?",
-            user_id
+        return self.runInteraction(
+            "flush_user", self._invalidate_access_tokens_txn, user_id
+        )
+
+    def _invalidate_access_tokens_txn(self, txn, user_id):
+        """Invalidate the cached lookups of all of a user's access tokens once
+        the transaction has completed.
+        """
+        txn.execute(
+            "SELECT token FROM access_tokens WHERE user_id = ?", (user_id,)
         )
-        for r in rows:
-            self.get_user_by_access_token.invalidate((r,))
+        for token, in txn.fetchall():
+            txn.call_after(self.get_user_by_access_token.invalidate, (token,))
+            txn.call_after(self.access_token_user_info.invalidate, (token,))
 
     @cached()
     def get_user_by_access_token(self, token):
@@ -244,6 +267,10 @@ class RegistrationStore(SQLBaseStore):
         sql = "UPDATE refresh_tokens SET token = ? WHERE token = ?"
         txn.execute(sql, (new_token, old_token,))
 
+        # Make sure that the user's existing access tokens are looked up
+        # afresh rather than trusted from the cache.
+        self._invalidate_access_tokens_txn(txn, user_id)
+
         return user_id, new_token
 
     @defer.inlineCallbacks
@@ -159,6 +159,15 @@ class RoomStore(SQLBaseStore):
             ))
 
     def _store_event_search_txn(self, txn, event, key, value):
+        if self.search_index is not None:
+            # The index is only written to once we know the event has been
+            # persisted.
+            txn.call_after(self.search_index.add_documents, [(
+                event.event_id, event.room_id, key, value,
+                event.origin_server_ts, event.internal_metadata.stream_ordering,
+            )])
+            return
+
         if isinstance(self.database_engine, PostgresEngine):
             sql = (
                 "INSERT INTO event_search (event_id, room_id, key, vector)"
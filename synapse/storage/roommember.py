@@ -20,7 +20,7 @@ from collections import namedtuple
 from ._base import SQLBaseStore
 from synapse.util.caches.descriptors import cached, cachedInlineCallbacks
 
-from synapse.api.constants import Membership
+from synapse.api.constants import EventTypes, Membership
 from synapse.types import UserID
 
 import logging
@@ -34,6 +34,15 @@ RoomsForUser = namedtuple(
 )
 
 
+# The room_stats column each membership is counted in.
+_ROOM_STATS_COLUMNS = {
+    Membership.JOIN: "joined_members",
+    Membership.INVITE: "invited_members",
+    Membership.LEAVE: "left_members",
+    Membership.BAN: "left_members",
+}
+
+
 class RoomMemberStore(SQLBaseStore):
 
     def _store_room_members_txn(self, txn, events):
@@ -63,6 +72,142 @@ class RoomMemberStore(SQLBaseStore):
                 event.state_key, event.internal_metadata.stream_ordering
             )
 
+    @cachedInlineCallbacks(max_entries=50000)
+    def get_room_stats(self, room_id):
+        """Get the size of a room from its current state.
+
+        Returns:
+            Deferred dict: with the number of joined_members, invited_members
+            and left_members (including banned members), and the number of
+            state_events.
+        """
+        row = yield self._simple_select_one(
+            table="room_stats",
+            keyvalues={"room_id": room_id},
+            retcols=(
+                "joined_members", "invited_members", "left_members",
+                "state_events",
+            ),
+            allow_none=True,
+            desc="get_room_stats",
+        )
+
+        if row is None:
+            row = {
+                "joined_members": 0,
+                "invited_members": 0,
+                "left_members": 0,
+                "state_events": 0,
+            }
+
+        defer.returnValue(row)
+
+    def _update_room_stats_txn(self, txn, events):
+        """Update the room_stats of the rooms the given state events are about
+        to become the current state of. Must be called before
+        current_state_events is updated.
+        """
+        # (room_id, type, state_key) -> (event_id, membership) of the current
+        # state, including the events earlier in the list.
+        current = {}
+        deltas = {}
+        for event in events:
+            key = (event.room_id, event.type, event.state_key)
+            if key in current:
+                prev = current[key]
+            else:
+                txn.execute(
+                    "SELECT c.event_id, m.membership"
+                    " FROM current_state_events AS c"
+                    " LEFT JOIN room_memberships AS m ON m.event_id = c.event_id"
+                    " WHERE c.room_id = ? AND c.type = ? AND c.state_key = ?",
+                    key
+                )
+                prev = txn.fetchone()
+
+            membership = None
+            if event.type == EventTypes.Member:
+                membership = event.membership
+            current[key] = (event.event_id, membership)
+
+            if prev and prev[0] == event.event_id:
+                continue
+
+            delta = deltas.setdefault(event.room_id, {
+                "joined_members": 0,
+                "invited_members": 0,
+                "left_members": 0,
+                "state_events": 0,
+            })
+            if not prev:
+                delta["state_events"] += 1
+            elif prev[1] in _ROOM_STATS_COLUMNS:
+                delta[_ROOM_STATS_COLUMNS[prev[1]]] -= 1
+            if membership in _ROOM_STATS_COLUMNS:
+                delta[_ROOM_STATS_COLUMNS[membership]] += 1
+
+        sql = (
+            "UPDATE room_stats SET joined_members = joined_members + ?,"
+            " invited_members = invited_members + ?,"
+            " left_members = left_members + ?,"
+            " state_events = state_events + ?"
+            " WHERE room_id = ?"
+        )
+        for room_id, delta in deltas.items():
+            txn.call_after(self.get_room_stats.invalidate, (room_id,))
+
+            args = (
+                delta["joined_members"], delta["invited_members"],
+                delta["left_members"], delta["state_events"], room_id,
+            )
+            txn.execute(sql, args)
+            if txn.rowcount:
+                continue
+
+            # This only happens for the first state event of each room, so
+            # it's fine to take the lock to avoid racing another insert.
+            self.database_engine.lock_table(txn, "room_stats")
+
+            txn.execute(sql, args)
+            if txn.rowcount:
+                continue
+
+            values = dict(delta)
+            values["room_id"] = room_id
+            self._simple_insert_txn(txn, table="room_stats", values=values)
+
+    def _recalculate_room_stats_txn(self, txn, room_id):
+        """Recount the room_stats of a room from its current state. Used when
+        the whole of the current state is replaced.
+        """
+        txn.call_after(self.get_room_stats.invalidate, (room_id,))
+
+        self._simple_delete_txn(
+            txn,
+            table="room_stats",
+            keyvalues={"room_id": room_id},
+        )
+
+        txn.execute(
+            "INSERT INTO room_stats ("
+            " room_id, joined_members, invited_members, left_members,"
+            " state_events"
+            ")"
+            " SELECT c.room_id,"
+            " SUM(CASE WHEN m.membership = ? THEN 1 ELSE 0 END),"
+            " SUM(CASE WHEN m.membership = ? THEN 1 ELSE 0 END),"
+            " SUM(CASE WHEN m.membership IN (?, ?) THEN 1 ELSE 0 END),"
+            " COUNT(*)"
+            " FROM current_state_events AS c"
+            " LEFT JOIN room_memberships AS m ON m.event_id = c.event_id"
+            " WHERE c.room_id = ?"
+            " GROUP BY c.room_id",
+            (
+                Membership.JOIN, Membership.INVITE, Membership.LEAVE,
+                Membership.BAN, room_id,
+            )
+        )
+
     def get_room_member(self, user_id, room_id):
         """Retrieve the current state of a room member.
 
@@ -0,0 +1,49 @@
+/* Copyright 2016 OpenMarket Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/* The number of notifying and highlighting push actions each user has in each
+ * room after their read receipt. Maintained as push actions and receipts are
+ * inserted, so that sync doesn't have to sum over event_push_actions.
+ */
+CREATE TABLE IF NOT EXISTS event_push_summary (
+    user_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    notif_count BIGINT NOT NULL,
+    highlight_count BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX event_push_summary_user_rm ON event_push_summary(
+    user_id, room_id
+);
+
+INSERT INTO event_push_summary (user_id, room_id, notif_count, highlight_count)
+    SELECT ea.user_id, ea.room_id, COALESCE(SUM(ea.notif), 0),
+        COALESCE(SUM(ea.highlight), 0)
+    FROM event_push_actions AS ea
+    LEFT JOIN (
+        SELECT r.user_id, r.room_id, e.topological_ordering, e.stream_ordering
+        FROM receipts_linearized AS r
+        LEFT JOIN events AS e USING (room_id, event_id)
+        WHERE r.receipt_type = 'm.read'
+    ) AS rr ON rr.user_id = ea.user_id AND rr.room_id = ea.room_id
+    -- Users with a receipt for an event we don't have get no notifications,
+    -- as the orderings we compare with are then NULL.
+    WHERE rr.user_id IS NULL
+        OR ea.topological_ordering > rr.topological_ordering
+        OR (
+            ea.topological_ordering = rr.topological_ordering
+            AND ea.stream_ordering > rr.stream_ordering
+        )
+    GROUP BY ea.user_id, ea.room_id;
@@ -0,0 +1,43 @@
+/* Copyright 2016 OpenMarket Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/* Media content stored on disk under the sha256 of its contents, so that
+ * identical uploads and remote downloads share a single file and a single
+ * set of thumbnails.
+ */
+CREATE TABLE IF NOT EXISTS media_blobs (
+    sha256 TEXT NOT NULL, -- The hex encoded sha256 of the content.
+    media_length BIGINT NOT NULL, -- Length of the content in bytes.
+    refcount INTEGER NOT NULL, -- The number of local and remote media using it.
+    created_ts BIGINT NOT NULL, -- When the content was first stored in ms.
+    UNIQUE (sha256)
+);
+
+CREATE TABLE IF NOT EXISTS media_blob_thumbnails (
+    sha256 TEXT NOT NULL, -- The blob the thumbnail was made from.
+    thumbnail_width INTEGER, -- The width of the thumbnail in pixels.
+    thumbnail_height INTEGER, -- The height of the thumbnail in pixels.
+    thumbnail_type TEXT, -- The MIME-type of the thumbnail.
+    thumbnail_method TEXT, -- The method used to make the thumbnail.
+    thumbnail_length INTEGER, -- The length of the thumbnail in bytes.
+    UNIQUE (
+        sha256, thumbnail_width, thumbnail_height, thumbnail_type
+    )
+);
+
+/* NULL for media stored before content addressing, which is still stored
+ * under its media_id or filesystem_id. */
+ALTER TABLE local_media_repository ADD COLUMN sha256 TEXT;
+ALTER TABLE remote_media_cache ADD COLUMN sha256 TEXT;
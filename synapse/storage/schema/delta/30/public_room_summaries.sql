@@ -0,0 +1,33 @@
+/* Copyright 2016 OpenMarket Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/* What the public room list shows for each room, so that it doesn't have to
+ * load the current state of every public room. A room's row is deleted when
+ * its state or aliases change, and rebuilt the next time the list is.
+ */
+CREATE TABLE IF NOT EXISTS public_room_summaries (
+    room_id TEXT NOT NULL,
+    aliases TEXT NOT NULL, -- JSON list of aliases
+    name TEXT,
+    topic TEXT,
+    canonical_alias TEXT,
+    avatar_url TEXT,
+    world_readable BOOLEAN NOT NULL,
+    guest_can_join BOOLEAN NOT NULL
+);
+
+CREATE UNIQUE INDEX public_room_summaries_room_id ON public_room_summaries(
+    room_id
+);
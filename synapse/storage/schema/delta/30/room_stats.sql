@@ -0,0 +1,41 @@
+/* Copyright 2016 OpenMarket Ltd
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *    http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+/* The number of members of each room in each membership, and the number of
+ * events in its current state. Maintained as current_state_events is updated,
+ * so that room sizes can be read without loading the room's state.
+ * left_members includes banned members.
+ */
+CREATE TABLE IF NOT EXISTS room_stats (
+    room_id TEXT NOT NULL,
+    joined_members BIGINT NOT NULL,
+    invited_members BIGINT NOT NULL,
+    left_members BIGINT NOT NULL,
+    state_events BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX room_stats_room_id ON room_stats(room_id);
+
+INSERT INTO room_stats (
+    room_id, joined_members, invited_members, left_members, state_events
+)
+    SELECT c.room_id,
+        SUM(CASE WHEN m.membership = 'join' THEN 1 ELSE 0 END),
+        SUM(CASE WHEN m.membership = 'invite' THEN 1 ELSE 0 END),
+        SUM(CASE WHEN m.membership IN ('leave', 'ban') THEN 1 ELSE 0 END),
+        COUNT(*)
+    FROM current_state_events AS c
+    LEFT JOIN room_memberships AS m ON m.event_id = c.event_id
+    GROUP BY c.room_id;
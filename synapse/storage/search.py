@@ -13,11 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor, threads
 
 from .background_updates import BackgroundUpdateStore
+from .search_index import SearchIndex
 from synapse.api.errors import SynapseError
 from synapse.storage.engines import PostgresEngine, Sqlite3Engine
+from synapse.util.logcontext import preserve_context_over_fn
 
 import logging
 import re
@@ -25,6 +27,19 @@ import re
 
 logger = logging.getLogger(__name__)
 
+# The most rooms we list as arguments in a search query on SQLite, which limits
+# the number of arguments a statement can have. Searches over more rooms than
+# this put the rooms in a temporary table instead.
+MAX_SEARCH_ROOM_ARGS = 500
+
+# The number of matching events at which we stop counting the results of a
+# search. The count returned to clients is a lower bound beyond this.
+MAX_SEARCH_RESULT_COUNT = 1000
+
+# How many events to read at a time when adding the events persisted since the
+# search index was last written to.
+SEARCH_INDEX_CATCH_UP_BATCH_SIZE = 1000
+
 
 class SearchStore(BackgroundUpdateStore):
 
@@ -36,6 +51,77 @@ class SearchStore(BackgroundUpdateStore):
             self.EVENT_SEARCH_UPDATE_NAME, self._background_reindex_search
         )
 
+        # If configured, events are indexed in and searched with a separate
+        # SearchIndex rather than the event_search table.
+        self.search_index = None
+        if hs.config.search_index_path:
+            self.search_index = SearchIndex(hs.config.search_index_path)
+            self.search_index.start()
+            reactor.addSystemEventTrigger(
+                "before", "shutdown", self.search_index.stop
+            )
+            self._clock.call_later(0, self._catch_up_search_index)
+
+    @defer.inlineCallbacks
+    def _catch_up_search_index(self):
+        """Add the events that were persisted after the search index was last
+        written to, e.g. because they were still queued when we stopped.
+
+        On SQLite events are persisted one transaction at a time, so are
+        queued for the index in stream order and the index's position is
+        accurate.
+        """
+        try:
+            position = yield preserve_context_over_fn(
+                threads.deferToThread, self.search_index.get_stream_position
+            )
+
+            while True:
+                docs, position = yield self.runBackgroundInteraction(
+                    "catch_up_search_index", self._get_search_index_docs_txn,
+                    position, SEARCH_INDEX_CATCH_UP_BATCH_SIZE,
+                )
+                if position is None:
+                    break
+                self.search_index.add_documents(docs)
+        except Exception:
+            logger.exception("Failed to catch up search index")
+
+    def _get_search_index_docs_txn(self, txn, from_stream, limit):
+        """Get the documents to add to the search index for the events after
+        the given stream ordering.
+
+        Returns:
+            (list, int|None): The documents and the stream ordering to fetch
+            the next batch from, or None if there were no events.
+        """
+        txn.execute(
+            "SELECT stream_ordering, event_id FROM events"
+            " WHERE stream_ordering > ? AND type IN (%s)"
+            " ORDER BY stream_ordering ASC LIMIT ?" % (
+                ",".join("?" for _ in _SEARCH_KEYS),
+            ),
+            [from_stream] + list(_SEARCH_KEYS) + [limit]
+        )
+        rows = txn.fetchall()
+        if not rows:
+            return [], None
+
+        events = self._get_events_txn(txn, [row[1] for row in rows])
+
+        docs = []
+        for event in events:
+            key_and_value = _get_search_key_and_value(event)
+            if key_and_value is None:
+                continue
+            key, value = key_and_value
+            docs.append((
+                event.event_id, event.room_id, key, value,
+                event.origin_server_ts, event.internal_metadata.stream_ordering,
+            ))
+
+        return docs, rows[-1][0]
+
     @defer.inlineCallbacks
     def _background_reindex_search(self, progress, batch_size):
         target_min_stream_id = progress["target_min_stream_id_inclusive"]
@@ -67,30 +153,13 @@ class SearchStore(BackgroundUpdateStore):
 
             event_search_rows = []
             for event in events:
-                try:
-                    event_id = event.event_id
-                    room_id = event.room_id
-                    content = event.content
-                    if event.type == "m.room.message":
-                        key = "content.body"
-                        value = content["body"]
-                    elif event.type == "m.room.topic":
-                        key = "content.topic"
-                        value = content["topic"]
-                    elif event.type == "m.room.name":
-                        key = "content.name"
-                        value = content["name"]
-                except (KeyError, AttributeError):
-                    # If the event is missing a necessary field then
-                    # skip over it.
-                    continue
-
-                if not isinstance(value, basestring):
-                    # If the event body, name or topic isn't a string
-                    # then skip over it
+                key_and_value = _get_search_key_and_value(event)
+                if key_and_value is None:
                     continue
-
-                event_search_rows.append((event_id, room_id, key, value))
+                key, value = key_and_value
+                event_search_rows.append(
+                    (event.event_id, event.room_id, key, value)
+                )
 
             if isinstance(self.database_engine, PostgresEngine):
                 sql = (
@@ -122,7 +191,7 @@ class SearchStore(BackgroundUpdateStore):
 
             return len(event_search_rows)
 
-        result = yield self.runInteraction(
+        result = yield self.runBackgroundInteraction(
             self.EVENT_SEARCH_UPDATE_NAME, reindex_search_txn
         )
 
@@ -132,91 +201,92 @@ class SearchStore(BackgroundUpdateStore):
         defer.returnValue(result)
 
     @defer.inlineCallbacks
-    def search_msgs(self, room_ids, search_term, keys):
-        """Performs a full text search over events with given keys.
+    def search_msgs(self, room_ids, search_term, keys, limit, pagination_token=None):
+        """Performs a full text search over events with given keys, ordered by
+        rank.
 
         Args:
             room_ids (list): List of room ids to search in
             search_term (str): Search term to search for
             keys (list): List of keys to search in, currently supports
                 "content.body", "content.name", "content.topic"
+            limit (int): The maximum number of results to return
+            pagination_token (str): A pagination token previously returned
 
         Returns:
             list of dicts
         """
-        clauses = []
-
-        search_query = search_query = _parse_query(self.database_engine, search_term)
-
-        args = []
-
-        # Make sure we don't explode because the person is in too many rooms.
-        # We filter the results below regardless.
-        if len(room_ids) < 500:
-            clauses.append(
-                "room_id IN (%s)" % (",".join(["?"] * len(room_ids)),)
+        if self.search_index is not None:
+            pagination_key = None
+            if pagination_token:
+                pagination_key = _parse_pagination_token(pagination_token, float)
+
+            results, count = yield preserve_context_over_fn(
+                threads.deferToThread, self.search_index.search,
+                room_ids, search_term, keys, limit, "rank",
+                pagination_key=pagination_key,
+                max_count=MAX_SEARCH_RESULT_COUNT,
+            )
+        else:
+            results, count = yield self._search_msgs_in_db(
+                room_ids, search_term, keys, limit, pagination_token
             )
-            args.extend(room_ids)
-
-        local_clauses = []
-        for key in keys:
-            local_clauses.append("key = ?")
-            args.append(key)
 
-        clauses.append(
-            "(%s)" % (" OR ".join(local_clauses),)
+        result = yield self._load_search_results(
+            results, count, search_term,
+            lambda r: "%r,%s" % (r["rank"], r["stream_ordering"]),
         )
+        defer.returnValue(result)
 
-        count_args = args
-        count_clauses = clauses
-
-        if isinstance(self.database_engine, PostgresEngine):
-            sql = (
-                "SELECT ts_rank_cd(vector, to_tsquery('english', ?)) AS rank,"
-                " room_id, event_id"
-                " FROM event_search"
-                " WHERE vector @@ to_tsquery('english', ?)"
-            )
-            args = [search_query, search_query] + args
+    @defer.inlineCallbacks
+    def search_rooms(self, room_ids, search_term, keys, limit, pagination_token=None):
+        """Performs a full text search over events with given keys.
 
-            count_sql = (
-                "SELECT room_id, count(*) as count FROM event_search"
-                " WHERE vector @@ to_tsquery('english', ?)"
-            )
-            count_args = [search_query] + count_args
-        elif isinstance(self.database_engine, Sqlite3Engine):
-            sql = (
-                "SELECT rank(matchinfo(event_search)) as rank, room_id, event_id"
-                " FROM event_search"
-                " WHERE value MATCH ?"
-            )
-            args = [search_query] + args
+        Args:
+            room_id (list): The room_ids to search in
+            search_term (str): Search term to search for
+            keys (list): List of keys to search in, currently supports
+                "content.body", "content.name", "content.topic"
+            pagination_token (str): A pagination token previously returned
 
-            count_sql = (
-                "SELECT room_id, count(*) as count FROM event_search"
-                " WHERE value MATCH ?"
+        Returns:
+            list of dicts
+        """
+        if self.search_index is not None:
+            pagination_key = None
+            if pagination_token:
+                pagination_key = _parse_pagination_token(pagination_token, int)
+
+            results, count = yield preserve_context_over_fn(
+                threads.deferToThread, self.search_index.search,
+                room_ids, search_term, keys, limit, "recent",
+                pagination_key=pagination_key,
+                max_count=MAX_SEARCH_RESULT_COUNT,
             )
-            count_args = [search_term] + count_args
         else:
-            # This should be unreachable.
-            raise Exception("Unrecognized database engine")
-
-        for clause in clauses:
-            sql += " AND " + clause
-
-        for clause in count_clauses:
-            count_sql += " AND " + clause
-
-        # We add an arbitrary limit here to ensure we don't try to pull the
-        # entire table from the database.
-        sql += " ORDER BY rank DESC LIMIT 500"
+            results, count = yield self._search_rooms_in_db(
+                room_ids, search_term, keys, limit, pagination_token
+            )
 
-        results = yield self._execute(
-            "search_msgs", self.cursor_to_dict, sql, *args
+        result = yield self._load_search_results(
+            results, count, search_term,
+            lambda r: "%s,%s" % (r["origin_server_ts"], r["stream_ordering"]),
         )
+        defer.returnValue(result)
 
-        results = filter(lambda row: row["room_id"] in room_ids, results)
+    @defer.inlineCallbacks
+    def _load_search_results(self, results, count, search_term, make_token):
+        """Fetches the events for the rows found by a search.
+
+        Args:
+            results (list[dict]): The rows found by the search
+            count (int): The number of matches
+            search_term (str): What was searched for
+            make_token (func): Returns the pagination token for a row
 
+        Returns:
+            dict
+        """
         events = yield self._get_events([r["event_id"] for r in results])
 
         event_map = {
@@ -226,21 +296,15 @@ class SearchStore(BackgroundUpdateStore):
 
         highlights = None
         if isinstance(self.database_engine, PostgresEngine):
+            search_query = _parse_query(self.database_engine, search_term)
             highlights = yield self._find_highlights_in_postgres(search_query, events)
 
-        count_sql += " GROUP BY room_id"
-
-        count_results = yield self._execute(
-            "search_rooms_count", self.cursor_to_dict, count_sql, *count_args
-        )
-
-        count = sum(row["count"] for row in count_results if row["room_id"] in room_ids)
-
         defer.returnValue({
             "results": [
                 {
                     "event": event_map[r["event_id"]],
                     "rank": r["rank"],
+                    "pagination_token": make_token(r),
                 }
                 for r in results
                 if r["event_id"] in event_map
@@ -249,61 +313,96 @@ class SearchStore(BackgroundUpdateStore):
             "count": count,
         })
 
-    @defer.inlineCallbacks
-    def search_rooms(self, room_ids, search_term, keys, limit, pagination_token=None):
-        """Performs a full text search over events with given keys.
+    def _search_msgs_in_db(self, room_ids, search_term, keys, limit,
+                           pagination_token):
+        search_query = _parse_query(self.database_engine, search_term)
 
-        Args:
-            room_id (list): The room_ids to search in
-            search_term (str): Search term to search for
-            keys (list): List of keys to search in, currently supports
-                "content.body", "content.name", "content.topic"
-            pagination_token (str): A pagination token previously returned
+        if isinstance(self.database_engine, PostgresEngine):
+            sql = (
+                "SELECT ts_rank_cd(vector, to_tsquery('english', ?)) AS rank,"
+                " room_id, event_id, stream_ordering"
+                " FROM event_search"
+                " NATURAL JOIN events"
+                " WHERE vector @@ to_tsquery('english', ?) AND "
+            )
+            args = [search_query, search_query]
+
+            # Postgres doesn't let us refer to the rank by its alias. The rank
+            # is a REAL, so make sure the rank from the token is compared as
+            # one too.
+            rank_sql = "ts_rank_cd(vector, to_tsquery('english', ?))"
+            rank_args = [search_query]
+            token_rank_sql = "CAST(? AS REAL)"
+        elif isinstance(self.database_engine, Sqlite3Engine):
+            # See search_rooms for why we use a CROSS JOIN.
+            sql = (
+                "SELECT rank(matchinfo) as rank, room_id, event_id,"
+                " stream_ordering"
+                " FROM (SELECT key, event_id, matchinfo(event_search) as matchinfo"
+                " FROM event_search"
+                " WHERE value MATCH ?"
+                " )"
+                " CROSS JOIN events USING (event_id)"
+                " WHERE "
+            )
+            args = [search_query]
 
-        Returns:
-            list of dicts
-        """
-        clauses = []
+            rank_sql = "rank"
+            rank_args = []
+            token_rank_sql = "?"
+        else:
+            # This should be unreachable.
+            raise Exception("Unrecognized database engine")
+
+        pagination_clauses = []
+        pagination_args = []
+        if pagination_token:
+            rank, stream = _parse_pagination_token(pagination_token, float)
+            pagination_clauses.append(
+                "(%(rank)s < %(token_rank)s"
+                " OR (%(rank)s = %(token_rank)s AND stream_ordering < ?))" % {
+                    "rank": rank_sql,
+                    "token_rank": token_rank_sql,
+                }
+            )
+            pagination_args.extend(
+                rank_args + [rank] + rank_args + [rank, stream]
+            )
 
-        search_query = search_query = _parse_query(self.database_engine, search_term)
+        def search_msgs_txn(txn):
+            clauses, clause_args = self._search_clauses_txn(txn, room_ids, keys)
 
-        args = []
+            txn.execute(
+                sql + " AND ".join(clauses + pagination_clauses)
+                + " ORDER BY rank DESC, stream_ordering DESC LIMIT ?",
+                args + clause_args + pagination_args + [limit]
+            )
+            results = self.cursor_to_dict(txn)
 
-        # Make sure we don't explode because the person is in too many rooms.
-        # We filter the results below regardless.
-        if len(room_ids) < 500:
-            clauses.append(
-                "room_id IN (%s)" % (",".join(["?"] * len(room_ids)),)
+            count = self._count_search_results_txn(
+                txn, search_query, clauses, clause_args
             )
-            args.extend(room_ids)
 
-        local_clauses = []
-        for key in keys:
-            local_clauses.append("key = ?")
-            args.append(key)
+            return results, count
 
-        clauses.append(
-            "(%s)" % (" OR ".join(local_clauses),)
-        )
+        return self.runInteraction("search_msgs", search_msgs_txn)
 
-        # take copies of the current args and clauses lists, before adding
-        # pagination clauses to main query.
-        count_args = list(args)
-        count_clauses = list(clauses)
+    def _search_rooms_in_db(self, room_ids, search_term, keys, limit,
+                            pagination_token):
+        search_query = _parse_query(self.database_engine, search_term)
 
+        pagination_clauses = []
+        pagination_args = []
         if pagination_token:
-            try:
-                origin_server_ts, stream = pagination_token.split(",")
-                origin_server_ts = int(origin_server_ts)
-                stream = int(stream)
-            except:
-                raise SynapseError(400, "Invalid pagination token")
-
-            clauses.append(
+            origin_server_ts, stream = _parse_pagination_token(
+                pagination_token, int
+            )
+
+            pagination_clauses.append(
                 "(origin_server_ts < ?"
                 " OR (origin_server_ts = ? AND stream_ordering < ?))"
             )
-            args.extend([origin_server_ts, origin_server_ts, stream])
+            pagination_args.extend([origin_server_ts, origin_server_ts, stream])
 
         if isinstance(self.database_engine, PostgresEngine):
             sql = (
@@ -313,13 +412,7 @@ class SearchStore(BackgroundUpdateStore):
                 " NATURAL JOIN events"
                 " WHERE vector @@ to_tsquery('english', ?) AND "
             )
-            args = [search_query, search_query] + args
-
-            count_sql = (
-                "SELECT room_id, count(*) as count FROM event_search"
-                " WHERE vector @@ to_tsquery('english', ?) AND "
-            )
-            count_args = [search_query] + count_args
+            args = [search_query, search_query]
         elif isinstance(self.database_engine, Sqlite3Engine):
             # We use CROSS JOIN here to ensure we use the right indexes.
             # https://sqlite.org/optoverview.html#crossjoin
@@ -339,66 +432,81 @@ class SearchStore(BackgroundUpdateStore):
                 " CROSS JOIN events USING (event_id)"
                 " WHERE "
             )
-            args = [search_query] + args
-
-            count_sql = (
-                "SELECT room_id, count(*) as count FROM event_search"
-                " WHERE value MATCH ? AND "
-            )
-            count_args = [search_term] + count_args
+            args = [search_query]
         else:
             # This should be unreachable.
             raise Exception("Unrecognized database engine")
 
-        sql += " AND ".join(clauses)
-        count_sql += " AND ".join(count_clauses)
-
-        # We add an arbitrary limit here to ensure we don't try to pull the
-        # entire table from the database.
-        sql += " ORDER BY origin_server_ts DESC, stream_ordering DESC LIMIT ?"
+        def search_rooms_txn(txn):
+            clauses, clause_args = self._search_clauses_txn(txn, room_ids, keys)
 
-        args.append(limit)
+            txn.execute(
+                sql + " AND ".join(clauses + pagination_clauses)
+                + " ORDER BY origin_server_ts DESC, stream_ordering DESC LIMIT ?",
+                args + clause_args + pagination_args + [limit]
+            )
+            results = self.cursor_to_dict(txn)
 
-        results = yield self._execute(
-            "search_rooms", self.cursor_to_dict, sql, *args
-        )
+            count = self._count_search_results_txn(
+                txn, search_query, clauses, clause_args
+            )
 
-        results = filter(lambda row: row["room_id"] in room_ids, results)
+            return results, count
 
-        events = yield self._get_events([r["event_id"] for r in results])
+        return self.runInteraction("search_rooms", search_rooms_txn)
 
-        event_map = {
-            ev.event_id: ev
-            for ev in events
-        }
+    def _search_clauses_txn(self, txn, room_ids, keys):
+        """Builds the clauses that restrict a search of event_search to the
+        given rooms and keys.
 
-        highlights = None
+        Returns:
+            tuple(list[str], list): The clauses and their arguments.
+        """
         if isinstance(self.database_engine, PostgresEngine):
-            highlights = yield self._find_highlights_in_postgres(search_query, events)
+            room_clause = "room_id = ANY(?)"
+            args = [list(room_ids)]
+        elif len(room_ids) <= MAX_SEARCH_ROOM_ARGS:
+            room_clause = "room_id IN (%s)" % (",".join(["?"] * len(room_ids)),)
+            args = list(room_ids)
+        else:
+            # SQLite limits the number of arguments a statement can have, so
+            # users in lots of rooms get the rooms put in a temporary table.
+            txn.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS search_room_ids"
+                " (room_id TEXT PRIMARY KEY)"
+            )
+            txn.execute("DELETE FROM search_room_ids")
+            txn.executemany(
+                "INSERT INTO search_room_ids (room_id) VALUES (?)",
+                [(room_id,) for room_id in room_ids]
+            )
+            room_clause = "room_id IN (SELECT room_id FROM search_room_ids)"
+            args = []
 
-        count_sql += " GROUP BY room_id"
+        key_clause = "(%s)" % (" OR ".join(["key = ?"] * len(keys)),)
+        args.extend(keys)
 
-        count_results = yield self._execute(
-            "search_rooms_count", self.cursor_to_dict, count_sql, *count_args
-        )
+        return [room_clause, key_clause], args
 
-        count = sum(row["count"] for row in count_results if row["room_id"] in room_ids)
+    def _count_search_results_txn(self, txn, search_query, clauses, args):
+        """Counts the events matching a search, stopping at
+        MAX_SEARCH_RESULT_COUNT so that very common terms don't mean counting
+        a large part of the table.
+        """
+        if isinstance(self.database_engine, PostgresEngine):
+            match_clause = "vector @@ to_tsquery('english', ?)"
+        else:
+            match_clause = "value MATCH ?"
 
-        defer.returnValue({
-            "results": [
-                {
-                    "event": event_map[r["event_id"]],
-                    "rank": r["rank"],
-                    "pagination_token": "%s,%s" % (
-                        r["origin_server_ts"], r["stream_ordering"]
-                    ),
-                }
-                for r in results
-                if r["event_id"] in event_map
-            ],
-            "highlights": highlights,
-            "count": count,
-        })
+        sql = (
+            "SELECT COUNT(*) FROM ("
+            " SELECT 1 FROM event_search WHERE %s LIMIT ?"
+            ") AS s"
+        ) % (" AND ".join([match_clause] + clauses),)
+
+        txn.execute(sql, [search_query] + args + [MAX_SEARCH_RESULT_COUNT])
+        count, = txn.fetchone()
+        return count
 
     def _find_highlights_in_postgres(self, search_query, events):
         """Given a list of events and a search term, return a list of words
@@ -471,6 +579,49 @@ def _to_postgres_options(options_dict):
     )
 
 
+# The key in the content of each type of event that is searchable.
+_SEARCH_KEYS = {
+    "m.room.message": "body",
+    "m.room.name": "name",
+    "m.room.topic": "topic",
+}
+
+
+def _get_search_key_and_value(event):
+    """Get the searchable text of an event.
+
+    Returns:
+        (str, unicode)|None: The key of the text, e.g. "content.body", and the
+        text, or None if the event doesn't have any.
+    """
+    field = _SEARCH_KEYS.get(event.type)
+    if field is None:
+        return None
+
+    try:
+        value = event.content[field]
+    except (KeyError, AttributeError):
+        # If the event is missing a necessary field then skip over it.
+        return None
+
+    if not isinstance(value, basestring):
+        # If the event body, name or topic isn't a string then skip over it
+        return None
+
+    return "content." + field, value
+
+
+def _parse_pagination_token(pagination_token, rank_type):
+    """Parses a search pagination token into the rank or origin_server_ts,
+    as given type, and stream ordering that it is made of.
+    """
+    try:
+        rank, stream = pagination_token.split(",")
+        return rank_type(rank), int(stream)
+    except:
+        raise SynapseError(400, "Invalid pagination token")
+
+
 def _parse_query(database_engine, search_term):
     """Takes a plain unicode string from the user and converts it into a form
     that can be passed to database.
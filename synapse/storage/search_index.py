@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An inverted index of event text, kept in its own file.
+
+This is an alternative to the event_search table for SQLite deployments.
+Indexing is done by a dedicated writer thread with its own connection, so it
+never competes with the homeserver's database for SQLite's single writer.
+"""
+
+from collections import Counter
+
+import logging
+import Queue
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The most documents written to the index in a single transaction.
+WRITE_BATCH_SIZE = 1000
+
+# The most rooms we list as arguments in a search query. Searches over more
+# rooms than this put the rooms in a temporary table instead.
+MAX_SEARCH_ROOM_ARGS = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY,
+    event_id TEXT NOT NULL,
+    room_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    origin_server_ts BIGINT NOT NULL,
+    stream_ordering BIGINT NOT NULL,
+    UNIQUE (event_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+);
+
+-- The highest stream ordering of the events that have been indexed, which is
+-- where we catch up from after a restart.
+CREATE TABLE IF NOT EXISTS stream_position (
+    Lock CHAR(1) NOT NULL DEFAULT 'X' UNIQUE,
+    stream_ordering BIGINT NOT NULL,
+    CHECK (Lock='X')
+);
+
+INSERT OR IGNORE INTO stream_position (stream_ordering) VALUES (0);
+"""
+
+# Marks the end of the writer's queue.
+_STOP = object()
+
+
+def tokenize(value):
+    """Splits text into the terms that are indexed and searched for, in the
+    same way as the database search backends split search terms.
+    """
+    return re.findall(r"([\w\-]+)", value.lower(), re.UNICODE)
+
+
+class SearchIndex(object):
+    """An inverted index of event text stored in an SQLite file of its own.
+
+    Documents are queued with add_documents and written in batches by a
+    writer thread. Searches open their own connection, which can read while
+    the writer is writing since the file is in WAL mode.
+
+    Search terms are matched as prefixes and all of them must match. Results
+    are ranked by the sum of the terms' frequencies in the document, which
+    doesn't depend on the rest of the index, so the rank in a pagination token
+    still means the same thing when more events have been indexed since.
+
+    Documents that are queued but not yet written when the process stops are
+    lost, so the index records the highest stream ordering it has written,
+    and callers should add any events after get_stream_position on startup.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = Queue.Queue()
+        self._writer = None
+        self._local = threading.local()
+
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def start(self):
+        """Start the writer thread."""
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._write_loop, name="search-index-writer",
+            )
+            self._writer.daemon = True
+            self._writer.start()
+
+    def stop(self):
+        """Write out any queued documents and stop the writer thread."""
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+
+    def flush(self):
+        """Block until every document queued so far has been written."""
+        self._queue.join()
+
+    def add_documents(self, docs):
+        """Queue documents to be indexed.
+
+        Args:
+            docs (list): List of (event_id, room_id, key, value,
+                origin_server_ts, stream_ordering) tuples
+        """
+        for doc in docs:
+            self._queue.put(doc)
+
+    def _write_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                try:
+                    while len(batch) < WRITE_BATCH_SIZE:
+                        batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    pass
+
+                stop = _STOP in batch
+                docs = [doc for doc in batch if doc is not _STOP]
+
+                try:
+                    if docs:
+                        with conn:
+                            self._write_docs(conn, docs)
+                except Exception:
+                    logger.exception("Failed to write to search index")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def get_stream_position(self):
+        """Get the highest stream ordering of the events that have been
+        written to the index. This blocks, so should be run in a thread.
+        """
+        row = self._reader().execute(
+            "SELECT stream_ordering FROM stream_position"
+        ).fetchone()
+        return row[0]
+
+    def _write_docs(self, conn, docs):
+        conn.execute(
+            "UPDATE stream_position SET stream_ordering = ?"
+            " WHERE stream_ordering < ?",
+            (max(doc[5] for doc in docs),) * 2
+        )
+
+        for event_id, room_id, key, value, origin_server_ts, stream in docs:
+            terms = Counter(tokenize(value))
+            if not terms:
+                continue
+
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO docs"
+                " (event_id, room_id, key, origin_server_ts, stream_ordering)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (event_id, room_id, key, origin_server_ts, stream)
+            )
+            if not cur.rowcount:
+                # We've already indexed this, e.g. during a reindex.
+                continue
+
+            doc_id = cur.lastrowid
+            conn.executemany(
+                "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                [(term, doc_id, tf) for term, tf in terms.items()]
+            )
+
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def search(self, room_ids, search_term, keys, limit, order_by,
+               pagination_key=None, max_count=None):
+        """Search the index. This blocks, so should be run in a thread.
+
+        Args:
+            room_ids (collection): The rooms to search in
+            search_term (unicode): What to search for
+            keys (list): The keys to search in, e.g. "content.body"
+            limit (int): The maximum number of results to return
+            order_by (str): "rank" to order by rank, or "recent" to order by
+                origin_server_ts. Ties are broken by stream ordering.
+            pagination_key (tuple|None): Only return results after this
+                (rank or origin_server_ts, stream_ordering).
+            max_count (int|None): Stop counting matches beyond this.
+
+        Returns:
+            tuple(list[dict], int): The results, with the same keys as the
+            rows returned by the database search backends, and the number of
+            matches.
+        """
+        terms = tokenize(search_term)
+        if not terms:
+            return [], 0
+
+        conn = self._reader()
+
+        # Join the documents matching each term, each of which may match
+        # several indexed terms as they're prefixes.
+        sql = " INNER JOIN ".join(
+            "(SELECT doc_id, SUM(tf) AS tf FROM postings"
+            " WHERE term >= ? AND term < ? GROUP BY doc_id) AS t%d%s" % (
+                i, " USING (doc_id)" if i else "",
+            )
+            for i in range(len(terms))
+        )
+        args = []
+        for term in terms:
+            args.extend((term, term + u"\uffff"))
+
+        sql += " INNER JOIN docs USING (doc_id) WHERE key IN (%s)" % (
+            ",".join("?" for _ in keys),
+        )
+        args.extend(keys)
+
+        if len(room_ids) > MAX_SEARCH_ROOM_ARGS:
+            conn.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS search_rooms"
+                " (room_id TEXT PRIMARY KEY)"
+            )
+            conn.execute("DELETE FROM search_rooms")
+            conn.executemany(
+                "INSERT OR IGNORE INTO search_rooms (room_id) VALUES (?)",
+                [(room_id,) for room_id in room_ids]
+            )
+            sql += " AND room_id IN (SELECT room_id FROM search_rooms)"
+        else:
+            room_ids = list(room_ids)
+            sql += " AND room_id IN (%s)" % (",".join("?" for _ in room_ids),)
+            args.extend(room_ids)
+
+        count_sql = "SELECT COUNT(*) FROM (SELECT 1 FROM " + sql
+        count_args = list(args)
+        if max_count is not None:
+            count_sql += " LIMIT ?"
+            count_args.append(max_count)
+        count, = conn.execute(count_sql + ")", count_args).fetchone()
+
+        rank_sql = " + ".join("t%d.tf" % (i,) for i in range(len(terms)))
+        if order_by == "rank":
+            order_sql = rank_sql
+        else:
+            order_sql = "origin_server_ts"
+
+        if pagination_key is not None:
+            sql += (
+                " AND (%(order)s < ? OR (%(order)s = ? AND stream_ordering < ?))"
+            ) % {"order": order_sql}
+            args.extend((pagination_key[0],) + tuple(pagination_key))
+
+        rows = conn.execute(
+            "SELECT %s, event_id, room_id, origin_server_ts, stream_ordering"
+            " FROM %s ORDER BY %s DESC, stream_ordering DESC LIMIT ?" % (
+                rank_sql, sql, order_sql,
+            ),
+            args + [limit]
+        )
+
+        results = [
+            {
+                "rank": float(rank),
+                "event_id": event_id,
+                "room_id": room_id,
+                "origin_server_ts": ts,
+                "stream_ordering": stream,
+            }
+            for rank, event_id, room_id, ts, stream in rows
+        ]
+
+        return results, count
@@ -648,6 +648,55 @@ class StreamStore(SQLBaseStore):
             "end": results["after"]["token"],
         })
 
+    @defer.inlineCallbacks
+    def get_events_around_many(self, events, before_limit, after_limit):
+        """Like get_events_around, but for several events at once, fetching
+        all of them in a single transaction.
+
+        Args:
+            events (list): List of (room_id, event_id) tuples
+            before_limit (int)
+            after_limit (int)
+
+        Returns:
+            dict: event_id -> dict, as returned by get_events_around
+        """
+        def get_events_around_many_txn(txn):
+            return {
+                event_id: self._get_events_around_txn(
+                    txn, room_id, event_id, before_limit, after_limit
+                )
+                for room_id, event_id in events
+            }
+
+        results = yield self.runInteraction(
+            "get_events_around_many", get_events_around_many_txn
+        )
+
+        event_ids = set()
+        for r in results.values():
+            event_ids.update(r["before"]["event_ids"])
+            event_ids.update(r["after"]["event_ids"])
+
+        fetched = yield self._get_events(list(event_ids), get_prev_content=True)
+        event_map = {e.event_id: e for e in fetched}
+
+        defer.returnValue({
+            event_id: {
+                "events_before": [
+                    event_map[e] for e in r["before"]["event_ids"]
+                    if e in event_map
+                ],
+                "events_after": [
+                    event_map[e] for e in r["after"]["event_ids"]
+                    if e in event_map
+                ],
+                "start": r["before"]["token"],
+                "end": r["after"]["token"],
+            }
+            for event_id, r in results.items()
+        })
+
     def _get_events_around_txn(self, txn, room_id, event_id, before_limit, after_limit):
         """Retrieves event_ids and pagination tokens around a given event in a
         room.
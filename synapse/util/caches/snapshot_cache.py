@@ -89,6 +89,11 @@ class SnapshotCache(object):
             self.pending_result_cache.pop(key, None)
             return r
 
-        result.addBoth(shuffle_along)
+        def remove(f):
+            # Failures aren't cached, so that the next request tries again.
+            # The observers have already been given the failure.
+            self.pending_result_cache.pop(key, None)
+
+        result.addCallbacks(shuffle_along, remove)
 
         return result.observe()
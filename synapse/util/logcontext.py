@@ -73,6 +73,9 @@ class LoggingContext(object):
         def add_database_transaction(self, duration_ms):
             pass
 
+        def add_database_scheduled(self, sched_ms):
+            pass
+
         def __nonzero__(self):
             return False
 
@@ -85,6 +88,7 @@ class LoggingContext(object):
         self.ru_utime = 0.
         self.db_txn_count = 0
         self.db_txn_duration = 0.
+        self.db_sched_duration = 0.
         self.usage_start = None
         self.main_thread = threading.current_thread()
         self.tag = ""
@@ -186,6 +190,15 @@ class LoggingContext(object):
         self.db_txn_count += 1
         self.db_txn_duration += duration_ms / 1000.
 
+    def add_database_scheduled(self, sched_ms):
+        """Record time spent waiting for a database connection to become
+        available to run a transaction.
+
+        Args:
+            sched_ms (float): time spent waiting, in milliseconds
+        """
+        self.db_sched_duration += sched_ms / 1000.
+
 
 class LoggingContextFilter(logging.Filter):
     """Logging filter that adds values from the current logging context to each
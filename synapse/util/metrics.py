@@ -25,7 +25,7 @@ logger = logging.getLogger(__name__)
 
 metrics = synapse.metrics.get_metrics_for(__name__)
 
-block_timer = metrics.register_distribution(
+block_timer = metrics.register_histogram(
     "block_timer",
     labels=["block_name"]
 )
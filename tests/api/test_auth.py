@@ -20,6 +20,7 @@ from mock import Mock
 from synapse.api.auth import Auth
 from synapse.api.errors import AuthError
 from synapse.types import UserID
+from synapse.util.caches.descriptors import Cache
 from tests.utils import setup_test_homeserver
 
 import pymacaroons
@@ -31,6 +32,7 @@ class AuthTestCase(unittest.TestCase):
     def setUp(self):
         self.state_handler = Mock()
         self.store = Mock()
+        self.store.access_token_user_info = Cache("test_access_token_user_info")
 
         self.hs = yield setup_test_homeserver(handlers=None)
         self.hs.get_datastore = Mock(return_value=self.store)
@@ -158,6 +160,26 @@ class AuthTestCase(unittest.TestCase):
         user = user_info["user"]
         self.assertEqual(UserID.from_string(user_id), user)
 
+    @defer.inlineCallbacks
+    def test_get_user_by_access_token_is_cached(self):
+        self.store.get_user_by_access_token = Mock(
+            return_value={"name": self.test_user, "token_id": "ditto"}
+        )
+
+        user_info = yield self.auth._get_user_by_access_token(self.test_token)
+        self.assertEqual(UserID.from_string(self.test_user), user_info["user"])
+
+        user_info = yield self.auth._get_user_by_access_token(self.test_token)
+        self.assertEqual(UserID.from_string(self.test_user), user_info["user"])
+        self.assertEquals(self.store.get_user_by_access_token.call_count, 1)
+
+        # Once the token is invalidated we have to look it up again.
+        self.store.access_token_user_info.invalidate((self.test_token,))
+        self.store.get_user_by_access_token = Mock(return_value=None)
+
+        with self.assertRaises(AuthError):
+            yield self.auth._get_user_by_access_token(self.test_token)
+
     @defer.inlineCallbacks
     def test_get_guest_user_from_macaroon(self):
         user_id = "@baldrick:matrix.org"
@@ -37,3 +37,44 @@ class TestRatelimiter(unittest.TestCase):
         )
 
         self.assertNotIn("test_id_1", limiter.message_counts)
+
+    def test_pruning_out_of_order(self):
+        limiter = Ratelimiter()
+
+        # test_id_1 was seen first but its bucket drains last.
+        limiter.can_do_action(
+            key="test_id_1", time_now_s=0, rate_hz=0.01, burst_count=1,
+        )
+        limiter.can_do_action(
+            key="test_id_2", time_now_s=1, rate_hz=0.1, burst_count=1,
+        )
+
+        limiter.can_do_action(
+            key="test_id_3", time_now_s=20, rate_hz=0.1, burst_count=1,
+        )
+
+        self.assertIn("test_id_1", limiter.message_counts)
+        self.assertNotIn("test_id_2", limiter.message_counts)
+
+        limiter.can_do_action(
+            key="test_id_3", time_now_s=100, rate_hz=0.1, burst_count=1,
+        )
+
+        self.assertNotIn("test_id_1", limiter.message_counts)
+
+    def test_separate_keys(self):
+        limiter = Ratelimiter()
+        allowed, _ = limiter.can_do_action(
+            key=("join", "test_id"), time_now_s=0, rate_hz=0.1, burst_count=1,
+        )
+        self.assertTrue(allowed)
+
+        allowed, _ = limiter.can_do_action(
+            key=("join", "test_id"), time_now_s=1, rate_hz=0.1, burst_count=1,
+        )
+        self.assertFalse(allowed)
+
+        allowed, _ = limiter.can_do_action(
+            key=("join", "other_id"), time_now_s=1, rate_hz=0.1, burst_count=1,
+        )
+        self.assertTrue(allowed)
@@ -18,6 +18,7 @@ from tests import unittest
 from twisted.internet import defer, reactor
 
 from mock import Mock, call, ANY, NonCallableMock
+from collections import deque
 import json
 
 from tests.utils import (
@@ -26,7 +27,9 @@ from tests.utils import (
 
 from synapse.api.constants import PresenceState
 from synapse.api.errors import SynapseError
-from synapse.handlers.presence import PresenceHandler, UserPresenceCache
+from synapse.handlers.presence import (
+    PresenceHandler, UserPresenceCache, REMOTE_PUSH_BATCH_SECONDS,
+)
 from synapse.streams.config import SourcePaginationConfig
 from synapse.types import UserID
 
@@ -35,10 +38,11 @@ UNAVAILABLE = PresenceState.UNAVAILABLE
 ONLINE = PresenceState.ONLINE
 
 
-def _expect_edu(destination, edu_type, content, origin="test"):
+def _expect_edu(destination, edu_type, content, origin="test",
+                origin_server_ts=1000000):
     return {
         "origin": origin,
-        "origin_server_ts": 1000000,
+        "origin_server_ts": origin_server_ts,
         "pdus": [],
         "edus": [
             {
@@ -824,9 +828,10 @@ class PresencePushTestCase(MockedDatastorePresenceTestCase):
                         "push": [
                             {"user_id": "@apple:test",
                              "presence": u"online",
-                             "last_active_ago": 0},
+                             "last_active_ago": 500},
                         ],
-                    }
+                    },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -841,9 +846,10 @@ class PresencePushTestCase(MockedDatastorePresenceTestCase):
                         "push": [
                             {"user_id": "@apple:test",
                              "presence": u"online",
-                             "last_active_ago": 0},
+                             "last_active_ago": 500},
                         ],
-                    }
+                    },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -869,6 +875,160 @@ class PresencePushTestCase(MockedDatastorePresenceTestCase):
             {"presence": ONLINE}
         )
 
+        # Pushes to remote servers are sent in batches
+        put_json.assert_had_no_calls()
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
+        yield put_json.await_calls()
+
+    @defer.inlineCallbacks
+    def test_push_remote_after_remote_leave(self):
+        put_json = self.mock_http_client.put_json
+        put_json.expect_call_and_return(
+            call("farm",
+                path=ANY,
+                data=_expect_edu("farm", "m.presence",
+                    content={
+                        "push": [
+                            {"user_id": "@apple:test",
+                             "presence": u"online",
+                             "last_active_ago": 500},
+                        ],
+                    },
+                    origin_server_ts=ANY,
+                ),
+                json_data_callback=ANY,
+                long_retries=True,
+            ),
+            defer.succeed((200, "OK"))
+        )
+
+        self.room_members = [self.u_apple, self.u_onion]
+
+        self.datastore.set_presence_state.return_value = defer.succeed(
+            {"state": ONLINE}
+        )
+
+        yield self.handler.set_state(self.u_apple, self.u_apple,
+            {"presence": ONLINE}
+        )
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
+        yield put_json.await_calls()
+
+        # Once onion has left, farm no longer shares a room with apple.
+        self.room_members = [self.u_apple]
+
+        yield self.handler.set_state(self.u_apple, self.u_apple,
+            {"presence": UNAVAILABLE}
+        )
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
+        put_json.assert_had_no_calls()
+
+    @defer.inlineCallbacks
+    def test_changed_users(self):
+        # TODO(paul): Gut-wrenching
+        self.handler._presence_changes = deque(maxlen=2)
+
+        for user, room_id in (
+            (self.u_apple, "!a:test"),
+            (self.u_banana, "!b:test"),
+            (self.u_clementine, "!c:test"),
+        ):
+            self.handler._user_cachemap_latest_serial += 1
+            yield self.handler.update_presence_cache(
+                user, {"presence": ONLINE}, room_ids=[room_id]
+            )
+
+        # Changes are matched by user or by room
+        self.assertEquals(
+            self.handler.get_changed_users(1, {self.u_banana}, {"!c:test"}),
+            {self.u_banana: 2, self.u_clementine: 3},
+        )
+        self.assertEquals(
+            self.handler.get_changed_users(2, {self.u_banana}, {"!c:test"}),
+            {self.u_clementine: 3},
+        )
+
+        # apple's change has fallen out of the log
+        self.assertIsNone(
+            self.handler.get_changed_users(0, {self.u_apple}, set())
+        )
+
+    @defer.inlineCallbacks
+    def test_prune_user_cachemap(self):
+        for user, presence in (
+            (self.u_apple, OFFLINE),
+            (self.u_banana, ONLINE),
+            (self.u_clementine, OFFLINE),
+            (self.u_onion, OFFLINE),
+        ):
+            self.handler._user_cachemap_latest_serial += 1
+            yield self.handler.update_presence_cache(
+                user, {"presence": presence}, room_ids=[]
+            )
+
+        # TODO(paul): Gut-wrenching
+        self.handler._local_pushmap["clementine"] = {self.u_banana}
+
+        # Nothing is evicted until it has been idle for a whole prune
+        self.handler._prune_user_cachemap()
+        self.assertEquals(len(self.handler._user_cachemap), 4)
+
+        self.handler._prune_user_cachemap()
+        self.assertEquals(
+            set(self.handler._user_cachemap),
+            {self.u_banana, self.u_clementine},
+        )
+
+        # Event streams still see that apple went offline
+        (events, _) = yield self.event_source.get_new_events(
+            user=self.u_apple, from_key=0,
+        )
+        self.assertIn(
+            {"type": "m.presence",
+             "content": {"user_id": "@apple:test", "presence": OFFLINE}},
+            events
+        )
+
+    @defer.inlineCallbacks
+    def test_push_remote_batched(self):
+        put_json = self.mock_http_client.put_json
+        put_json.expect_call_and_return(
+            call("remote",
+                path=ANY,
+                data=_expect_edu("remote", "m.presence",
+                    content={
+                        "push": [
+                            {"user_id": "@apple:test",
+                             "presence": u"unavailable"},
+                            {"user_id": "@banana:test",
+                             "presence": u"online"},
+                        ],
+                    },
+                    origin_server_ts=ANY,
+                ),
+                json_data_callback=ANY,
+                long_retries=True,
+            ),
+            defer.succeed((200, "OK"))
+        )
+
+        # Only apple's latest state is sent.
+        self.handler._queue_remote_push(
+            self.u_apple, "remote", {"presence": ONLINE}
+        )
+        self.handler._queue_remote_push(
+            self.u_banana, "remote", {"presence": ONLINE}
+        )
+        self.handler._queue_remote_push(
+            self.u_apple, "remote", {"presence": UNAVAILABLE}
+        )
+
+        put_json.assert_had_no_calls()
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
     @defer.inlineCallbacks
@@ -1033,24 +1193,11 @@ class PresencePushTestCase(MockedDatastorePresenceTestCase):
                         "push": [
                             {"user_id": "@apple:test",
                              "presence": "online"},
-                        ],
-                    }
-                ),
-                json_data_callback=ANY,
-                long_retries=True,
-            ),
-            defer.succeed((200, "OK"))
-        )
-        put_json.expect_call_and_return(
-            call("remote",
-                path=ANY,  # Can't guarantee which txn ID will be which
-                data=_expect_edu("remote", "m.presence",
-                    content={
-                        "push": [
                             {"user_id": "@banana:test",
                              "presence": "offline"},
                         ],
-                    }
+                    },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -1068,20 +1215,24 @@ class PresencePushTestCase(MockedDatastorePresenceTestCase):
             self.room_id
         )
 
+        # Both users' presence is sent in one EDU
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
         ## Sending newly-joined local user state to remote users
 
         put_json.expect_call_and_return(
             call("remote",
-                path="/_matrix/federation/v1/send/1000002/",
+                path="/_matrix/federation/v1/send/1000001/",
                 data=_expect_edu("remote", "m.presence",
                     content={
                         "push": [
                             {"user_id": "@clementine:test",
                              "presence": "online"},
                         ],
-                    }
+                    },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -1098,6 +1249,8 @@ class PresencePushTestCase(MockedDatastorePresenceTestCase):
             self.room_id
         )
 
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         put_json.await_calls()
 
 
@@ -1206,6 +1359,7 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
                             "presence": OFFLINE,
                         }],
                     },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -1219,6 +1373,8 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
             state={"presence": ONLINE}
         )
 
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
         # Gut-wrenching tests
@@ -1239,6 +1395,7 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
                             "presence": OFFLINE,
                         }],
                     },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -1254,6 +1411,8 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
 
         # reactor.iterate(delay=0)
 
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
         # fig goes offline
@@ -1273,6 +1432,7 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
                     content={
                         "unpoll": [ "@potato:remote" ],
                     },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -1306,6 +1466,7 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
                              "status_msg": None},
                         ],
                     },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -1322,6 +1483,8 @@ class PresencePollingTestCase(MockedDatastorePresenceTestCase):
             )
         )
 
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
         # Gut-wrenching tests
@@ -24,7 +24,9 @@ from mock import Mock, call, ANY, NonCallableMock
 from ..utils import MockClock, setup_test_homeserver
 
 from synapse.api.constants import PresenceState
-from synapse.handlers.presence import PresenceHandler
+from synapse.handlers.presence import (
+    PresenceHandler, REMOTE_PUSH_BATCH_SECONDS,
+)
 from synapse.handlers.profile import ProfileHandler
 from synapse.types import UserID
 
@@ -58,8 +60,9 @@ class PresenceProfilelikeDataTestCase(unittest.TestCase):
 
     @defer.inlineCallbacks
     def setUp(self):
+        self.clock = MockClock()
         hs = yield setup_test_homeserver(
-            clock=MockClock(),
+            clock=self.clock,
             datastore=Mock(spec=[
                 "set_presence_state",
                 "is_presence_visible",
@@ -258,6 +261,8 @@ class PresenceProfilelikeDataTestCase(unittest.TestCase):
             self.u_apple, {"presence": ONLINE}
         )
 
+        self.clock.advance_time(REMOTE_PUSH_BATCH_SECONDS)
+
         self.replication.send_edu.assert_called_with(
                 destination="remote",
                 edu_type="m.presence",
@@ -265,7 +270,7 @@ class PresenceProfilelikeDataTestCase(unittest.TestCase):
                     "push": [
                         {"user_id": "@apple:test",
                          "presence": "online",
-                         "last_active_ago": 0,
+                         "last_active_ago": 500,
                          "displayname": "Frank",
                          "avatar_url": "http://foo"},
                     ],
@@ -25,15 +25,18 @@ from ..utils import (
 )
 
 from synapse.api.errors import AuthError
-from synapse.handlers.typing import TypingNotificationHandler
+from synapse.handlers.typing import (
+    TypingNotificationHandler, TYPING_EDU_BATCH_SECONDS,
+)
 
 from synapse.types import UserID
 
 
-def _expect_edu(destination, edu_type, content, origin="test"):
+def _expect_edu(destination, edu_type, content, origin="test",
+                origin_server_ts=1000000):
     return {
         "origin": origin,
-        "origin_server_ts": 1000000,
+        "origin_server_ts": origin_server_ts,
         "pdus": [],
         "edus": [
             {
@@ -214,7 +217,8 @@ class TypingNotificationsTestCase(unittest.TestCase):
                         "room_id": self.room_id,
                         "user_id": self.u_apple.to_string(),
                         "typing": True,
-                    }
+                    },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -229,8 +233,34 @@ class TypingNotificationsTestCase(unittest.TestCase):
             timeout=20000,
         )
 
+        # Changes are sent to remote servers in batches
+        put_json.assert_had_no_calls()
+        self.clock.advance_time(TYPING_EDU_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
+    @defer.inlineCallbacks
+    def test_started_and_stopped_typing_remote_send(self):
+        self.room_members = [self.u_apple, self.u_onion]
+
+        put_json = self.mock_http_client.put_json
+
+        yield self.handler.started_typing(
+            target_user=self.u_apple,
+            auth_user=self.u_apple,
+            room_id=self.room_id,
+            timeout=20000,
+        )
+        yield self.handler.stopped_typing(
+            target_user=self.u_apple,
+            auth_user=self.u_apple,
+            room_id=self.room_id,
+        )
+
+        # Remote servers needn't hear about it at all
+        self.clock.advance_time(TYPING_EDU_BATCH_SECONDS)
+        put_json.assert_had_no_calls()
+
     @defer.inlineCallbacks
     def test_started_typing_remote_recv(self):
         self.room_members = [self.u_apple, self.u_onion]
@@ -268,6 +298,13 @@ class TypingNotificationsTestCase(unittest.TestCase):
             ]
         )
 
+        # Everyone polling gets the same event for the room
+        other_events = yield self.event_source.get_new_events(
+            room_ids=[self.room_id],
+            from_key=0
+        )
+        self.assertIs(other_events[0][0], events[0][0])
+
     @defer.inlineCallbacks
     def test_stopped_typing(self):
         self.room_members = [self.u_apple, self.u_banana, self.u_onion]
@@ -281,7 +318,8 @@ class TypingNotificationsTestCase(unittest.TestCase):
                         "room_id": self.room_id,
                         "user_id": self.u_apple.to_string(),
                         "typing": False,
-                    }
+                    },
+                    origin_server_ts=ANY,
                 ),
                 json_data_callback=ANY,
                 long_retries=True,
@@ -310,6 +348,8 @@ class TypingNotificationsTestCase(unittest.TestCase):
             call('typing_key', 1, rooms=[self.room_id]),
         ])
 
+        self.clock.advance_time(TYPING_EDU_BATCH_SECONDS)
+
         yield put_json.await_calls()
 
         self.assertEquals(self.event_source.get_current_key(), 1)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransport
+from twisted.web.resource import Resource
+
+from synapse.http.site import SynapseSite
+from synapse.rest.media.v1.filepath import MediaFilePaths
+from synapse.rest.media.v1.upload_resource import UploadResource
+
+from tests.utils import setup_test_homeserver
+
+from mock import Mock
+
+import shutil
+import tempfile
+
+
+class EchoResource(Resource):
+    isLeaf = True
+
+    def render_POST(self, request):
+        return "%d" % (len(request.content.read()),)
+
+
+class SynapseSiteTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(tls_server_context_factory=Mock())
+        hs.config.max_upload_size = 100
+        hs.config.max_image_pixels = 10 ** 6
+        hs.config.dynamic_thumbnails = False
+        hs.config.thumbnail_requirements = {}
+
+        self.tmpdir = tempfile.mkdtemp()
+
+        root = Resource()
+        root.putChild("upload", UploadResource(
+            hs, MediaFilePaths(self.tmpdir), Mock()
+        ))
+        root.putChild("echo", EchoResource())
+        root.putChild("echo_limited", EchoResource())
+
+        self.site = SynapseSite(
+            "test", "test", {}, root,
+            max_request_body_sizes={"/upload": 100, "/echo_limited": 10},
+        )
+        self.site.access_logger = Mock()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def send(self, data):
+        channel = self.site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        self.addCleanup(channel.setTimeout, None)
+        channel.dataReceived(data)
+        return transport
+
+    def assertRejected(self, transport):
+        self.assertTrue(
+            transport.value().startswith("HTTP/1.1 413 "), transport.value()
+        )
+        self.assertTrue(transport.disconnecting)
+
+        # The response went through the usual access logging.
+        self.assertEquals(
+            413, self.site.access_logger.info.call_args_list[-1][0][11]
+        )
+
+    def test_oversized_body(self):
+        transport = self.send(
+            "POST /upload HTTP/1.1\r\n"
+            "Content-Length: 101\r\n"
+            "Content-Type: text/plain\r\n"
+            "\r\n" + "x" * 101
+        )
+        self.assertRejected(transport)
+
+    def test_oversized_body_expect_continue(self):
+        transport = self.send(
+            "POST /upload HTTP/1.1\r\n"
+            "Content-Length: 101\r\n"
+            "Content-Type: text/plain\r\n"
+            "Expect: 100-continue\r\n"
+            "\r\n"
+        )
+        self.assertRejected(transport)
+
+        # The client isn't told to send the body after all.
+        self.assertNotIn("100 Continue", transport.value())
+
+    def test_oversized_chunked_body(self):
+        transport = self.send(
+            "POST /echo_limited HTTP/1.1\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "\r\n"
+            "8\r\nxxxxxxxx\r\n"
+            "8\r\nxxxxxxxx\r\n"
+            "0\r\n\r\n"
+        )
+
+        # Only enough of the body to tell that it is too large is stored.
+        self.assertTrue(transport.value().endswith("\r\n11"))
+
+    def test_unlimited_path(self):
+        transport = self.send(
+            "POST /echo HTTP/1.1\r\n"
+            "Content-Length: 1000\r\n"
+            "\r\n" + "x" * 1000
+        )
+        self.assertTrue(
+            transport.value().startswith("HTTP/1.1 200 "), transport.value()
+        )
+        self.assertTrue(transport.value().endswith("\r\n1000"))
@@ -16,7 +16,8 @@
 from tests import unittest
 
 from synapse.metrics.metric import (
-    CounterMetric, CallbackMetric, DistributionMetric, CacheMetric
+    CounterMetric, CallbackMetric, DistributionMetric, HistogramMetric,
+    CacheMetric,
 )
 
 
@@ -61,6 +62,15 @@ class CounterMetricTestCase(unittest.TestCase):
             'vector{method="PUT"} 1',
         ])
 
+    def test_escaped_labels(self):
+        counter = CounterMetric("vector", labels=["pattern"])
+
+        counter.inc('^/rooms/(?P<room_id>[^/]*)/"\\w+"$')
+
+        self.assertEquals(counter.render(), [
+            'vector{pattern="^/rooms/(?P<room_id>[^/]*)/\\"\\\\w+\\"$"} 1',
+        ])
+
 
 class CallbackMetricTestCase(unittest.TestCase):
 
@@ -130,6 +140,59 @@ class DistributionMetricTestCase(unittest.TestCase):
         ])
 
 
+class HistogramMetricTestCase(unittest.TestCase):
+
+    def test_scalar(self):
+        metric = HistogramMetric("thing", buckets=[10, 100])
+
+        self.assertEquals(metric.render(), [
+            'thing:bucket{le="10"} 0',
+            'thing:bucket{le="100"} 0',
+            'thing:bucket{le="+Inf"} 0',
+            'thing:count 0',
+            'thing:total 0',
+        ])
+
+        metric.inc_by(5)
+        metric.inc_by(10)
+        metric.inc_by(50)
+        metric.inc_by(500)
+
+        self.assertEquals(metric.render(), [
+            'thing:bucket{le="10"} 2',
+            'thing:bucket{le="100"} 3',
+            'thing:bucket{le="+Inf"} 4',
+            'thing:count 4',
+            'thing:total 565',
+        ])
+
+    def test_vector(self):
+        metric = HistogramMetric("queries", buckets=[100], labels=["verb"])
+
+        self.assertEquals(metric.render(), [])
+
+        metric.inc_by(300, "SELECT")
+        metric.inc_by(20, "SELECT")
+        metric.inc_by(80, "INSERT")
+
+        self.assertEquals(metric.render(), [
+            'queries:bucket{verb="INSERT",le="100"} 1',
+            'queries:bucket{verb="INSERT",le="+Inf"} 1',
+            'queries:bucket{verb="SELECT",le="100"} 1',
+            'queries:bucket{verb="SELECT",le="+Inf"} 2',
+            'queries:count{verb="INSERT"} 1',
+            'queries:count{verb="SELECT"} 2',
+            'queries:total{verb="INSERT"} 80',
+            'queries:total{verb="SELECT"} 320',
+        ])
+
+    def test_wrong_dimension(self):
+        metric = HistogramMetric("queries", labels=["verb"])
+
+        with self.assertRaises(ValueError):
+            metric.inc_by(1)
+
+
 class CacheMetricTestCase(unittest.TestCase):
 
     def test_cache(self):
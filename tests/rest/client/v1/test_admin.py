@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests REST events for /admin paths."""
+from tests import unittest
+from twisted.internet import defer
+
+from mock import Mock
+
+from ....utils import MockHttpResource, setup_test_homeserver
+
+from synapse.types import Requester, UserID
+
+from synapse.rest.client.v1 import admin
+
+myid = "@1234ABCD:test"
+PATH_PREFIX = "/_matrix/client/api/v1"
+
+
+class SqlStatementsTestCase(unittest.TestCase):
+    """ Tests the SQL statement profile admin API. """
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.mock_resource = MockHttpResource(prefix=PATH_PREFIX)
+        self.mock_handler = Mock(spec=["get_sql_statement_profile"])
+        self.mock_handler.get_sql_statement_profile.return_value = []
+
+        hs = yield setup_test_homeserver(
+            "test",
+            http_client=None,
+            resource_for_client=self.mock_resource,
+            federation=Mock(),
+            replication_layer=Mock(),
+        )
+
+        def _get_user_by_req(request=None, allow_guest=False):
+            return Requester(UserID.from_string(myid), "", False)
+
+        hs.get_v1auth().get_user_by_req = _get_user_by_req
+        hs.get_v1auth().is_server_admin = lambda user: defer.succeed(True)
+
+        hs.get_handlers().admin_handler = self.mock_handler
+
+        admin.register_servlets(hs, self.mock_resource)
+
+    @defer.inlineCallbacks
+    def test_get_statements(self):
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/admin/sql_statements?limit=10&order_by=count"
+        )
+
+        self.assertEquals(200, code)
+        self.assertEquals({"statements": []}, response)
+        self.mock_handler.get_sql_statement_profile.assert_called_with(
+            10, "count"
+        )
+
+    @defer.inlineCallbacks
+    def test_bad_limit(self):
+        for limit in ("0", "-1", "ten"):
+            (code, response) = yield self.mock_resource.trigger_get(
+                "/admin/sql_statements?limit=%s" % (limit,)
+            )
+            self.assertEquals(400, code, limit)
+
+        self.assertFalse(self.mock_handler.get_sql_statement_profile.called)
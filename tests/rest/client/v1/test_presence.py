@@ -358,6 +358,7 @@ class PresenceEventStreamTestCase(unittest.TestCase):
         self.mock_datastore.get_joined_hosts_for_room = get_joined_hosts_for_room
 
         self.presence = hs.get_handlers().presence_handler
+        self.notifier = hs.get_notifier()
 
         self.u_apple = UserID.from_string("@apple:test")
         self.u_banana = UserID.from_string("@banana:test")
@@ -397,6 +398,9 @@ class PresenceEventStreamTestCase(unittest.TestCase):
 
         yield run_on_reactor()
 
+        # The clock is mocked out, so wake up the notifier's listeners by hand
+        self.notifier._wake_pending_streams()
+
         (code, response) = yield self.mock_resource.trigger("GET",
                 "/events?from=s0_1_0&timeout=0", None)
 
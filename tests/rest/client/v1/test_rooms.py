@@ -1055,3 +1055,100 @@ class RoomMessageListTestCase(RestTestCase):
         self.assertEquals(token, response['start'])
         self.assertTrue("chunk" in response)
         self.assertTrue("end" in response)
+
+
+class PublicRoomListTestCase(RestTestCase):
+    """ Tests /publicRooms REST events. """
+    user_id = "@sid1:red"
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.mock_resource = MockHttpResource(prefix=PATH_PREFIX)
+        self.auth_user_id = self.user_id
+
+        hs = yield setup_test_homeserver(
+            "red",
+            http_client=None,
+            replication_layer=Mock(),
+            ratelimiter=NonCallableMock(spec_set=["send_message"]),
+        )
+        self.ratelimiter = hs.get_ratelimiter()
+        self.ratelimiter.send_message.return_value = (True, 0)
+
+        hs.get_handlers().federation_handler = Mock()
+
+        def _get_user_by_access_token(token=None, allow_guest=False):
+            return {
+                "user": UserID.from_string(self.auth_user_id),
+                "token_id": 1,
+                "is_guest": False,
+            }
+        hs.get_v1auth()._get_user_by_access_token = _get_user_by_access_token
+
+        def _insert_client_ip(*args, **kwargs):
+            return defer.succeed(None)
+        hs.get_datastore().insert_client_ip = _insert_client_ip
+
+        synapse.rest.client.v1.room.register_servlets(hs, self.mock_resource)
+
+        self.room_ids = []
+        for name in ("a", "b", "c"):
+            (code, response) = yield self.mock_resource.trigger(
+                "POST", "/createRoom",
+                json.dumps({"room_alias_name": name, "name": name})
+            )
+            self.assertEquals(200, code, response)
+            self.room_ids.append(response["room_id"])
+
+        # A public room without an alias isn't listed.
+        yield self.create_room_as(self.user_id)
+
+    @defer.inlineCallbacks
+    def test_public_rooms(self):
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/publicRooms"
+        )
+        self.assertEquals(200, code, response)
+        self.assertEquals(
+            sorted(self.room_ids), [r["room_id"] for r in response["chunk"]]
+        )
+        self.assertFalse("next_batch" in response)
+
+        room = response["chunk"][0]
+        self.assertEquals(["#%s:red" % (room["name"],)], room["aliases"])
+        self.assertEquals(1, room["num_joined_members"])
+
+    @defer.inlineCallbacks
+    def test_public_rooms_paginate(self):
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/publicRooms?limit=2"
+        )
+        self.assertEquals(200, code, response)
+        first = [r["room_id"] for r in response["chunk"]]
+        self.assertEquals(2, len(first))
+
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/publicRooms?limit=2&since=%s" % (
+                urllib.quote(response["next_batch"]),
+            )
+        )
+        self.assertEquals(200, code, response)
+        second = [r["room_id"] for r in response["chunk"]]
+        self.assertFalse("next_batch" in response)
+
+        self.assertEquals(sorted(self.room_ids), first + second)
+
+    @defer.inlineCallbacks
+    def test_public_rooms_bad_since(self):
+        (code, response) = yield self.mock_resource.trigger_get(
+            "/publicRooms?since=nonsense"
+        )
+        self.assertEquals(400, code, response)
+
+    @defer.inlineCallbacks
+    def test_public_rooms_bad_limit(self):
+        for limit in (0, -1):
+            (code, response) = yield self.mock_resource.trigger_get(
+                "/publicRooms?limit=%d" % (limit,)
+            )
+            self.assertEquals(400, code, response)
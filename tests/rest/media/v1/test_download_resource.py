@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.api.errors import SynapseError
+from synapse.rest.media.v1.base_resource import _parse_byte_range
+from synapse.rest.media.v1.download_resource import DownloadResource
+from synapse.rest.media.v1.filepath import MediaFilePaths
+from synapse.types import UserID
+
+from tests.utils import MockRequest, setup_test_homeserver
+
+from mock import Mock
+
+import os
+import shutil
+import tempfile
+
+
+CONTENT = "0123456789"
+
+
+class DownloadResourceTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(tls_server_context_factory=Mock())
+        hs.config.max_upload_size = 100
+        hs.config.max_image_pixels = 10 ** 6
+        hs.config.dynamic_thumbnails = False
+        hs.config.thumbnail_requirements = {}
+
+        self.tmpdir = tempfile.mkdtemp()
+        filepaths = MediaFilePaths(self.tmpdir)
+        self.resource = DownloadResource(hs, filepaths, Mock())
+
+        yield hs.get_datastore().store_local_media(
+            media_id="media",
+            media_type="text/plain",
+            time_now_ms=1000,
+            upload_name=None,
+            media_length=len(CONTENT),
+            user_id=UserID.from_string("@alice:test"),
+        )
+
+        fname = filepaths.local_media_filepath("media")
+        os.makedirs(os.path.dirname(fname))
+        with open(fname, "wb") as f:
+            f.write(CONTENT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def download(self, **headers):
+        request = MockRequest("GET", ["test", "media"], headers=headers)
+        return request.render_and_wait(self.resource).addCallback(
+            lambda _: request
+        )
+
+    def get_header(self, request, name):
+        return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+    @defer.inlineCallbacks
+    def test_download(self):
+        request = yield self.download()
+        self.assertEquals(CONTENT, request.body)
+        self.assertIsNone(self.get_header(request, "Content-Range"))
+        self.assertEquals("bytes", self.get_header(request, "Accept-Ranges"))
+        self.assertIsNotNone(self.get_header(request, "ETag"))
+
+    @defer.inlineCallbacks
+    def test_range(self):
+        request = yield self.download(Range="bytes=2-4")
+        self.assertEquals(206, request.responseCode)
+        self.assertEquals("234", request.body)
+        self.assertEquals(
+            "bytes 2-4/10", self.get_header(request, "Content-Range")
+        )
+        self.assertEquals("3", self.get_header(request, "Content-Length"))
+
+    @defer.inlineCallbacks
+    def test_open_ended_range(self):
+        request = yield self.download(Range="bytes=7-")
+        self.assertEquals(206, request.responseCode)
+        self.assertEquals("789", request.body)
+
+    @defer.inlineCallbacks
+    def test_suffix_range(self):
+        request = yield self.download(Range="bytes=-3")
+        self.assertEquals(206, request.responseCode)
+        self.assertEquals("789", request.body)
+        self.assertEquals(
+            "bytes 7-9/10", self.get_header(request, "Content-Range")
+        )
+
+    @defer.inlineCallbacks
+    def test_unsatisfiable_range(self):
+        request = yield self.download(Range="bytes=10-20")
+        self.assertEquals(416, request.responseCode)
+        self.assertEquals(
+            "bytes */10", self.get_header(request, "Content-Range")
+        )
+
+    @defer.inlineCallbacks
+    def test_malformed_range(self):
+        for range_header in ("bytes=a-b", "bytes=5", "lines=1-2", "bytes=0-1,3-4"):
+            # The whole file is sent instead.
+            request = yield self.download(Range=range_header)
+            self.assertEquals(CONTENT, request.body, range_header)
+            self.assertIsNone(self.get_header(request, "Content-Range"))
+
+    @defer.inlineCallbacks
+    def test_stale_if_range(self):
+        request = yield self.download(Range="bytes=2-4", **{
+            "If-Range": '"stale"',
+        })
+        self.assertEquals(CONTENT, request.body)
+
+    @defer.inlineCallbacks
+    def test_if_none_match(self):
+        request = yield self.download()
+        etag = self.get_header(request, "ETag")
+
+        request = yield self.download(**{"If-None-Match": etag})
+        self.assertEquals(304, request.responseCode)
+        self.assertEquals("", request.body)
+
+        request = yield self.download(**{"If-None-Match": '"other"'})
+        self.assertEquals(CONTENT, request.body)
+
+
+class ParseByteRangeTestCase(unittest.TestCase):
+
+    def test_ranges(self):
+        self.assertEquals((0, 9), _parse_byte_range("bytes=0-", 10))
+        self.assertEquals((2, 9), _parse_byte_range("bytes=2-100", 10))
+        self.assertEquals((0, 9), _parse_byte_range("bytes=-100", 10))
+        self.assertEquals((9, 9), _parse_byte_range("bytes=9-9", 10))
+
+    def test_malformed(self):
+        for range_header in ("bytes=", "bytes=-", "bytes=4-2", "bytes=x-"):
+            self.assertIsNone(_parse_byte_range(range_header, 10), range_header)
+
+    def test_unsatisfiable(self):
+        for range_header in ("bytes=10-", "bytes=-0"):
+            with self.assertRaises(SynapseError) as cm:
+                _parse_byte_range(range_header, 10)
+            self.assertEquals(416, cm.exception.code)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.rest.media.v1.filepath import MediaFilePaths
+from synapse.rest.media.v1.remote_media_evictor import RemoteMediaEvictor
+
+from tests.utils import setup_test_homeserver
+
+import os
+import shutil
+import tempfile
+
+
+class RemoteMediaEvictorTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver()
+        hs.config.max_remote_media_cache_size = 250
+
+        self.clock = hs.get_clock()
+        self.store = hs.get_datastore()
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepaths = MediaFilePaths(self.tmpdir)
+        self.evictor = RemoteMediaEvictor(hs, self.filepaths)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, path, length):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        with open(path, "wb") as f:
+            f.write("x" * length)
+
+    @defer.inlineCallbacks
+    def store_remote_media(self, media_id, sha256=None):
+        self.clock.advance_time(1)
+        yield self.store.store_cached_remote_media(
+            origin="remote",
+            media_id=media_id,
+            media_type="image/png",
+            media_length=100,
+            time_now_ms=self.clock.time_msec(),
+            upload_name=None,
+            filesystem_id="fs" + media_id,
+            sha256=sha256,
+        )
+        if sha256:
+            self.write_file(self.filepaths.blob_filepath(sha256), 100)
+        else:
+            self.write_file(
+                self.filepaths.remote_media_filepath("remote", "fs" + media_id),
+                100,
+            )
+
+    @defer.inlineCallbacks
+    def get_media_ids(self):
+        media = yield self.store.get_least_recently_accessed_remote_media(10)
+        defer.returnValue([m["media_id"] for m in media])
+
+    @defer.inlineCallbacks
+    def test_evicts_least_recently_accessed(self):
+        yield self.store_remote_media("media1")
+        yield self.store_remote_media("media2")
+        yield self.store_remote_media("media3")
+        yield self.store_remote_media("media4")
+
+        # media1 has just been served, but the access hasn't been written out
+        # yet.
+        self.clock.advance_time(1)
+        self.store.mark_remote_media_accessed("remote", "media1")
+
+        freed = yield self.evictor.evict()
+        self.assertEquals(freed, 200)
+
+        media_ids = yield self.get_media_ids()
+        self.assertEquals(media_ids, ["media4", "media1"])
+        self.assertFalse(os.path.exists(
+            self.filepaths.remote_media_filepath("remote", "fsmedia2")
+        ))
+        self.assertTrue(os.path.exists(
+            self.filepaths.remote_media_filepath("remote", "fsmedia1")
+        ))
+
+    @defer.inlineCallbacks
+    def test_shared_blob_kept_until_unused(self):
+        blob_path = self.filepaths.blob_filepath("abcdef")
+
+        yield self.store_remote_media("media1", "abcdef")
+        yield self.store_remote_media("media2")
+        yield self.store_remote_media("media3", "abcdef")
+        yield self.store_remote_media("media4")
+
+        # The blob is only counted once, so evicting media1 would be enough if
+        # it freed the blob. It doesn't, as media3 still uses the blob, so
+        # media2 is evicted too.
+        freed = yield self.evictor.evict()
+        self.assertEquals(freed, 100)
+        self.assertTrue(os.path.exists(blob_path))
+
+        media_ids = yield self.get_media_ids()
+        self.assertEquals(media_ids, ["media3", "media4"])
+
+        self.evictor.max_size = 100
+        self.store.mark_remote_media_accessed("remote", "media4")
+
+        freed = yield self.evictor.evict()
+        self.assertEquals(freed, 100)
+        self.assertFalse(os.path.exists(blob_path))
+
+        media_ids = yield self.get_media_ids()
+        self.assertEquals(media_ids, ["media4"])
+
+    def test_delete_files(self):
+        media_path = self.filepaths.remote_media_filepath("remote", "fsmedia1")
+        thumbnail_path = self.filepaths.remote_media_thumbnail(
+            "remote", "fsmedia1", 32, 32, "image/png", "scale"
+        )
+        blob_path = self.filepaths.blob_filepath("abcdef")
+        blob_thumbnail_path = self.filepaths.blob_thumbnail(
+            "abcdef", 32, 32, "image/png", "scale"
+        )
+        shared_blob_path = self.filepaths.blob_filepath("012345")
+
+        self.write_file(media_path, 100)
+        self.write_file(thumbnail_path, 10)
+        self.write_file(blob_path, 100)
+        self.write_file(blob_thumbnail_path, 10)
+        self.write_file(shared_blob_path, 100)
+
+        media = [
+            {
+                "media_origin": "remote", "media_id": "media1",
+                "filesystem_id": "fsmedia1", "sha256": None,
+            },
+            {
+                "media_origin": "remote", "media_id": "media2",
+                "filesystem_id": "fsmedia2", "sha256": "abcdef",
+            },
+            {
+                "media_origin": "remote", "media_id": "media3",
+                "filesystem_id": "fsmedia3", "sha256": "012345",
+            },
+            {
+                # Already deleted files are ignored.
+                "media_origin": "remote", "media_id": "media4",
+                "filesystem_id": "fsmedia4", "sha256": None,
+            },
+        ]
+
+        freed = self.evictor._delete_files(media, ["abcdef"])
+        self.assertEquals(freed, 220)
+
+        for path in (media_path, thumbnail_path, blob_path, blob_thumbnail_path):
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(shared_blob_path))
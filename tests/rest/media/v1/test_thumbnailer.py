@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.rest.media.v1 import thumbnailer
+from synapse.rest.media.v1.thumbnailer import (
+    Thumbnailer, ThumbnailPool, generate_thumbnails,
+)
+
+from tests.utils import MockClock
+
+from mock import patch
+
+import PIL.Image as Image
+import os
+import shutil
+import tempfile
+import threading
+
+
+class ThumbnailerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmpdir, "input.jpg")
+        Image.new("RGB", (2000, 1000), (255, 0, 0)).save(self.input_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_uses_draft_mode(self):
+        t = Thumbnailer(self.input_path)
+        t.load(100, 50)
+
+        # JPEGs can be decoded at down to an eighth of their size.
+        self.assertEquals((250, 125), t.image.size)
+
+    def test_thumbnails_made_from_largest(self):
+        thumbnails = [
+            (os.path.join(self.tmpdir, "small.jpg"), 32, 32, "crop", "image/jpeg"),
+            (os.path.join(self.tmpdir, "large.png"), 640, 320, "scale", "image/png"),
+        ]
+
+        shrink_sizes = []
+        shrink = Thumbnailer.shrink
+
+        def record_shrink(t, width, height):
+            shrink_sizes.append((width, height))
+            shrink(t, width, height)
+
+        with patch.object(Thumbnailer, "shrink", record_shrink):
+            stage_times, t_lens = generate_thumbnails(
+                self.input_path, thumbnails, 2000 * 1000 + 1,
+            )
+
+        # The crop is made from a copy shrunk from the scaled thumbnail's.
+        self.assertEquals([(640, 320), (64, 32)], shrink_sizes)
+
+        self.assertEquals(
+            [os.path.getsize(t[0]) for t in thumbnails], t_lens
+        )
+        self.assertEquals((32, 32), Image.open(thumbnails[0][0]).size)
+        self.assertEquals((640, 320), Image.open(thumbnails[1][0]).size)
+        self.assertEquals(
+            {"decode", "resize", "encode"}, set(stage_times)
+        )
+
+    def test_too_many_pixels(self):
+        t_path = os.path.join(self.tmpdir, "t.jpg")
+        _, t_lens = generate_thumbnails(
+            self.input_path, [(t_path, 32, 32, "crop", "image/jpeg")],
+            2000 * 1000,
+        )
+        self.assertEquals([None], t_lens)
+        self.assertFalse(os.path.exists(t_path))
+
+
+class ThumbnailPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = MockClock()
+        self.pool = ThumbnailPool(self.clock, 1, timeout_s=10)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmpdir, "input.jpg")
+        Image.new("RGB", (200, 100)).save(self.input_path)
+
+    def tearDown(self):
+        self.pool.stop()
+        shutil.rmtree(self.tmpdir)
+
+    @defer.inlineCallbacks
+    def test_generate_thumbnails(self):
+        t_path = os.path.join(self.tmpdir, "t.jpg")
+        _, t_lens = yield self.pool.generate_thumbnails(
+            self.input_path, [(t_path, 32, 32, "crop", "image/jpeg")], 10 ** 6,
+        )
+        self.assertEquals([os.path.getsize(t_path)], t_lens)
+
+    @defer.inlineCallbacks
+    def test_failure(self):
+        not_an_image = os.path.join(self.tmpdir, "text")
+        with open(not_an_image, "w") as f:
+            f.write("Not an image")
+
+        d = self.pool.generate_thumbnails(
+            not_an_image, [("t.jpg", 32, 32, "crop", "image/jpeg")], 10 ** 6,
+        )
+        yield self.assertFailure(d, IOError)
+
+        # The timeout was cancelled.
+        self.assertEquals([], self.clock.timers)
+
+    @defer.inlineCallbacks
+    def test_timeout(self):
+        release = threading.Event()
+
+        def stuck(*args):
+            release.wait()
+            return {}, [1]
+
+        with patch.object(thumbnailer, "generate_thumbnails", stuck):
+            d = self.pool.generate_thumbnails(
+                self.input_path, [("t.jpg", 32, 32, "crop", "image/jpeg")],
+                10 ** 6,
+            )
+
+            self.clock.advance_time(10)
+            yield self.assertFailure(d, defer.TimeoutError)
+
+        # The late result is ignored.
+        release.set()
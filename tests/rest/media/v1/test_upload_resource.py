@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.config.repository import ThumbnailRequirement
+from synapse.rest.media.v1.filepath import MediaFilePaths
+from synapse.rest.media.v1.thumbnailer import ThumbnailPool
+from synapse.rest.media.v1.upload_resource import UploadResource
+from synapse.types import UserID
+
+from tests.utils import MockRequest, setup_test_homeserver
+
+from mock import Mock, patch
+
+import PIL.Image as Image
+import StringIO
+import os
+import shutil
+import tempfile
+
+
+class UploadResourceTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(tls_server_context_factory=Mock())
+        hs.config.max_upload_size = 100
+        hs.config.max_image_pixels = 10 ** 6
+        hs.config.dynamic_thumbnails = False
+        hs.config.thumbnail_requirements = {}
+
+        self.clock = hs.get_clock()
+        self.store = hs.get_datastore()
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepaths = MediaFilePaths(self.tmpdir)
+        self.resource = UploadResource(hs, self.filepaths, Mock())
+
+        self.user = UserID.from_string("@alice:test")
+        self.auth = Mock()
+        self.auth.get_user_by_req.side_effect = lambda *args, **kwargs: (
+            defer.succeed(Mock(user=self.user))
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def upload(self, content, content_length=None, content_type="text/plain"):
+        if content_length is None:
+            content_length = len(content)
+        request = MockRequest(
+            "POST", [], content=content, headers={
+                "Content-Length": str(content_length),
+                "Content-Type": content_type,
+            },
+        )
+        return request.render_and_wait(self.resource).addCallback(
+            lambda _: request
+        )
+
+    def list_files(self):
+        return [
+            os.path.join(dirpath, filename)
+            for dirpath, _, filenames in os.walk(self.tmpdir)
+            for filename in filenames
+        ]
+
+    @defer.inlineCallbacks
+    def test_upload(self):
+        self.resource.auth = self.auth
+
+        request = yield self.upload("Hello world")
+        self.assertEquals(200, request.responseCode, request.body)
+
+        media_id = request.json_body()["content_uri"].split("/")[-1]
+        media = yield self.store.get_local_media(media_id)
+        self.assertEquals(11, media["media_length"])
+
+        with open(self.filepaths.blob_filepath(media["sha256"])) as f:
+            self.assertEquals("Hello world", f.read())
+
+    @defer.inlineCallbacks
+    def test_missing_auth(self):
+        request = yield self.upload("Hello world")
+        self.assertEquals(401, request.responseCode, request.body)
+        self.assertEquals([], self.list_files())
+
+    @defer.inlineCallbacks
+    def test_too_large(self):
+        self.resource.auth = self.auth
+
+        request = yield self.upload("x" * 101)
+        self.assertEquals(413, request.responseCode, request.body)
+        self.assertFalse(self.auth.get_user_by_req.called)
+
+        # The body is checked too, in case the Content-Length was wrong.
+        request = yield self.upload("x" * 101, content_length=100)
+        self.assertEquals(413, request.responseCode, request.body)
+
+        self.assertEquals([], self.list_files())
+
+    @defer.inlineCallbacks
+    def test_failed_write(self):
+        self.resource.auth = self.auth
+
+        with patch("os.rename", side_effect=OSError("Disk full")):
+            request = yield self.upload("Hello world")
+        self.assertEquals(500, request.responseCode, request.body)
+
+        # The partially stored upload is removed, along with its row and its
+        # reference to the blob.
+        self.assertEquals([], self.list_files())
+
+        media = yield self.store._simple_select_list(
+            "local_media_repository", None, ["media_id"]
+        )
+        self.assertEquals([], media)
+
+        blobs = yield self.store._simple_select_list(
+            "media_blobs", None, ["refcount"]
+        )
+        self.assertEquals([{"refcount": 0}], blobs)
+
+    @defer.inlineCallbacks
+    def test_deduplicated_upload_makes_missing_thumbnails(self):
+        self.resource.auth = self.auth
+        self.resource.thumbnail_requirements = {
+            "image/png": (ThumbnailRequirement(4, 4, "crop", "image/png"),),
+        }
+        self.resource.thumbnail_pool = ThumbnailPool(self.clock, 1)
+        self.addCleanup(self.resource.thumbnail_pool.stop)
+
+        image = StringIO.StringIO()
+        Image.new("RGB", (8, 8), (255, 0, 0)).save(image, "png")
+
+        # The first upload of the content has no thumbnails, because of its
+        # media type.
+        request = yield self.upload(
+            image.getvalue(), content_type="application/octet-stream"
+        )
+        self.assertEquals(200, request.responseCode, request.body)
+
+        media_id = request.json_body()["content_uri"].split("/")[-1]
+        media = yield self.store.get_local_media(media_id)
+        thumbnails = yield self.store.get_media_blob_thumbnails(media["sha256"])
+        self.assertEquals([], thumbnails)
+
+        request = yield self.upload(image.getvalue(), content_type="image/png")
+        self.assertEquals(200, request.responseCode, request.body)
+
+        media_id = request.json_body()["content_uri"].split("/")[-1]
+        thumbnails = yield self.store.get_local_media_thumbnails(media_id)
+        self.assertEquals(
+            [(4, 4, "crop", "image/png")],
+            [
+                (
+                    t["thumbnail_width"], t["thumbnail_height"],
+                    t["thumbnail_method"], t["thumbnail_type"],
+                )
+                for t in thumbnails
+            ],
+        )
+        self.assertTrue(os.path.exists(self.filepaths.blob_thumbnail(
+            media["sha256"], 4, 4, "image/png", "crop"
+        )))
+
+        # Uploading it again doesn't make them twice.
+        self.resource.thumbnail_pool.generate_thumbnails = Mock()
+        request = yield self.upload(image.getvalue(), content_type="image/png")
+        self.assertEquals(200, request.responseCode, request.body)
+        self.assertFalse(self.resource.thumbnail_pool.generate_thumbnails.called)
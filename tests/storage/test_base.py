@@ -17,15 +17,23 @@
 from tests import unittest
 from twisted.internet import defer
 
-from mock import Mock, call
+from mock import Mock, call, patch
 
 from collections import OrderedDict
 
 from synapse.server import HomeServer
 
-from synapse.storage._base import SQLBaseStore
+from synapse.storage import _base
+from synapse.storage._base import (
+    DB_LANE_BACKGROUND, DB_LANE_EVENT_FETCH, LoggingTransaction, SQLBaseStore,
+    StatementProfiler, _compute_db_lane_limits, _db_lane_stores,
+    normalize_sql,
+)
+import synapse.metrics
 from synapse.storage.engines import create_engine
 
+from tests.utils import setup_test_homeserver
+
 
 class SQLBaseStoreTestCase(unittest.TestCase):
     """ Test the "simple" SQL generating methods in SQLBaseStore. """
@@ -48,6 +56,8 @@ class SQLBaseStoreTestCase(unittest.TestCase):
 
         config = Mock()
         config.event_cache_size = 1
+        config.search_index_path = None
+        config.profile_sql_statements = False
         hs = HomeServer(
             "test",
             db_pool=self.db_pool,
@@ -198,3 +208,217 @@ class SQLBaseStoreTestCase(unittest.TestCase):
                 "DELETE FROM tablename WHERE keycol = ?",
                 ["Go away"]
         )
+
+    @defer.inlineCallbacks
+    def test_background_interactions_are_bounded(self):
+        pending = []
+
+        def runWithConnection(func, *args, **kwargs):
+            d = defer.Deferred()
+            pending.append((d, func, args, kwargs))
+            return d
+        self.db_pool.runWithConnection = runWithConnection
+
+        def run_next():
+            d, func, args, kwargs = pending.pop(0)
+            d.callback(func(self.mock_conn, *args, **kwargs))
+
+        bg1 = self.datastore.runBackgroundInteraction("bg1", lambda txn: 1)
+        bg2 = self.datastore.runBackgroundInteraction("bg2", lambda txn: 2)
+        fg = self.datastore.runInteraction("fg", lambda txn: 3)
+
+        # Only one background interaction is let through at a time for a
+        # single connection pool, but interactive ones aren't held up.
+        self.assertEquals(len(pending), 2)
+
+        run_next()
+        self.assertEquals((yield bg1), 1)
+
+        # The first background interaction has finished, so the second one
+        # can now be scheduled.
+        self.assertEquals(len(pending), 2)
+
+        run_next()
+        self.assertEquals((yield fg), 3)
+        run_next()
+        self.assertEquals((yield bg2), 2)
+
+    def test_db_lane_limits(self):
+        # Nothing can be reserved for interactive work with a single
+        # connection, as with SQLite.
+        self.assertEquals(_compute_db_lane_limits(1), {
+            DB_LANE_BACKGROUND: 1,
+            DB_LANE_EVENT_FETCH: 1,
+        })
+        self.assertEquals(_compute_db_lane_limits(11), {
+            DB_LANE_BACKGROUND: 5,
+            DB_LANE_EVENT_FETCH: 5,
+        })
+
+    def test_db_lane_metrics_registered_once(self):
+        metric = synapse.metrics.all_metrics["synapse_storage_db_lane_waiting"]
+
+        store = SQLBaseStore(self.datastore.hs)
+
+        self.assertIs(
+            synapse.metrics.all_metrics["synapse_storage_db_lane_waiting"],
+            metric,
+        )
+        self.assertIn(store, _db_lane_stores)
+        self.assertIn(self.datastore, _db_lane_stores)
+
+
+class SimpleSqlCacheTestCase(unittest.TestCase):
+    """ Test the caching of the SQL generated by the "simple" helpers. """
+
+    def setUp(self):
+        self.mock_txn = Mock()
+        self.mock_txn.rowcount = 1
+        self.mock_txn.fetchone.return_value = (1,)
+        self.mock_txn.fetchall.return_value = [(1,)]
+
+        # An engine with a different parameter style to SQLite's
+        self.engine = Mock()
+        self.engine.convert_param_style.side_effect = (
+            lambda sql: sql.replace("?", "%s")
+        )
+
+        patcher = patch.dict(_base._simple_sql_cache, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_txn(self, engine):
+        return LoggingTransaction(self.mock_txn, "test", engine, [])
+
+    def test_statement_reused(self):
+        txn = self.make_txn(self.engine)
+
+        with patch.object(
+            _base, "_cache_simple_sql", wraps=_base._cache_simple_sql
+        ) as cache_simple_sql:
+            SQLBaseStore._simple_insert_txn(txn, "t", {"a": 1})
+            SQLBaseStore._simple_insert_txn(txn, "t", {"a": 2})
+
+        self.assertEquals(cache_simple_sql.call_count, 1)
+        self.assertEquals(self.engine.convert_param_style.call_count, 1)
+
+        # The cached SQL is already in the engine's parameter style, so is
+        # executed as it is.
+        self.mock_txn.execute.assert_called_with(
+            "INSERT INTO t (a) VALUES(%s)", (2,)
+        )
+
+    def test_keys(self):
+        txn = self.make_txn(self.engine)
+        other_txn = self.make_txn(create_engine("sqlite3"))
+
+        calls = [
+            lambda: SQLBaseStore._simple_insert_txn(txn, "t", {"a": 1}),
+            # A different table
+            lambda: SQLBaseStore._simple_insert_txn(txn, "u", {"a": 1}),
+            # A different set of columns
+            lambda: SQLBaseStore._simple_insert_txn(txn, "t", {"b": 1}),
+            # Different helpers generating the same SQL
+            lambda: SQLBaseStore._simple_select_one_txn(
+                txn, "t", {"b": 1}, ["a"]
+            ),
+            lambda: SQLBaseStore._simple_select_onecol_txn(
+                txn, "t", {"b": 1}, "a"
+            ),
+            # A different engine
+            lambda: SQLBaseStore._simple_insert_txn(other_txn, "t", {"a": 1}),
+        ]
+
+        for i, c in enumerate(calls):
+            c()
+            self.assertEquals(len(_base._simple_sql_cache), i + 1)
+
+        # Each engine gets SQL in its own parameter style.
+        self.assertEquals(
+            [
+                _base._simple_sql_cache[("insert", "t", ("a",), engine)]
+                for engine in (txn.database_engine, other_txn.database_engine)
+            ],
+            ["INSERT INTO t (a) VALUES(%s)", "INSERT INTO t (a) VALUES(?)"],
+        )
+
+
+class StatementProfilerTestCase(unittest.TestCase):
+
+    def test_normalize_sql(self):
+        self.assertEquals(
+            normalize_sql(
+                "SELECT event_id FROM events\n"
+                "  WHERE room_id = 'foo' AND stream_ordering > 10"
+                " AND event_id IN (?, ?,?)"
+            ),
+            "SELECT event_id FROM events WHERE room_id = ?"
+            " AND stream_ordering > ? AND event_id IN (...)"
+        )
+        self.assertEquals(
+            normalize_sql("INSERT INTO t (a, b) VALUES (?,?), (?,?), (?,?)"),
+            "INSERT INTO t (a, b) VALUES (...)"
+        )
+
+    def test_aggregates(self):
+        profiler = StatementProfiler()
+
+        profiler.record("SELECT a FROM t WHERE b IN (?,?)", "desc", 10)
+        entry = profiler.record("SELECT a FROM t WHERE b IN (?)", "desc", 30)
+        profiler.add_rows(entry, 5)
+        profiler.record("SELECT a FROM t WHERE b IN (?)", "other", 5)
+
+        self.assertEquals(profiler.get_top(1), [{
+            "statement": "SELECT a FROM t WHERE b IN (...)",
+            "desc": "desc",
+            "count": 2,
+            "total_time_ms": 40,
+            "max_time_ms": 30,
+            "rows": 5,
+        }])
+        self.assertEquals(len(profiler.get_top(10)), 2)
+
+    @defer.inlineCallbacks
+    def test_profiles_interactions(self):
+        hs = yield setup_test_homeserver()
+        hs.config.profile_sql_statements = True
+        store = SQLBaseStore(hs)
+
+        def select(txn):
+            txn.execute("SELECT ? UNION SELECT ?", (1, 2))
+            return txn.fetchall()
+
+        yield store.runInteraction("select", select)
+
+        profile = store.get_statement_profile(10)
+        self.assertEquals(len(profile), 1)
+        self.assertEquals(profile[0]["statement"], "SELECT ? UNION SELECT ?")
+        self.assertEquals(profile[0]["desc"], "select")
+        self.assertEquals(profile[0]["count"], 1)
+        self.assertEquals(profile[0]["rows"], 2)
+
+        # The statement metrics are registered once, and report on every
+        # profiled store.
+        metric = synapse.metrics.all_metrics["synapse_storage_statement_count"]
+        other_store = SQLBaseStore(hs)
+        yield other_store.runInteraction("select", select)
+
+        self.assertIs(
+            synapse.metrics.all_metrics["synapse_storage_statement_count"],
+            metric,
+        )
+        self.assertEquals(
+            metric.callback()[("SELECT ? UNION SELECT ?", "select")], 2
+        )
+
+    def test_max_entries(self):
+        profiler = StatementProfiler(max_entries=1)
+
+        profiler.record("SELECT a FROM t", "desc", 10)
+        profiler.record("SELECT b FROM t", "desc", 10)
+
+        statements = [s["statement"] for s in profiler.get_top(10)]
+        self.assertEquals(
+            sorted(statements),
+            sorted(["SELECT a FROM t", StatementProfiler.OTHER_STATEMENT])
+        )
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from mock import patch
+
+from synapse.types import UserID
+import synapse.storage
+
+from tests.utils import setup_test_homeserver
+
+
+class ClientIpStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        with patch.object(synapse.storage, "reactor") as reactor:
+            hs = yield setup_test_homeserver()
+        self.reactor = reactor
+
+        self.clock = hs.get_clock()
+        self.store = hs.get_datastore()
+        self.user = UserID.from_string("@alice:test")
+
+    @defer.inlineCallbacks
+    def test_client_ips_are_buffered(self):
+        first_seen = self.clock.time_msec()
+        self.store.insert_client_ip(self.user, "token", "1.2.3.4", "agent")
+        self.store.insert_client_ip(self.user, "token", "5.6.7.8", "agent")
+
+        # Nothing is written until the buffer is flushed.
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals(rows, [])
+
+        yield self.store._flush_client_ips()
+
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals(
+            sorted((r["ip"], r["last_seen"]) for r in rows),
+            [("1.2.3.4", first_seen), ("5.6.7.8", first_seen)],
+        )
+
+        # Repeat sightings update the existing rows.
+        self.clock.advance_time(60)
+        last_seen = self.clock.time_msec()
+        self.store.client_ip_last_seen.invalidate_all()
+        self.store.insert_client_ip(self.user, "token", "1.2.3.4", "agent")
+        yield self.store._flush_client_ips()
+
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals(
+            sorted((r["ip"], r["last_seen"]) for r in rows),
+            [("1.2.3.4", last_seen), ("5.6.7.8", first_seen)],
+        )
+
+    @defer.inlineCallbacks
+    def test_failed_flush_is_retried(self):
+        now = self.clock.time_msec()
+        self.store.insert_client_ip(self.user, "token", "1.2.3.4", "agent")
+
+        with patch.object(
+            self.store, "runBackgroundInteraction",
+            side_effect=lambda *args: defer.fail(Exception("db down")),
+        ):
+            yield self.store._flush_client_ips()
+
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals(rows, [])
+
+        yield self.store._flush_client_ips()
+
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals(
+            [(r["ip"], r["last_seen"]) for r in rows], [("1.2.3.4", now)],
+        )
+
+    @defer.inlineCallbacks
+    def test_failed_flush_forgets_sightings_without_room(self):
+        self.store.insert_client_ip(self.user, "token", "1.2.3.4", "agent")
+
+        with patch.object(
+            self.store, "runBackgroundInteraction",
+            side_effect=lambda *args: defer.fail(Exception("db down")),
+        ), patch.object(synapse.storage, "MAX_CLIENT_IP_BUFFER_SIZE", 0):
+            yield self.store._flush_client_ips()
+
+        self.assertEquals(self.store._client_ip_buffer, {})
+
+        # The next request from the client is recorded again.
+        self.store.insert_client_ip(self.user, "token", "1.2.3.4", "agent")
+        yield self.store._flush_client_ips()
+
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals([r["ip"] for r in rows], ["1.2.3.4"])
+
+    @defer.inlineCallbacks
+    def test_flush_on_shutdown(self):
+        self.reactor.addSystemEventTrigger.assert_called_once_with(
+            "before", "shutdown", self.store._flush_client_ips
+        )
+
+        self.store.insert_client_ip(self.user, "token", "1.2.3.4", "agent")
+
+        _, _, flush = self.reactor.addSystemEventTrigger.call_args[0]
+        yield flush()
+
+        rows = yield self.store.get_user_ip_and_agents(self.user)
+        self.assertEquals([r["ip"] for r in rows], ["1.2.3.4"])
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.api.constants import EventTypes
+from synapse.types import UserID, RoomID
+
+from tests.utils import setup_test_homeserver
+
+from mock import Mock
+
+
+class EventPushSummaryTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+
+        self.store = hs.get_datastore()
+        self.event_builder_factory = hs.get_event_builder_factory()
+        self.message_handler = hs.get_handlers().message_handler
+
+        self.u_alice = UserID.from_string("@alice:test")
+        self.u_bob = UserID.from_string("@bob:test")
+
+        self.room = RoomID.from_string("!abc123:test")
+
+    @defer.inlineCallbacks
+    def inject_message(self, body, push_actions=[]):
+        builder = self.event_builder_factory.new({
+            "type": EventTypes.Message,
+            "sender": self.u_alice.to_string(),
+            "room_id": self.room.to_string(),
+            "content": {"body": body, "msgtype": u"message"},
+        })
+
+        event, context = yield self.message_handler._create_new_client_event(
+            builder
+        )
+        context.push_actions = push_actions
+
+        yield self.store.persist_event(event, context)
+
+        defer.returnValue(event)
+
+    @defer.inlineCallbacks
+    def get_counts(self):
+        counts = yield self.store.get_unread_push_counts_for_user(
+            self.u_bob.to_string()
+        )
+        defer.returnValue(counts.get(self.room.to_string()))
+
+    @defer.inlineCallbacks
+    def test_counts(self):
+        bob = self.u_bob.to_string()
+        highlight = [
+            "notify", {"set_tweak": "highlight", "value": True},
+        ]
+
+        counts = yield self.get_counts()
+        self.assertIsNone(counts)
+
+        yield self.inject_message("one", [(bob, "", ["notify"])])
+        e2 = yield self.inject_message("two", [(bob, "", highlight)])
+
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 2, "highlight_count": 1})
+
+        # Reading up to the second message clears the counts...
+        yield self.store.insert_receipt(
+            self.room.to_string(), "m.read", bob, [e2.event_id], {}
+        )
+
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 0, "highlight_count": 0})
+
+        # ... and only later notifications are then counted.
+        yield self.inject_message("three", [(bob, "", highlight)])
+
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 1, "highlight_count": 1})
+
+    @defer.inlineCallbacks
+    def test_receipt_in_the_past(self):
+        bob = self.u_bob.to_string()
+
+        e1 = yield self.inject_message("one", [(bob, "", ["notify"])])
+        yield self.inject_message("two", [(bob, "", ["notify"])])
+
+        yield self.store.insert_receipt(
+            self.room.to_string(), "m.read", bob, [e1.event_id], {}
+        )
+
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 1, "highlight_count": 0})
+
+    @defer.inlineCallbacks
+    def test_receipt_for_unknown_event(self):
+        bob = self.u_bob.to_string()
+
+        yield self.inject_message("one", [(bob, "", ["notify"])])
+        yield self.inject_message("two", [(bob, "", ["notify"])])
+
+        yield self.store.insert_receipt(
+            self.room.to_string(), "m.read", bob, ["$unknown:test"], {}
+        )
+
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 0, "highlight_count": 0})
+
+    @defer.inlineCallbacks
+    def test_remove_push_actions(self):
+        bob = self.u_bob.to_string()
+        highlight = [
+            "notify", {"set_tweak": "highlight", "value": True},
+        ]
+
+        e1 = yield self.inject_message("one", [(bob, "", ["notify"])])
+        e2 = yield self.inject_message("two", [(bob, "", highlight)])
+        yield self.inject_message("three", [(bob, "", ["notify"])])
+
+        yield self.store.insert_receipt(
+            self.room.to_string(), "m.read", bob, [e1.event_id], {}
+        )
+
+        yield self.store.runInteraction(
+            "remove", self.store._remove_push_actions_for_event_id_txn,
+            self.room.to_string(), e2.event_id,
+        )
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 1, "highlight_count": 0})
+
+        # Actions before the receipt weren't counted, so removing them
+        # doesn't change the counts.
+        yield self.store.runInteraction(
+            "remove", self.store._remove_push_actions_for_event_id_txn,
+            self.room.to_string(), e1.event_id,
+        )
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 1, "highlight_count": 0})
+
+    @defer.inlineCallbacks
+    def test_many_recipients(self):
+        bob = self.u_bob.to_string()
+        others = ["@user%d:test" % (i,) for i in range(20)]
+
+        yield self.inject_message("one", [(bob, "", ["notify"])])
+
+        # Bob's summary is updated and everyone else's is inserted.
+        yield self.inject_message("two", [
+            (user_id, "", ["notify"]) for user_id in [bob] + others
+        ])
+
+        counts = yield self.get_counts()
+        self.assertEquals(counts, {"notify_count": 2, "highlight_count": 0})
+
+        for user_id in others:
+            counts = yield self.store.get_unread_push_counts_for_user(user_id)
+            self.assertEquals(counts, {
+                self.room.to_string(): {"notify_count": 1, "highlight_count": 0},
+            })
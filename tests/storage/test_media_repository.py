@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.types import UserID
+
+from tests.utils import setup_test_homeserver
+
+
+class MediaBlobTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver()
+
+        self.store = hs.get_datastore()
+        self.user = UserID.from_string("@alice:test")
+
+    def store_local_media(self, media_id, sha256):
+        return self.store.store_local_media(
+            media_id=media_id,
+            media_type="image/png",
+            time_now_ms=1000,
+            upload_name=None,
+            media_length=100,
+            user_id=self.user,
+            sha256=sha256,
+        )
+
+    def get_refcount(self, sha256):
+        return self.store._simple_select_one_onecol(
+            table="media_blobs",
+            keyvalues={"sha256": sha256},
+            retcol="refcount",
+            allow_none=True,
+        )
+
+    @defer.inlineCallbacks
+    def test_deduplication(self):
+        blob = yield self.store_local_media("media1", "abcdef")
+        self.assertEquals(blob, ("abcdef", False))
+
+        blob = yield self.store_local_media("media2", "abcdef")
+        self.assertEquals(blob, ("abcdef", True))
+
+        blob = yield self.store.store_cached_remote_media(
+            origin="remote",
+            media_id="media3",
+            media_type="image/png",
+            media_length=100,
+            time_now_ms=1000,
+            upload_name=None,
+            filesystem_id="fsid",
+            sha256="abcdef",
+        )
+        self.assertEquals(blob, ("abcdef", True))
+
+        refcount = yield self.get_refcount("abcdef")
+        self.assertEquals(refcount, 3)
+
+    @defer.inlineCallbacks
+    def test_shared_thumbnails(self):
+        yield self.store_local_media("media1", "abcdef")
+        yield self.store_local_media("media2", "abcdef")
+        yield self.store_local_media("media3", None)
+
+        yield self.store.store_media_blob_thumbnail(
+            "abcdef", 32, 32, "image/png", "scale", 10
+        )
+        yield self.store.store_local_thumbnail(
+            "media3", 64, 64, "image/png", "crop", 20
+        )
+
+        for media_id in ("media1", "media2"):
+            thumbnails = yield self.store.get_local_media_thumbnails(media_id)
+            self.assertEquals(thumbnails, [{
+                "thumbnail_width": 32,
+                "thumbnail_height": 32,
+                "thumbnail_method": "scale",
+                "thumbnail_type": "image/png",
+                "thumbnail_length": 10,
+            }])
+
+        thumbnails = yield self.store.get_local_media_thumbnails("media3")
+        self.assertEquals([t["thumbnail_width"] for t in thumbnails], [64])
+
+    @defer.inlineCallbacks
+    def test_remove_reference(self):
+        yield self.store_local_media("media1", "abcdef")
+        yield self.store_local_media("media2", "abcdef")
+        yield self.store.store_media_blob_thumbnail(
+            "abcdef", 32, 32, "image/png", "scale", 10
+        )
+
+        unused = yield self.store.runInteraction(
+            "remove", self.store._remove_media_blob_reference_txn, "abcdef"
+        )
+        self.assertFalse(unused)
+
+        unused = yield self.store.runInteraction(
+            "remove", self.store._remove_media_blob_reference_txn, "abcdef"
+        )
+        self.assertTrue(unused)
+
+        # The blob is kept until it is marked as being deleted.
+        refcount = yield self.get_refcount("abcdef")
+        self.assertEquals(refcount, 0)
+
+        deleting = yield self.store.mark_media_blobs_deleting(["abcdef"])
+        self.assertEquals(deleting, ["abcdef"])
+        yield self.store.delete_media_blobs(deleting)
+
+        refcount = yield self.get_refcount("abcdef")
+        self.assertIsNone(refcount)
+        thumbnails = yield self.store.get_local_media_thumbnails("media1")
+        self.assertEquals(thumbnails, [])
+
+    @defer.inlineCallbacks
+    def test_reused_before_deletion(self):
+        yield self.store_local_media("media1", "abcdef")
+        unused = yield self.store.runInteraction(
+            "remove", self.store._remove_media_blob_reference_txn, "abcdef"
+        )
+        self.assertTrue(unused)
+
+        # The same content is stored again before the evictor gets round to
+        # deleting the blob, so it must keep it.
+        blob = yield self.store_local_media("media2", "abcdef")
+        self.assertEquals(blob, ("abcdef", True))
+
+        deleting = yield self.store.mark_media_blobs_deleting(["abcdef"])
+        self.assertEquals(deleting, [])
+
+        refcount = yield self.get_refcount("abcdef")
+        self.assertEquals(refcount, 1)
+
+    @defer.inlineCallbacks
+    def test_stored_during_deletion(self):
+        yield self.store_local_media("media1", "abcdef")
+        yield self.store.runInteraction(
+            "remove", self.store._remove_media_blob_reference_txn, "abcdef"
+        )
+        deleting = yield self.store.mark_media_blobs_deleting(["abcdef"])
+        self.assertEquals(deleting, ["abcdef"])
+
+        # The blob's files may be going away, so the content isn't stored in
+        # it.
+        blob = yield self.store_local_media("media2", "abcdef")
+        self.assertEquals(blob, (None, False))
+
+        media = yield self.store.get_local_media("media2")
+        self.assertIsNone(media["sha256"])
+
+        # Blobs that were being deleted are returned again, in case we were
+        # stopped before deleting them.
+        deleting = yield self.store.mark_media_blobs_deleting([])
+        self.assertEquals(deleting, ["abcdef"])
+        yield self.store.delete_media_blobs(deleting)
+
+        blob = yield self.store_local_media("media3", "abcdef")
+        self.assertEquals(blob, ("abcdef", False))
+
+
+class RemoteMediaEvictionTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver()
+
+        self.clock = hs.get_clock()
+        self.store = hs.get_datastore()
+
+    def store_remote_media(self, media_id, sha256=None):
+        return self.store.store_cached_remote_media(
+            origin="remote",
+            media_id=media_id,
+            media_type="image/png",
+            media_length=100,
+            time_now_ms=self.clock.time_msec(),
+            upload_name=None,
+            filesystem_id="fs" + media_id,
+            sha256=sha256,
+        )
+
+    @defer.inlineCallbacks
+    def get_lru_media_ids(self):
+        media = yield self.store.get_least_recently_accessed_remote_media(10)
+        defer.returnValue([m["media_id"] for m in media])
+
+    @defer.inlineCallbacks
+    def test_access_times_are_batched(self):
+        yield self.store_remote_media("media1")
+        self.clock.advance_time(1)
+        yield self.store_remote_media("media2")
+        self.clock.advance_time(1)
+
+        self.store.mark_remote_media_accessed("remote", "media1")
+
+        # Nothing is written until the accesses are flushed.
+        media_ids = yield self.get_lru_media_ids()
+        self.assertEquals(media_ids, ["media1", "media2"])
+
+        yield self.store.flush_remote_media_accesses()
+
+        media_ids = yield self.get_lru_media_ids()
+        self.assertEquals(media_ids, ["media2", "media1"])
+
+    @defer.inlineCallbacks
+    def test_delete_remote_media(self):
+        yield self.store_remote_media("media1", "abcdef")
+        yield self.store_remote_media("media2", "abcdef")
+        yield self.store_remote_media("media3")
+        yield self.store.store_remote_media_thumbnail(
+            "remote", "media3", "fsmedia3", 32, 32, "image/png", "scale", 10
+        )
+
+        size = yield self.store.get_remote_media_cache_size()
+        # The shared blob is only counted once.
+        self.assertEquals(size, 210)
+
+        media = yield self.store.get_least_recently_accessed_remote_media(10)
+        unused_blobs = yield self.store.delete_remote_media(media[:2])
+        self.assertEquals(unused_blobs, ["abcdef"])
+
+        unused_blobs = yield self.store.delete_remote_media(media[2:])
+        self.assertEquals(unused_blobs, [])
+
+        size = yield self.store.get_remote_media_cache_size()
+        self.assertEquals(size, 0)
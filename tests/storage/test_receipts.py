@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from tests.utils import setup_test_homeserver
+
+from mock import Mock
+
+
+class ReceiptsStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+
+        self.store = hs.get_datastore()
+
+    @defer.inlineCallbacks
+    def test_get_last_receipts_for_rooms(self):
+        user_id = "@bob:test"
+
+        for stream_id, room_id in enumerate(("!a:test", "!b:test")):
+            yield self.store.runInteraction(
+                "insert_linearized_receipt",
+                self.store.insert_linearized_receipt_txn,
+                room_id, "m.read", user_id, "$1" + room_id, {}, stream_id,
+            )
+
+        receipts = yield self.store.get_last_receipt_event_ids_for_user_for_rooms(
+            user_id, ["!a:test", "!c:test"], "m.read",
+        )
+        self.assertEquals(receipts, {"!a:test": "$1!a:test", "!c:test": None})
+
+        # The per-room lookups are now answered from the cache.
+        self.store.runInteraction = Mock()
+
+        event_id = yield self.store.get_last_receipt_event_id_for_user(
+            user_id=user_id, room_id="!a:test", receipt_type="m.read",
+        )
+        self.assertEquals(event_id, "$1!a:test")
+
+        event_id = yield self.store.get_last_receipt_event_id_for_user(
+            user_id=user_id, room_id="!c:test", receipt_type="m.read",
+        )
+        self.assertIsNone(event_id)
+
+        self.assertFalse(self.store.runInteraction.called)
@@ -75,6 +75,26 @@ class RegistrationStoreTestCase(unittest.TestCase):
 
         self.assertTrue("token_id" in result)
 
+    @defer.inlineCallbacks
+    def test_delete_access_tokens_invalidates_caches(self):
+        yield self.store.register(self.user_id, self.tokens[0], self.pwhash)
+
+        result = yield self.store.get_user_by_access_token(self.tokens[0])
+        self.assertEquals(result["name"], self.user_id)
+        self.store.access_token_user_info.prefill((self.tokens[0],), {})
+
+        yield self.store.user_delete_access_tokens(self.user_id)
+
+        self.assertIsNone(
+            self.store.access_token_user_info.get((self.tokens[0],), None)
+        )
+
+        result = yield self.store.get_user_by_access_token(self.tokens[0])
+        self.assertIsNone(result)
+
+        # The cache is shared between stores, so don't leave the miss in it.
+        self.store.get_user_by_access_token.invalidate((self.tokens[0],))
+
     @defer.inlineCallbacks
     def test_exchange_refresh_token_valid(self):
         uid = stringutils.random_string(32)
@@ -51,6 +51,51 @@ class RoomStoreTestCase(unittest.TestCase):
             (yield self.store.get_room(self.room.to_string()))
         )
 
+    @defer.inlineCallbacks
+    def test_public_room_summaries(self):
+        room_id = self.room.to_string()
+
+        summaries = yield self.store.get_public_room_summaries()
+        self.assertEquals({room_id: None}, summaries)
+
+        summary = {
+            "room_id": room_id,
+            "aliases": [self.alias.to_string()],
+            "name": u"A room",
+            # This comes from the room_stats, and the room has no members.
+            "num_joined_members": 0,
+            "world_readable": False,
+            "guest_can_join": True,
+        }
+        sequence = self.store.get_public_room_summaries_sequence(room_id)
+        yield self.store.store_public_room_summary(summary, sequence)
+
+        summaries = yield self.store.get_public_room_summaries()
+        self.assertEquals({room_id: summary}, summaries)
+
+        # Adding an alias invalidates the summary...
+        yield self.store.create_room_alias_association(
+            self.alias, room_id, ["test"]
+        )
+        summaries = yield self.store.get_public_room_summaries()
+        self.assertEquals({room_id: None}, summaries)
+
+        # ... and one built before then isn't stored.
+        yield self.store.store_public_room_summary(summary, sequence)
+        summaries = yield self.store.get_public_room_summaries()
+        self.assertEquals({room_id: None}, summaries)
+
+        # Invalidating another room's summary doesn't stop this one being
+        # stored.
+        sequence = self.store.get_public_room_summaries_sequence(room_id)
+        yield self.store.runInteraction(
+            "invalidate", self.store._invalidate_public_room_summary_txn,
+            "!other:test",
+        )
+        yield self.store.store_public_room_summary(summary, sequence)
+        summaries = yield self.store.get_public_room_summaries()
+        self.assertEquals({room_id: summary}, summaries)
+
 
 class RoomEventsStoreTestCase(unittest.TestCase):
 
@@ -158,3 +158,50 @@ class RoomMemberStoreTestCase(unittest.TestCase):
             {"test"},
             (yield self.store.get_joined_hosts_for_room(self.room.to_string()))
         )
+
+    @defer.inlineCallbacks
+    def test_room_stats(self):
+        room_id = self.room.to_string()
+
+        yield self.inject_room_member(self.room, self.u_alice, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_bob, Membership.INVITE)
+        yield self.inject_room_member(self.room, self.u_charlie, Membership.JOIN)
+
+        self.assertEquals(
+            {
+                "joined_members": 2,
+                "invited_members": 1,
+                "left_members": 0,
+                "state_events": 3,
+            },
+            (yield self.store.get_room_stats(room_id))
+        )
+
+        yield self.inject_room_member(self.room, self.u_bob, Membership.JOIN)
+        yield self.inject_room_member(self.room, self.u_charlie, Membership.LEAVE)
+
+        self.assertEquals(
+            {
+                "joined_members": 2,
+                "invited_members": 0,
+                "left_members": 1,
+                "state_events": 3,
+            },
+            (yield self.store.get_room_stats(room_id))
+        )
+
+        # The counts match those recalculated from the current state.
+        yield self.store.runInteraction(
+            "test_room_stats", self.store._recalculate_room_stats_txn, room_id
+        )
+        self.store.get_room_stats.invalidate_all()
+
+        self.assertEquals(
+            {
+                "joined_members": 2,
+                "invited_members": 0,
+                "left_members": 1,
+                "state_events": 3,
+            },
+            (yield self.store.get_room_stats(room_id))
+        )
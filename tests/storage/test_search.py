@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+from twisted.internet import defer
+
+from synapse.api.constants import EventTypes
+from synapse.storage import search
+from synapse.storage.search_index import SearchIndex
+from synapse.types import UserID, RoomID
+
+from tests.utils import setup_test_homeserver
+
+from mock import Mock
+
+import os
+import shutil
+import tempfile
+
+
+class SearchStoreTestCase(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        hs = yield setup_test_homeserver(
+            resource_for_federation=Mock(),
+            http_client=None,
+        )
+
+        self.store = hs.get_datastore()
+        self.event_builder_factory = hs.get_event_builder_factory()
+        self.message_handler = hs.get_handlers().message_handler
+
+        self.u_alice = UserID.from_string("@alice:test")
+        self.room = RoomID.from_string("!abc123:test")
+
+        # Lots of other rooms, so that the search can't just list them all.
+        self.room_ids = set(
+            "!room%d:test" % (i,) for i in range(600)
+        )
+        self.room_ids.add(self.room.to_string())
+
+    @defer.inlineCallbacks
+    def inject_message(self, body):
+        builder = self.event_builder_factory.new({
+            "type": EventTypes.Message,
+            "sender": self.u_alice.to_string(),
+            "room_id": self.room.to_string(),
+            "content": {"body": body, "msgtype": u"message"},
+        })
+
+        event, context = yield self.message_handler._create_new_client_event(
+            builder
+        )
+
+        yield self.store.persist_event(event, context)
+
+        defer.returnValue(event)
+
+    @defer.inlineCallbacks
+    def test_search_in_many_rooms(self):
+        e1 = yield self.inject_message("hello world")
+        e2 = yield self.inject_message("hello again")
+        yield self.inject_message("goodbye")
+
+        result = yield self.store.search_msgs(
+            self.room_ids, "hello", ["content.body"], 10
+        )
+        self.assertEquals(
+            set(r["event"].event_id for r in result["results"]),
+            {e1.event_id, e2.event_id},
+        )
+        self.assertEquals(result["count"], 2)
+
+        result = yield self.store.search_rooms(
+            self.room_ids, "hello", ["content.body"], 10
+        )
+        self.assertEquals(
+            [r["event"].event_id for r in result["results"]],
+            [e2.event_id, e1.event_id],
+        )
+
+        # Rooms the user isn't searching are excluded in the query.
+        result = yield self.store.search_msgs(
+            self.room_ids - {self.room.to_string()}, "hello", ["content.body"], 10
+        )
+        self.assertEquals(result["results"], [])
+        self.assertEquals(result["count"], 0)
+
+    @defer.inlineCallbacks
+    def test_count_is_bounded(self):
+        for i in range(5):
+            yield self.inject_message("hello %d" % (i,))
+
+        old_max_count = search.MAX_SEARCH_RESULT_COUNT
+        search.MAX_SEARCH_RESULT_COUNT = 3
+        try:
+            result = yield self.store.search_rooms(
+                self.room_ids, "hello", ["content.body"], 10
+            )
+        finally:
+            search.MAX_SEARCH_RESULT_COUNT = old_max_count
+
+        self.assertEquals(len(result["results"]), 5)
+        self.assertEquals(result["count"], 3)
+
+    @defer.inlineCallbacks
+    def test_paginate_by_rank(self):
+        for i in range(5):
+            yield self.inject_message("hello %d" % (i,))
+        yield self.inject_message("hello hello")
+
+        event_ids = []
+        pagination_token = None
+        while True:
+            result = yield self.store.search_msgs(
+                self.room_ids, "hello", ["content.body"], 2,
+                pagination_token=pagination_token,
+            )
+            event_ids.extend(r["event"].event_id for r in result["results"])
+            if len(result["results"]) < 2:
+                break
+            pagination_token = result["results"][-1]["pagination_token"]
+
+        result = yield self.store.search_msgs(
+            self.room_ids, "hello", ["content.body"], 10
+        )
+        self.assertEquals(
+            event_ids, [r["event"].event_id for r in result["results"]]
+        )
+        self.assertEquals(len(event_ids), 6)
+
+    @defer.inlineCallbacks
+    def test_get_events_around_many(self):
+        events = []
+        for i in range(5):
+            event = yield self.inject_message("hello %d" % (i,))
+            events.append(event)
+
+        contexts = yield self.store.get_events_around_many(
+            [(self.room.to_string(), events[i].event_id) for i in (1, 3)], 1, 1,
+        )
+
+        for i in (1, 3):
+            context = yield self.store.get_events_around(
+                self.room.to_string(), events[i].event_id, 1, 1,
+            )
+            self.assertEquals(
+                [e.event_id for e in contexts[events[i].event_id]["events_before"]],
+                [events[i - 1].event_id],
+            )
+            self.assertEquals(
+                [e.event_id for e in contexts[events[i].event_id]["events_after"]],
+                [events[i + 1].event_id],
+            )
+            self.assertEquals(
+                contexts[events[i].event_id]["start"], context["start"]
+            )
+            self.assertEquals(contexts[events[i].event_id]["end"], context["end"])
+
+    @defer.inlineCallbacks
+    def test_search_index(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        index = SearchIndex(os.path.join(tmpdir, "search.db"))
+        index.start()
+        self.addCleanup(index.stop)
+        self.store.search_index = index
+
+        e1 = yield self.inject_message("hello world")
+        e2 = yield self.inject_message("hello again")
+        index.flush()
+
+        result = yield self.store.search_rooms(
+            self.room_ids, "hello", ["content.body"], 1
+        )
+        self.assertEquals(
+            [r["event"].event_id for r in result["results"]], [e2.event_id]
+        )
+        self.assertEquals(result["count"], 2)
+
+        result = yield self.store.search_rooms(
+            self.room_ids, "hello", ["content.body"], 1,
+            pagination_token=result["results"][0]["pagination_token"],
+        )
+        self.assertEquals(
+            [r["event"].event_id for r in result["results"]], [e1.event_id]
+        )
+
+    @defer.inlineCallbacks
+    def test_search_index_catches_up(self):
+        e1 = yield self.inject_message("hello world")
+        e2 = yield self.inject_message("hello again")
+
+        # The index was missing the events, e.g. because they were still
+        # queued when we stopped.
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        index = SearchIndex(os.path.join(tmpdir, "search.db"))
+        index.start()
+        self.addCleanup(index.stop)
+        self.store.search_index = index
+
+        old_batch_size = search.SEARCH_INDEX_CATCH_UP_BATCH_SIZE
+        search.SEARCH_INDEX_CATCH_UP_BATCH_SIZE = 1
+        try:
+            yield self.store._catch_up_search_index()
+        finally:
+            search.SEARCH_INDEX_CATCH_UP_BATCH_SIZE = old_batch_size
+        index.flush()
+
+        result = yield self.store.search_rooms(
+            self.room_ids, "hello", ["content.body"], 10
+        )
+        self.assertEquals(
+            [r["event"].event_id for r in result["results"]],
+            [e2.event_id, e1.event_id],
+        )
+        self.assertEquals(
+            index.get_stream_position(), e2.internal_metadata.stream_ordering
+        )
+
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from tests import unittest
+
+from synapse.storage.search_index import SearchIndex
+
+import os
+import shutil
+import tempfile
+
+
+class SearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = SearchIndex(os.path.join(self.tmpdir, "search.db"))
+        self.index.start()
+
+        self.index.add_documents([
+            ("$1:test", "!a:test", "content.body", u"Hello world", 1000, 1),
+            ("$2:test", "!a:test", "content.body", u"hello hello there", 2000, 2),
+            ("$3:test", "!b:test", "content.body", u"Hello worldwide", 3000, 3),
+            ("$4:test", "!a:test", "content.name", u"World news", 4000, 4),
+            # Indexing an event again, e.g. during a reindex, is a no-op.
+            ("$1:test", "!a:test", "content.body", u"Hello world", 1000, 1),
+        ])
+        self.index.flush()
+
+    def tearDown(self):
+        self.index.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def search(self, term, order_by="recent", **kwargs):
+        kwargs.setdefault("room_ids", ["!a:test", "!b:test"])
+        kwargs.setdefault("keys", ["content.body"])
+        kwargs.setdefault("limit", 10)
+        results, count = self.index.search(
+            search_term=term, order_by=order_by, **kwargs
+        )
+        return [r["event_id"] for r in results], count
+
+    def test_terms_match_prefixes(self):
+        self.assertEquals(
+            self.search(u"world"), (["$3:test", "$1:test"], 2)
+        )
+
+    def test_all_terms_must_match(self):
+        self.assertEquals(self.search(u"HELLO there"), (["$2:test"], 1))
+        self.assertEquals(self.search(u"hello missing"), ([], 0))
+
+    def test_filters_rooms_and_keys(self):
+        self.assertEquals(
+            self.search(u"world", room_ids=["!a:test"]), (["$1:test"], 1)
+        )
+        self.assertEquals(
+            self.search(
+                u"world", room_ids=["!a:test"],
+                keys=["content.body", "content.name"],
+            ),
+            (["$4:test", "$1:test"], 2)
+        )
+
+    def test_order_by_rank(self):
+        # The event mentioning hello twice ranks highest.
+        events, count = self.search(u"hello", order_by="rank")
+        self.assertEquals(events[0], "$2:test")
+        self.assertEquals(count, 3)
+
+    def test_paginate(self):
+        results, count = self.index.search(
+            ["!a:test", "!b:test"], u"hello", ["content.body"], 2, "rank",
+        )
+        self.assertEquals(len(results), 2)
+        self.assertEquals(count, 3)
+
+        last = results[-1]
+        more, _ = self.index.search(
+            ["!a:test", "!b:test"], u"hello", ["content.body"], 2, "rank",
+            pagination_key=(last["rank"], last["stream_ordering"]),
+        )
+
+        seen = [r["event_id"] for r in results + more]
+        self.assertEquals(
+            sorted(seen), ["$1:test", "$2:test", "$3:test"]
+        )
+
+    def test_rank_is_independent_of_index(self):
+        results, _ = self.index.search(
+            ["!a:test"], u"hello", ["content.body"], 10, "rank",
+        )
+
+        self.index.add_documents([
+            ("$5:test", "!c:test", "content.body", u"unrelated", 5000, 5),
+        ])
+        self.index.flush()
+
+        # A pagination token with the rank still refers to the same place.
+        more, _ = self.index.search(
+            ["!a:test"], u"hello", ["content.body"], 10, "rank",
+        )
+        self.assertEquals(results, more)
+        self.assertEquals([2.0, 1.0], [r["rank"] for r in results])
+
+    def test_many_rooms(self):
+        room_ids = ["!room%d:test" % (i,) for i in range(600)]
+        self.assertEquals(
+            self.search(u"world", room_ids=room_ids + ["!a:test"]),
+            (["$1:test"], 1)
+        )
+
+    def test_stream_position(self):
+        self.assertEquals(self.index.get_stream_position(), 4)
+
+        # Backfilled events don't move the position backwards.
+        self.index.add_documents([
+            ("$5:test", "!a:test", "content.body", u"old", 500, -1),
+        ])
+        self.index.flush()
+        self.assertEquals(self.index.get_stream_position(), 4)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright 2016 OpenMarket Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from tests import unittest
+from tests.utils import MockClock
+
+from synapse.notifier import Notifier, _NotifierUserStream
+from synapse.types import StreamToken
+
+from mock import Mock, patch
+
+
+class NotifierTestCase(unittest.TestCase):
+    ROOM_ID = "!room:test"
+
+    def setUp(self):
+        self.clock = MockClock()
+
+        hs = Mock()
+        hs.get_clock.return_value = self.clock
+
+        self.notifier = Notifier(hs)
+
+    def add_user_streams(self, count):
+        user_streams = []
+        for i in xrange(count):
+            user_stream = _NotifierUserStream(
+                user_id="@user%d:test" % (i,),
+                rooms=[self.ROOM_ID],
+                current_token=StreamToken("s0", "0", "0", "0", "0"),
+                time_now_ms=self.clock.time_msec(),
+            )
+            self.notifier._register_with_keys(user_stream)
+            user_streams.append(user_stream)
+        return user_streams
+
+    def test_wakeups_are_coalesced(self):
+        user_stream, = self.add_user_streams(1)
+
+        results = []
+        listener = user_stream.new_listener(user_stream.current_token)
+        listener.deferred.addCallback(results.append)
+
+        self.notifier.on_new_event("room_key", 1, rooms=[self.ROOM_ID])
+        self.notifier.on_new_event("room_key", 3, rooms=[self.ROOM_ID])
+        self.notifier.on_new_event("room_key", 2, rooms=[self.ROOM_ID])
+        self.notifier.on_new_event("typing_key", 5, users=["@user0:test"])
+
+        # Nothing is woken until the end of the reactor tick.
+        self.assertEquals(results, [])
+
+        self.clock.advance_time(0)
+
+        self.assertEquals(len(results), 1)
+        self.assertEquals(results[0].room_key, 3)
+        self.assertEquals(results[0].typing_key, 5)
+        self.assertEquals(user_stream.current_token.room_key, 3)
+
+    def test_burst_wakes_each_listener_once(self):
+        num_streams = 50
+        num_events = 20
+
+        user_streams = self.add_user_streams(num_streams)
+
+        # Keep a listener on every stream, re-registering after each wake up
+        # as a client would.
+        wakeups = [0]
+
+        def listen(_, user_stream):
+            wakeups[0] += 1
+            d = user_stream.notify_deferred.observe()
+            d.addCallback(listen, user_stream)
+
+        for user_stream in user_streams:
+            d = user_stream.notify_deferred.observe()
+            d.addCallback(listen, user_stream)
+
+        fan_outs = [0]
+        notify_many = _NotifierUserStream.notify_many
+
+        def count_notify_many(user_stream, *args):
+            fan_outs[0] += 1
+            return notify_many(user_stream, *args)
+
+        with patch.object(_NotifierUserStream, "notify_many", count_notify_many):
+            for stream_id in xrange(1, num_events + 1):
+                self.notifier.on_new_event(
+                    "room_key", stream_id, rooms=[self.ROOM_ID]
+                )
+
+            # The whole burst is delivered by a single scheduled wake up.
+            self.assertEquals(len(self.clock.timers), 1)
+            self.assertEquals(wakeups[0], 0)
+
+            self.clock.advance_time(0)
+
+        self.assertEquals(fan_outs[0], num_streams)
+        self.assertEquals(wakeups[0], num_streams)
+        for user_stream in user_streams:
+            self.assertEquals(user_stream.current_token.room_key, num_events)
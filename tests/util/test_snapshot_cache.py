@@ -19,6 +19,7 @@ from .. import unittest
 from synapse.util.caches.snapshot_cache import SnapshotCache
 from twisted.internet.defer import Deferred
 
+
 class SnapshotCacheTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -58,3 +59,17 @@ class SnapshotCacheTestCase(unittest.TestCase):
         # after the cache expires returns None
         get_result_at_12 = self.cache.get(12, "key")
         self.assertIsNone(get_result_at_12)
+
+    def test_failures_not_cached(self):
+        d = Deferred()
+        set_result = self.cache.set(0, "key", d)
+
+        # Requests made while the deferred is pending see its failure.
+        get_result = self.cache.get(0, "key")
+
+        d.errback(Exception("Failed"))
+        self.assertFailure(set_result, Exception)
+        self.assertFailure(get_result, Exception)
+
+        # But later requests try again.
+        self.assertIsNone(self.cache.get(0, "key"))
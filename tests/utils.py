@@ -17,6 +17,7 @@ from synapse.http.server import HttpServer
 from synapse.api.errors import cs_error, CodeMessageException, StoreError
 from synapse.api.constants import EventTypes
 from synapse.storage.prepare_database import prepare_database
+from synapse.storage.engines.sqlite3 import _rank
 from synapse.storage.engines import create_engine
 from synapse.server import HomeServer
 from synapse.federation.transport import server
@@ -26,10 +27,14 @@ from synapse.util.logcontext import LoggingContext
 
 from twisted.internet import defer, reactor
 from twisted.enterprise.adbapi import ConnectionPool
+from twisted.web.test.requesthelper import DummyRequest
 
 from collections import namedtuple
 from mock import patch, Mock
+from StringIO import StringIO
+import contextlib
 import hashlib
+import json
 import urllib
 import urlparse
 
@@ -46,10 +51,16 @@ def setup_test_homeserver(name="test", datastore=None, config=None, **kargs):
         config = Mock()
         config.signing_key = [MockKey()]
         config.event_cache_size = 1
+        config.search_index_path = None
+        config.rc_joins_per_second = 10000
+        config.rc_join_burst_count = 10000
+        config.rc_registrations_per_second = 10000
+        config.rc_registration_burst_count = 10000
         config.enable_registration = True
         config.macaroon_secret_key = "not even a little secret"
         config.server_name = "server.under.test"
         config.trusted_third_party_id_servers = []
+        config.profile_sql_statements = False
 
     if "clock" not in kargs:
         kargs["clock"] = MockClock()
@@ -194,6 +205,42 @@ class MockHttpResource(HttpServer):
             self.callbacks.append((method, path_pattern, callback))
 
 
+class MockRequest(DummyRequest):
+    """A request for testing resources that render requests themselves,
+    rather than registering servlets with a JsonResource.
+    """
+    _disconnected = False
+
+    def __init__(self, method, postpath, content="", headers={}):
+        DummyRequest.__init__(self, postpath)
+        self.method = method
+        self.path = "/" + "/".join(postpath)
+        self.content = StringIO(content)
+        for name, value in headers.items():
+            self.requestHeaders.setRawHeaders(name, [value])
+
+    @contextlib.contextmanager
+    def processing(self):
+        yield
+
+    def render_and_wait(self, resource):
+        """Render the request and wait for the response to finish.
+
+        Returns:
+            Deferred: Resolves once the response has been written.
+        """
+        d = self.notifyFinish()
+        self.render(resource)
+        return d
+
+    @property
+    def body(self):
+        return "".join(self.written)
+
+    def json_body(self):
+        return json.loads(self.body)
+
+
 class MockKey(object):
     alg = "mock_alg"
     version = "mock_version"
@@ -279,9 +326,14 @@ class SQLiteMemoryDbPool(ConnectionPool, object):
 
     def prepare(self):
         engine = create_engine("sqlite3")
-        return self.runWithConnection(
-            lambda conn: prepare_database(conn, engine)
-        )
+
+        def prepare_conn(conn):
+            prepare_database(conn, engine)
+            # The full text search ranking function, which the engine adds to
+            # every new connection.
+            conn.create_function("rank", 1, _rank)
+
+        return self.runWithConnection(prepare_conn)
 
     def get_db_conn(self):
         conn = self.connect()
@@ -423,7 +475,7 @@ class MemoryDataStore(object):
         return defer.succeed((5, 5, 5))
 
     def insert_client_ip(self, user, access_token, ip, user_agent):
-        return defer.succeed(None)
+        pass
 
 
 def _format_call(args, kwargs):